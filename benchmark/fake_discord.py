@@ -0,0 +1,92 @@
+"""模擬的Discord頻道與指令context，只實作cog實際用到的介面，並記錄送出的訊息數量與延遲"""
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+class FakeDiscord:
+    """所有模擬物件共用的狀態：REST請求延遲與呼叫次數"""
+    def __init__(self, latency: float = 0.05) -> None:
+        """
+        :param latency: 每次Discord REST請求(送出、編輯、刪除訊息)的延遲秒數
+        """
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def rest(self, route: str) -> None:
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+
+class FakeMessage:
+    def __init__(self, discord: FakeDiscord, channel: 'FakeChannel', content: str = None, embed=None) -> None:
+        self.__discord = discord
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+
+    async def delete(self, **kwargs) -> None:
+        await self.__discord.rest('delete_message')
+
+    async def edit(self, content: str = None, embed=None, **kwargs) -> None:
+        await self.__discord.rest('edit_message')
+        self.content, self.embed = content, embed
+
+class FakeChannel:
+    def __init__(self, discord: FakeDiscord, channel_id: int, guild_id: int = 0) -> None:
+        self.__discord = discord
+        self.id = channel_id
+        self.guild = SimpleNamespace(id=guild_id)
+        self.sent = 0
+
+    async def send(self, content: str = None, embed=None, **kwargs) -> FakeMessage:
+        await self.__discord.rest('send_message')
+        self.sent += 1
+        return FakeMessage(self.__discord, self, content, embed)
+
+    def typing(self) -> 'FakeTyping':
+        return FakeTyping(self.__discord)
+
+class FakeTyping:
+    def __init__(self, discord: FakeDiscord) -> None:
+        self.__discord = discord
+
+    async def __aenter__(self) -> None:
+        await self.__discord.rest('trigger_typing')
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+class FakeBot:
+    """提供cog需要的get_channel與wait_until_ready"""
+    def __init__(self, discord: FakeDiscord, channels: Dict[int, FakeChannel]) -> None:
+        self.discord = discord
+        self.channels = channels
+        self.guilds = []
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    async def wait_until_ready(self) -> None:
+        pass
+
+class FakeContext:
+    """指令的context，reply與send都送到同一個模擬頻道"""
+    def __init__(self, discord: FakeDiscord, channel: FakeChannel, user_id: int) -> None:
+        self.__discord = discord
+        self.channel = channel
+        self.author = SimpleNamespace(id=user_id)
+        self.guild = channel.guild
+        self.me = SimpleNamespace(guild_permissions=SimpleNamespace(manage_messages=True))
+        self.message = FakeMessage(discord, channel)
+
+    async def send(self, content: str = None, embed=None, **kwargs) -> FakeMessage:
+        return await self.channel.send(content, embed=embed)
+
+    async def reply(self, content: str = None, embed=None, **kwargs) -> FakeMessage:
+        return await self.channel.send(content, embed=embed)
+
+    def typing(self) -> FakeTyping:
+        return self.channel.typing()
+
+    async def trigger_typing(self) -> None:
+        await self.__discord.rest('trigger_typing')
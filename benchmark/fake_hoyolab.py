@@ -0,0 +1,191 @@
+"""本機模擬的HoYoLAB伺服器，提供即時便箋、札記、深淵、簽到、兌換碼與帳號列表的API
+
+回傳資料的格式與官方API相同，genshin.py可以直接解析；
+透過patchGenshinClient()把genshin.py的所有請求改送到本機伺服器
+"""
+import time
+import random
+import asyncio
+import genshin
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+from aiohttp import web
+from yarl import URL
+
+CHARACTER_IDS = [10000002, 10000003, 10000006, 10000014, 10000015, 10000016, 10000020, 10000021, 10000022, 10000023]
+RESIN_RECOVERY_SECONDS = 8 * 60
+
+def _characterIcon(character_id: int, side: bool = False) -> str:
+    name = genshin.constants.CHARACTER_NAMES[character_id].icon_name
+    folder = 'character_side_icon/UI_AvatarIcon_Side' if side else 'character_icon/UI_AvatarIcon'
+    return f'https://upload-os-bbs.mihoyo.com/game_record/genshin/{folder}_{name}.png'
+
+class FakeHoyolabServer:
+    """模擬HoYoLAB API的aiohttp伺服器"""
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, seed: int = 0) -> None:
+        """
+        :param latency: 每個請求的平均延遲秒數，實際延遲在0.5~1.5倍之間隨機
+        :param error_rate: 回傳暫時性錯誤(retcode -110，請求過於頻繁)的機率
+        :param seed: 亂數種子，讓每次產生的資料一致
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.__random = random.Random(seed)
+        self.__claimed = set()
+        self.__runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    async def start(self, host: str = 'localhost', port: int = 0) -> None:
+        app = web.Application()
+        app.router.add_get('/game_record/genshin/api/dailyNote', self.__notes)
+        app.router.add_get('/game_record/genshin/api/spiralAbyss', self.__abyss)
+        app.router.add_get('/event/ysledgeros/month_info', self.__diary)
+        app.router.add_post('/event/sol/sign', self.__sign)
+        app.router.add_get('/event/sol/info', self.__rewardInfo)
+        app.router.add_get('/event/sol/home', self.__monthlyRewards)
+        app.router.add_get('/common/apicdkey/api/webExchangeCdkey', self.__redeem)
+        app.router.add_get('/binding/api/getUserGameRolesByCookie', self.__accounts)
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+
+    def patchGenshinClient(self) -> None:
+        """將genshin.py送出的所有請求改為送到本機伺服器，保留原本的路徑與參數"""
+        original_request = genshin.GenshinClient.request
+        # 使用主機名稱而不是IP，aiohttp的cookie jar不會把cookie送給IP位址
+        base = URL(f'http://localhost:{self.port}')
+        # 略過多語系字串的下載，避免每個client都去請求官方的靜態資源
+        genshin.GenshinClient.fetched_mi18n = True
+
+        async def request(client, url, method='GET', **kwargs):
+            url = URL(url)
+            return await original_request(client, base.with_path(url.path).with_query(url.query), method, **kwargs)
+        genshin.GenshinClient.request = request
+
+    async def __respond(self, request: web.Request, data: Any, retcode: int = 0, message: str = 'OK', on_success: Callable[[], None] = None) -> web.Response:
+        self.calls[request.path] += 1
+        await asyncio.sleep(self.latency * (0.5 + self.__random.random()))
+        if retcode == 0 and self.__random.random() < self.error_rate:
+            self.errors[request.path] += 1
+            retcode, message, data = -110, 'visit too frequently', None
+        elif retcode == 0 and on_success is not None:
+            on_success()
+        return web.json_response({'retcode': retcode, 'message': message, 'data': data})
+
+    async def __notes(self, request: web.Request) -> web.Response:
+        uid = int(request.query['role_id'])
+        rnd = random.Random(uid ^ int(time.time() // 3600))
+        current_resin = rnd.randint(0, 160)
+        expeditions = [{
+            'avatar_side_icon': _characterIcon(rnd.choice(CHARACTER_IDS), side=True),
+            'status': 'Ongoing',
+            'remained_time': str(rnd.randint(0, 20 * 3600))
+        } for _ in range(5)]
+        return await self.__respond(request, {
+            'current_resin': current_resin,
+            'max_resin': 160,
+            'resin_recovery_time': str((160 - current_resin) * RESIN_RECOVERY_SECONDS),
+            'current_home_coin': rnd.randint(0, 2400),
+            'max_home_coin': 2400,
+            'home_coin_recovery_time': str(rnd.randint(0, 72 * 3600)),
+            'finished_task_num': rnd.randint(0, 4),
+            'total_task_num': 4,
+            'is_extra_task_reward_received': False,
+            'remain_resin_discount_num': rnd.randint(0, 3),
+            'resin_discount_num_limit': 3,
+            'expeditions': expeditions,
+            'max_expedition_num': 5
+        })
+
+    async def __abyss(self, request: web.Request) -> web.Response:
+        uid = int(request.query['role_id'])
+        previous = request.query.get('schedule_type') == '2'
+        rnd = random.Random(uid * 2 + previous)
+        now = int(time.time())
+        floors = []
+        for floor in range(9, 13):
+            chambers = [{
+                'index': chamber,
+                'star': rnd.randint(1, 3),
+                'max_star': 3,
+                'battles': [{
+                    'index': half,
+                    'timestamp': str(now),
+                    'avatars': [
+                        {'id': c, 'icon': _characterIcon(c), 'level': 90, 'rarity': 5}
+                        for c in rnd.sample(CHARACTER_IDS, 4)
+                    ]
+                } for half in (1, 2)]
+            } for chamber in (1, 2, 3)]
+            floors.append({
+                'index': floor, 'is_unlock': True, 'max_star': 9,
+                'star': sum(c['star'] for c in chambers), 'levels': chambers
+            })
+        return await self.__respond(request, {
+            'schedule_id': 40 - previous,
+            'start_time': str(now - 86400 * (16 + 16 * previous)),
+            'end_time': str(now - 86400 * 16 * previous),
+            'total_battle_times': rnd.randint(12, 30),
+            'total_win_times': '12',
+            'max_floor': '12-3',
+            'total_star': sum(f['star'] for f in floors),
+            'is_unlock': True,
+            'reveal_rank': [], 'defeat_rank': [], 'damage_rank': [],
+            'take_damage_rank': [], 'energy_skill_rank': [], 'normal_skill_rank': [],
+            'floors': floors
+        })
+
+    async def __diary(self, request: web.Request) -> web.Response:
+        uid = int(request.query['uid'])
+        month = int(request.query['month'])
+        rnd = random.Random(uid * 13 + month)
+        categories = ['每日活躍', '冒險獎勵', '任務獎勵', '深境螺旋', '活動獎勵', '郵件獎勵', '其他']
+        return await self.__respond(request, {
+            'uid': uid, 'region': request.query.get('region', 'os_asia'), 'nickname': f'旅行者{uid % 10000}',
+            'data_month': month,
+            'month_data': {
+                'current_primogems': rnd.randint(0, 20000), 'current_mora': rnd.randint(0, 5000000),
+                'last_primogems': rnd.randint(0, 20000), 'last_mora': rnd.randint(0, 5000000),
+                'primogem_rate': rnd.randint(-100, 100), 'mora_rate': rnd.randint(-100, 100),
+                'group_by': [
+                    {'action_id': i, 'action': name, 'num': rnd.randint(0, 3000), 'percent': rnd.randint(0, 40)}
+                    for i, name in enumerate(categories)
+                ]
+            },
+            'day_data': {'current_primogems': rnd.randint(0, 300), 'current_mora': rnd.randint(0, 100000)}
+        })
+
+    async def __sign(self, request: web.Request) -> web.Response:
+        account = request.cookies.get('ltuid')
+        if account in self.__claimed:
+            return await self.__respond(request, None, -5003, 'Traveler, you\'ve already checked in today~')
+        return await self.__respond(request, {'code': 'ok'}, on_success=lambda: self.__claimed.add(account))
+
+    async def __rewardInfo(self, request: web.Request) -> web.Response:
+        return await self.__respond(request, {'is_sign': True, 'total_sign_day': 1})
+
+    async def __monthlyRewards(self, request: web.Request) -> web.Response:
+        return await self.__respond(request, {'awards': [{'name': '原石', 'cnt': 20, 'icon': ''}] * 31})
+
+    async def __redeem(self, request: web.Request) -> web.Response:
+        if request.query.get('cdkey', '').startswith('EXPIRED'):
+            return await self.__respond(request, None, -2001, 'Redemption code has expired.')
+        return await self.__respond(request, None)
+
+    async def __accounts(self, request: web.Request) -> web.Response:
+        ltuid = int(request.cookies.get('ltuid', '1'))
+        return await self.__respond(request, {'list': [{
+            'game_uid': str(800000000 + ltuid % 100000000), 'level': 60, 'nickname': f'旅行者{ltuid % 10000}',
+            'region': 'os_asia', 'region_name': 'Asia Server', 'game_biz': 'hk4e_global', 'is_chosen': False, 'is_official': True
+        }]})
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {'calls': dict(self.calls), 'errors': dict(self.errors)}
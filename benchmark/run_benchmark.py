@@ -0,0 +1,216 @@
+"""離線效能測試：以本機模擬的HoYoLAB伺服器與Discord頻道，量測指令延遲、自動化排程耗時、上游請求數量與記憶體用量
+
+使用方式(在專案根目錄執行)：
+    python -m benchmark.run_benchmark --users 10000 --output bench.json
+    python -m benchmark.run_benchmark --users 10000 --baseline bench.json   # 與先前的結果比較
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from benchmark.fake_hoyolab import FakeHoyolabServer
+from benchmark.fake_discord import FakeDiscord, FakeChannel, FakeContext, FakeBot
+from benchmark.synthetic_data import writeSyntheticData, channelId, guildId
+
+def percentile(values: List[float], p: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def measureCommand(name: str, invoke: Callable[[str], Awaitable[Any]], user_ids: List[str], count: int, concurrency: int) -> Dict[str, float]:
+    """以concurrency個並行的使用者重複呼叫指令count次，回傳延遲統計(毫秒)"""
+    latencies: List[float] = []
+    queue = [random.choice(user_ids) for _ in range(count)]
+
+    async def worker():
+        while len(queue) > 0:
+            user_id = queue.pop()
+            start = time.perf_counter()
+            await invoke(user_id)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        'count': count,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / max(len(latencies), 1),
+        'throughput_per_s': count / elapsed if elapsed > 0 else 0.0
+    }
+
+async def runBenchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    report: Dict[str, Any] = {'config': vars(args).copy()}
+    server = FakeHoyolabServer(latency=args.hoyolab_latency, error_rate=args.error_rate, seed=args.seed)
+    await server.start()
+    server.patchGenshinClient()
+    discord = FakeDiscord(latency=args.discord_latency)
+
+    # 載入使用者資料(包含第一次啟動時由JSON匯入SQLite)
+    start = time.perf_counter()
+    from utility.GenshinApp import genshin_app
+    await genshin_app.waitUntilLoaded()
+    report['startup_s'] = time.perf_counter() - start
+
+    from cogs.genshin_info import GenshinInfo
+    from cogs.genshin_tool import GenshinTool
+    import cogs.schedule as schedule_module
+
+    channels: Dict[int, FakeChannel] = { }
+    for i in range(args.users):
+        channel_id = channelId(i, args.users_per_channel)
+        if channel_id not in channels:
+            channels[channel_id] = FakeChannel(discord, channel_id, guildId(channel_id))
+    bot = FakeBot(discord, channels)
+    info_cog = GenshinInfo(bot)
+    tool_cog = GenshinTool(bot)
+    schedule_cog = schedule_module.Schedule(bot)
+    # 排程改為手動觸發，避免與指令量測同時執行
+    schedule_cog.job_schedule.cancel()
+    schedule_cog.resin_schedule.cancel()
+    schedule_cog.cookie_schedule.cancel()
+
+    def context(user_id: str) -> FakeContext:
+        return FakeContext(discord, channels[channelId(int(user_id) - 400000000000000000, args.users_per_channel)], int(user_id))
+
+    user_ids = args.user_ids
+    commands = {
+        'g': lambda user_id: info_cog.g.callback(info_cog, context(user_id)),
+        'abyss': lambda user_id: info_cog.abyss.callback(info_cog, context(user_id)),
+        'abyss rank': lambda user_id: info_cog.abyss.callback(info_cog, context(user_id), 'rank'),
+        'diary': lambda user_id: info_cog.diary.callback(info_cog, context(user_id)),
+        'd': lambda user_id: tool_cog.d.callback(tool_cog, context(user_id)),
+        'r': lambda user_id: tool_cog.r.callback(tool_cog, context(user_id), 'GENSHINGIFT'),
+    }
+    report['commands'] = { }
+    for name, invoke in commands.items():
+        report['commands'][name] = await measureCommand(name, invoke, user_ids, args.commands, args.concurrency)
+
+    # 模擬每日簽到時間，執行一次完整的自動化排程(每日簽到+樹脂檢查)
+    class ScheduleDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz).replace(hour=int(os.environ['AUTO_DAILY_REWARD_TIME']), minute=0)
+    schedule_module.datetime = ScheduleDatetime
+    calls_before = sum(server.calls.values())
+    start = time.perf_counter()
+    await schedule_cog.before_job_schedule()
+    await schedule_cog.before_resin_schedule()
+    await schedule_cog.job_schedule.coro(schedule_cog)
+    await schedule_cog.resin_schedule.coro(schedule_cog)
+    await schedule_cog.waitForJobs()
+    report['schedule'] = {
+        'wall_time_s': time.perf_counter() - start,
+        'upstream_calls': sum(server.calls.values()) - calls_before,
+        'daily_subscribers': args.daily_count,
+        'resin_subscribers': args.resin_count
+    }
+
+    report['upstream'] = server.stats()
+    report['discord'] = dict(discord.calls)
+    await genshin_app.close()
+    await server.stop()
+    return report
+
+def printReport(report: Dict[str, Any], baseline: Dict[str, Any] = None) -> None:
+    def delta(value: float, base: float) -> str:
+        if base is None or base == 0:
+            return ''
+        return f' ({(value - base) / base * 100:+.1f}%)'
+
+    base_commands = (baseline or {}).get('commands', { })
+    print(f'{"指令":<12}{"p50(ms)":>20}{"p99(ms)":>20}{"吞吐量(/s)":>20}')
+    for name, stat in report['commands'].items():
+        base = base_commands.get(name, { })
+        print(f'{name:<12}'
+            f'{stat["p50_ms"]:>10.1f}{delta(stat["p50_ms"], base.get("p50_ms")):>10}'
+            f'{stat["p99_ms"]:>10.1f}{delta(stat["p99_ms"], base.get("p99_ms")):>10}'
+            f'{stat["throughput_per_s"]:>10.1f}{delta(stat["throughput_per_s"], base.get("throughput_per_s")):>10}')
+    schedule = report['schedule']
+    base_schedule = (baseline or {}).get('schedule', { })
+    print(f'排程耗時：{schedule["wall_time_s"]:.1f} 秒{delta(schedule["wall_time_s"], base_schedule.get("wall_time_s"))}'
+        f'，上游請求 {schedule["upstream_calls"]} 次{delta(schedule["upstream_calls"], base_schedule.get("upstream_calls"))}'
+        f'(簽到 {schedule["daily_subscribers"]} 人、樹脂 {schedule["resin_subscribers"]} 人)')
+    print(f'啟動載入使用者資料：{report["startup_s"]:.2f} 秒{delta(report["startup_s"], (baseline or {}).get("startup_s"))}')
+    print('上游請求次數：')
+    for path, count in sorted(report['upstream']['calls'].items()):
+        print(f'  {path:<45}{count:>8}  錯誤 {report["upstream"]["errors"].get(path, 0)}')
+    print(f'Discord請求次數：{report["discord"]}')
+    print(f'記憶體峰值：RSS {report["peak_rss_mb"]:.1f} MB{delta(report["peak_rss_mb"], (baseline or {}).get("peak_rss_mb"))}', end='')
+    if report.get('peak_traced_mb') is not None:
+        print(f'，Python配置 {report["peak_traced_mb"]:.1f} MB', end='')
+    print()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='原神小幫手離線效能測試')
+    parser.add_argument('--users', type=int, default=10000, help='模擬的使用者數量')
+    parser.add_argument('--users-per-channel', type=int, default=20, help='每個頻道的使用者數量')
+    parser.add_argument('--commands', type=int, default=500, help='每種指令的呼叫次數')
+    parser.add_argument('--concurrency', type=int, default=50, help='同時呼叫指令的使用者數量')
+    parser.add_argument('--hoyolab-latency', type=float, default=0.05, help='HoYoLAB API平均延遲(秒)')
+    parser.add_argument('--discord-latency', type=float, default=0.05, help='Discord REST請求延遲(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='HoYoLAB回傳暫時性錯誤的機率')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true', help='追蹤Python記憶體配置峰值(會拖慢執行速度)')
+    parser.add_argument('--workdir', help='產生模擬資料的目錄，預設為暫存目錄')
+    parser.add_argument('--output', help='將結果寫入JSON檔案')
+    parser.add_argument('--baseline', help='與先前輸出的JSON結果比較')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # 機器人使用相對路徑data/，因此切換到模擬資料的目錄執行
+    workdir = args.workdir or tempfile.mkdtemp(prefix='genshin_bench_')
+    subscribers = writeSyntheticData(os.path.join(workdir, 'data'), args.users, users_per_channel=args.users_per_channel, seed=args.seed)
+    os.chdir(workdir)
+    args.user_ids = subscribers['users']
+    args.daily_count = len(subscribers['daily'])
+    args.resin_count = len(subscribers['resin'])
+    for key, value in {
+        'BOT_PREFIX': '%',
+        'AUTO_DAILY_REWARD_TIME': str(datetime.now().hour),
+        'AUTO_CHECK_RESIN_THRESHOLD': '150',
+        'AUTO_DAILY_REWARD_RPS': '1000',
+        'AUTO_DAILY_REWARD_REGION_RPS': '1000',
+        'AUTO_CHECK_RESIN_RPS': '1000',
+        'AUTO_DAILY_REWARD_CONCURRENCY': '50',
+        'UPSTREAM_RPS': '1000',
+    }.items():
+        os.environ.setdefault(key, value)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    # discord.py的tasks.loop綁定匯入當下的event loop，因此使用預設的loop執行
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(runBenchmark(args))
+    report['config'].pop('user_ids', None)
+    report['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024 if args.tracemalloc else None
+
+    printReport(report, baseline)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
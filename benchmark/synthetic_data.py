@@ -0,0 +1,43 @@
+"""產生模擬的使用者資料與自動化訂閱檔案(data/user_data.json、data/schedule_*.json)"""
+import os
+import json
+import random
+from typing import Dict, List
+
+def userId(i: int) -> str:
+    return str(400000000000000000 + i)
+
+def ltuid(i: int) -> int:
+    return 100000 + i
+
+def gameUid(i: int) -> str:
+    # 與FakeHoyolabServer帳號列表API回傳的UID對應
+    return str(800000000 + ltuid(i) % 100000000)
+
+def cookie(i: int) -> str:
+    token = f'{i:020d}'.replace('0', 'a')
+    return f'ltoken={token}x ltuid={ltuid(i)} cookie_token={token}y account_id={ltuid(i)}'
+
+def channelId(i: int, users_per_channel: int) -> int:
+    return 900000000000000000 + i // users_per_channel
+
+def guildId(channel_id: int, channels_per_guild: int = 3) -> int:
+    return 700000000000000000 + (channel_id - 900000000000000000) // channels_per_guild
+
+def writeSyntheticData(data_dir: str, users: int, *, daily_ratio: float = 0.5, resin_ratio: float = 0.5, users_per_channel: int = 20, seed: int = 0) -> Dict[str, List[str]]:
+    """產生users位使用者的資料，並依比例訂閱每日簽到與樹脂提醒
+    :return: {'users': 全部使用者ID, 'daily': 訂閱每日簽到的使用者ID, 'resin': 訂閱樹脂提醒的使用者ID}
+    """
+    rnd = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    user_data = {userId(i): {'cookie': cookie(i), 'uid': gameUid(i)} for i in range(users)}
+    daily = {userId(i): {'channel': str(channelId(i, users_per_channel))} for i in range(users) if rnd.random() < daily_ratio}
+    resin = {userId(i): {'channel': str(channelId(i, users_per_channel))} for i in range(users) if rnd.random() < resin_ratio}
+    for filename, data in (
+        ('user_data.json', user_data),
+        ('schedule_daily_reward.json', daily),
+        ('schedule_resin_notification.json', resin)
+    ):
+        with open(os.path.join(data_dir, filename), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    return {'users': list(user_data.keys()), 'daily': list(daily.keys()), 'resin': list(resin.keys())}
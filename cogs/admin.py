@@ -1,29 +1,159 @@
+import json
+import asyncio
 import discord
 from discord.ext import commands
-from typing import Optional, Literal
+from typing import Dict, Optional, Literal
 from utility.utils import log
+from utility.RateLimiter import TokenBucket, runRateLimited
+from utility.WriteBehind import WriteBehindJsonFile
+import os
 
 class Admin(commands.Cog):
     def __init__(self, bot):
         self.bot: commands.Bot = bot
-    
+        # 每個伺服器第一個可以發送訊息的頻道，權限或頻道變動時失效
+        self.__channel_cache: Dict[int, Optional[int]] = { }
+        self.__broadcast_concurrency = int(os.getenv('BROADCAST_CONCURRENCY', 10))
+        self.__broadcast_bucket = TokenBucket(float(os.getenv('BROADCAST_RPS', 20)))
+        self.__broadcast_task: Optional[asyncio.Task] = None
+        # 廣播進度，重新啟動後從還沒送出的伺服器繼續
+        self.__broadcast_filename = 'data/broadcast_job.json'
+        try:
+            with open(self.__broadcast_filename, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except:
+            job = { }
+        self.__broadcast_file = WriteBehindJsonFile(self.__broadcast_filename, job)
+        if job.get('pending'):
+            self.__broadcast_task = asyncio.ensure_future(self.__resumeBroadcast())
+
+    def cog_unload(self):
+        if self.__broadcast_task is not None:
+            self.__broadcast_task.cancel()
+        self.__broadcast_file.flushSync()
+
     # 廣播訊息到所有的伺服器
     @commands.command(hidden=True)
     @commands.is_owner()
     async def broadcast(self, ctx: commands.Context, *msg):
         msg = ' '.join(msg)
         log.info(msg)
-        for guild in self.bot.guilds:
-            # 找出第一個可用的頻道發出訊息
-            for channel in guild.text_channels:
-                if channel.permissions_for(guild.me).send_messages:
-                    try:
-                        await channel.send(msg)
-                    except Exception as e:
-                        log.error(f'{guild}: {e}')
-                        continue
-                    else:
-                        break
+        if self.__broadcast_task is not None and not self.__broadcast_task.done():
+            await ctx.reply('已有廣播正在進行中，請等待完成或使用 broadcast_cancel 取消')
+            return
+        job = self.__broadcast_file.data
+        job.clear()
+        job.update({
+            'message': msg,
+            'report_channel': ctx.channel.id,
+            'pending': [guild.id for guild in self.bot.guilds],
+            'delivered': 0,
+            'failed': 0
+        })
+        self.__broadcast_file.markDirty()
+        self.__broadcast_task = asyncio.ensure_future(self.__runBroadcast())
+        await ctx.reply(f'開始廣播到 {len(job["pending"])} 個伺服器，完成後會在此頻道回報結果')
+
+    # 取消進行中的廣播
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def broadcast_cancel(self, ctx: commands.Context):
+        if self.__broadcast_task is None or self.__broadcast_task.done():
+            await ctx.reply('目前沒有進行中的廣播')
+            return
+        self.__broadcast_task.cancel()
+        job = self.__broadcast_file.data
+        await ctx.reply(f'已取消廣播，成功 {job.get("delivered", 0)}，失敗 {job.get("failed", 0)}，未送出 {len(job.get("pending", []))}')
+        job.clear()
+        self.__broadcast_file.markDirty()
+
+    async def __resumeBroadcast(self) -> None:
+        await self.bot.wait_until_ready()
+        log.info(f'繼續未完成的廣播，剩餘 {len(self.__broadcast_file.data["pending"])} 個伺服器')
+        await self.__runBroadcast()
+
+    async def __runBroadcast(self) -> None:
+        job = self.__broadcast_file.data
+        # 不使用batch()，每個伺服器的進度都會在延遲寫入時保存，中斷後不會重複送出已送出的伺服器
+        await runRateLimited(
+            list(job['pending']),
+            self.__sendToGuild,
+            concurrency=self.__broadcast_concurrency,
+            buckets=lambda guild_id: [self.__broadcast_bucket],
+            name='廣播',
+            job='broadcast'
+        )
+        summary = f'廣播完成：成功 {job["delivered"]}，失敗 {job["failed"]}'
+        channel = self.bot.get_channel(job['report_channel'])
+        job.clear()
+        self.__broadcast_file.markDirty()
+        if channel is not None:
+            try:
+                await channel.send(summary)
+            except Exception as e:
+                log.error(f'broadcast report: {e}')
+
+    async def __sendToGuild(self, guild_id: int) -> None:
+        job = self.__broadcast_file.data
+        guild = self.bot.get_guild(guild_id)
+        channel = self.__getWritableChannel(guild) if guild is not None else None
+        try:
+            if channel is None:
+                raise Exception('沒有可以發送訊息的頻道')
+            try:
+                await channel.send(job['message'])
+            except (discord.Forbidden, discord.NotFound):
+                # 快取的頻道已被刪除或權限已變動(沒有members intent時收不到機器人自己的身分組變動)，重新尋找頻道再試一次
+                self.__channel_cache.pop(guild_id, None)
+                channel = self.__getWritableChannel(guild)
+                if channel is None:
+                    raise
+                await channel.send(job['message'])
+        except Exception as e:
+            # 送出失敗時下次重新尋找頻道
+            self.__channel_cache.pop(guild_id, None)
+            job['failed'] += 1
+            raise Exception(f'{guild}: {e}')
+        else:
+            job['delivered'] += 1
+        finally:
+            job['pending'].remove(guild_id)
+            self.__broadcast_file.markDirty()
+
+    def __getWritableChannel(self, guild: discord.Guild) -> Optional[discord.TextChannel]:
+        """找出伺服器第一個可以發送訊息的頻道，結果會快取到權限或頻道變動為止"""
+        if guild.id in self.__channel_cache:
+            channel_id = self.__channel_cache[guild.id]
+            return guild.get_channel(channel_id) if channel_id is not None else None
+        channel = next((c for c in guild.text_channels if c.permissions_for(guild.me).send_messages), None)
+        self.__channel_cache[guild.id] = channel.id if channel is not None else None
+        return channel
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel):
+        self.__channel_cache.pop(channel.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.__channel_cache.pop(channel.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        self.__channel_cache.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        self.__channel_cache.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        # 機器人自己的身分組變動會影響頻道權限；需要members intent，沒有時由發送失敗後重新尋找頻道處理
+        if after.id == self.bot.user.id:
+            self.__channel_cache.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.__channel_cache.pop(guild.id, None)
 
 def setup(client: commands.Bot):
-    client.add_cog(Admin(client))
\ No newline at end of file
+    client.add_cog(Admin(client))
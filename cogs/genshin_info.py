@@ -2,9 +2,8 @@ import datetime
 import discord
 from discord.ext import commands
 from utility.GenshinApp import genshin_app
+from utility.Response import respond
 import os
-from dotenv import load_dotenv
-load_dotenv()
 
 class GenshinInfo(commands.Cog, name='原神資訊'):
     def __init__(self, bot):
@@ -19,28 +18,31 @@ class GenshinInfo(commands.Cog, name='原神資訊'):
         help=''
     )
     async def g(self, ctx, *args):
-        msg = await ctx.send('讀取中...')
-        user_id = ctx.author.id if len(args) == 0 else filter(str.isdigit, args[0])
-        result = await genshin_app.getRealtimeNote(user_id)
-        embed = discord.Embed(title='', description=result, color=0xFF5733)
-        if ctx.me.guild_permissions.manage_messages:
-            await msg.delete()
-        await ctx.reply(embed=embed)
+        user_id = ctx.author.id if len(args) == 0 else ''.join(filter(str.isdigit, args[0]))
+
+        async def work():
+            result = await genshin_app.getRealtimeNote(user_id)
+            return discord.Embed(title='', description=result, color=0xFF5733)
+        await respond(ctx, work())
     
     # 取得深境螺旋資訊
     @commands.command(
         brief='查詢深境螺旋紀錄',
         description='查詢深境螺旋紀錄',
-        usage='[p] [f] [UID]',
+        usage='[rank|teams] [p] [f] [UID]',
         help='參數 p 查詢上期紀錄、參數 f 顯示全部樓層人物紀錄(預設只顯示最後一層)，範例：\n\n'
             f'{os.getenv("BOT_PREFIX")}abyss　　　　　　　查詢自己本期紀錄\n'
             f'{os.getenv("BOT_PREFIX")}abyss p　　　　　　查詢自己上期紀錄\n'
             f'{os.getenv("BOT_PREFIX")}abyss f　　　　　　查詢自己本期全部樓層紀錄\n'
             f'{os.getenv("BOT_PREFIX")}abyss p f 123456　查詢123456的上期完整深淵紀錄\n'
+            f'{os.getenv("BOT_PREFIX")}abyss rank　　　　查詢伺服器本期排行\n'
+            f'{os.getenv("BOT_PREFIX")}abyss teams p　　 查詢伺服器上期第12層角色與隊伍使用率\n\n'
+            '在伺服器中查詢自己的紀錄後會加入該伺服器的排行'
     )
     async def abyss(self, ctx, *args: str):
         previous = False
         full_data = False
+        board = None
         uid = None
         user_id = ctx.author.id
         for arg in args:
@@ -48,33 +50,47 @@ class GenshinInfo(commands.Cog, name='原神資訊'):
                 previous = True
             elif arg == 'f':
                 full_data = True
+            elif arg in ('rank', 'teams'):
+                board = arg
             elif len(arg) < 12 and arg.isnumeric(): # Genshin UID
                 uid = arg
             else:   # Discord UID
                 user_id = ''.join(filter(str.isdigit, arg))
-    
-        result = await genshin_app.getSpiralAbyss(user_id, uid, previous, full_data)
-        if type(result) == discord.Embed:
-            await ctx.reply(embed=result)
+
+        guild_id = str(ctx.guild.id) if ctx.guild is not None else None
+        if board is not None and guild_id is None:
+            await ctx.reply('伺服器排行只能在伺服器中使用')
+        elif board == 'rank':
+            await respond(ctx, genshin_app.getAbyssRank(guild_id, previous))
+        elif board == 'teams':
+            await respond(ctx, genshin_app.getAbyssTeams(guild_id, previous))
         else:
-            await ctx.reply(result)
+            # 只有查詢自己時才加入伺服器排行
+            guild_id = guild_id if str(user_id) == str(ctx.author.id) else None
+            await respond(ctx, genshin_app.getSpiralAbyss(user_id, uid, previous, full_data, guild_id))
 
     # 取得使用者旅行者札記
     @commands.command(
-        brief='查詢旅行者札記(三個月內)',
+        brief='查詢旅行者札記',
         description='查詢旅行者札記',
         usage='[月份]',
-        help='月份參數為數字，查詢該月份的旅行者札記，最多只能查到前二個月，範例：\n\n'
+        help='月份參數為數字，查詢該月份的旅行者札記，最多只能查到前二個月(開啟歷史紀錄同步後可查詢一年內已保存的月份)，範例：\n\n'
             f'{os.getenv("BOT_PREFIX")}diary　　查詢當月的旅行者札記\n'
             f'{os.getenv("BOT_PREFIX")}diary 5　查詢5月的旅行者札記'
     )
     async def diary(self, ctx, *month):
         month = month[0] if len(month) > 0 else datetime.datetime.now().month
-        result = await genshin_app.getTravelerDiary(ctx.author.id, month)
-        if type(result) == discord.Embed:
-            await ctx.reply(embed=result)
-        else:
-            await ctx.reply(result)
+        await respond(ctx, genshin_app.getTravelerDiary(ctx.author.id, month))
+
+    # 取得本地保存的歷史紀錄
+    @commands.command(
+        brief='查詢歷史紀錄(近一年原石收入、深境螺旋星數)',
+        description='查詢本地保存的歷史紀錄，包含近一年每月原石收入與近期深境螺旋星數',
+        usage='',
+        help=f'需要先使用 {os.getenv("BOT_PREFIX")}set history on 開啟歷史紀錄同步，之後每天自動保存已結束的月份與期數'
+    )
+    async def history(self, ctx):
+        await respond(ctx, genshin_app.getHistory(ctx.author.id))
 
 def setup(client):
     client.add_cog(GenshinInfo(client))
\ No newline at end of file
@@ -1,9 +1,8 @@
 import discord
 from discord.ext import commands
 from utility.GenshinApp import genshin_app
+from utility.Response import respond
 import os
-from dotenv import load_dotenv
-load_dotenv()
 
 class Setting(commands.Cog, name='設定'):
     def __init__(self, bot):
@@ -23,22 +22,26 @@ class Setting(commands.Cog, name='設定'):
             "```js\nd=document.cookie; c=d.includes('account_id') || alert('過期或無效的Cookie,請先登出帳號再重新登入!'); c && confirm('將Cookie複製到剪貼簿?') && copy(d)"
     )
     async def cookie(self, ctx, *args):
-        if ctx.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
-        msg = await ctx.send('設置中...')
-        user_id = ctx.author.id
-        cookie = ' '.join(args)
-        result = await genshin_app.setCookie(user_id, cookie)
-        if ctx.me.guild_permissions.manage_messages:
-            await msg.delete()
-        await ctx.send(f'<@{user_id}> {result}')
+        # 包含Cookie的訊息在背景刪除，不延遲設定
+        await respond(ctx, genshin_app.setCookie(ctx.author.id, ' '.join(args)), delete_command=True)
 
-    # 設定原神UID，當帳號內有多名角色時，保存指定的UID
+    # 新增其他Hoyolab帳號的Cookie，保留已保存的角色
     @commands.command(
-        brief='指定要保存的UID(帳號內多角色才需用本指令)',
-        description='指定自己帳號內要保存的UID，帳號只有一個角色的話設定Cookie時已自動保存，不需再使用本指令',
+        brief='新增其他帳號的Cookie(多帳號才需用本指令)',
+        description='保留已保存的Cookie與角色，再新增另一個Hoyolab帳號的Cookie，即時便箋、樹脂提醒與自動簽到會包含全部帳號的角色',
+        usage='你取得的Cookie',
+        help=f'取得Cookie的方式與 {os.getenv("BOT_PREFIX")}cookie 相同，使用範例：\n'
+            f'{os.getenv("BOT_PREFIX")}addcookie XXXXX(從網頁取得的Cookie)'
+    )
+    async def addcookie(self, ctx, *args):
+        await respond(ctx, genshin_app.setCookie(ctx.author.id, ' '.join(args), append=True), delete_command=True)
+
+    # 設定主要角色的原神UID，當帳號內有多名角色時，深淵、札記與兌換碼使用此角色
+    @commands.command(
+        brief='指定主要角色的UID(帳號內多角色才需用本指令)',
+        description='指定深淵、札記與兌換碼使用的主要角色UID，設定Cookie時已保存帳號內全部角色並以第一個角色為主要角色',
         usage='<UID>',
-        help='在設定cookie之後，如果自己帳號內有多個角色時，需指定一個要保存使用的角色UID，使用範例：\n'
+        help='在設定cookie之後，如果自己帳號內有多個角色時，可以指定主要角色的UID，使用範例：\n'
             f'{os.getenv("BOT_PREFIX")}uid 81234567'
     )
     async def uid(self, ctx, uid):
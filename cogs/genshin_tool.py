@@ -1,9 +1,8 @@
 import discord
 from discord.ext import commands
 from utility.GenshinApp import genshin_app
+from utility.Response import respond
 import os
-from dotenv import load_dotenv
-load_dotenv()
 
 class GenshinTool(commands.Cog, name='原神工具'):
     def __init__(self, bot):
@@ -18,8 +17,7 @@ class GenshinTool(commands.Cog, name='原神工具'):
         help=f'範例: {os.getenv("BOT_PREFIX")}R ABCDEFG'
     )
     async def r(self, ctx, code):
-        result = await genshin_app.redeemCode(ctx.author.id, code)
-        await ctx.reply(result)
+        await respond(ctx, genshin_app.redeemCode(ctx.author.id, code))
 
     # 為使用者在Hoyolab簽到
     @commands.command(
@@ -30,8 +28,7 @@ class GenshinTool(commands.Cog, name='原神工具'):
         help=''
     )
     async def d(self, ctx):
-        result = await genshin_app.claimDailyReward(ctx.author.id)
-        await ctx.reply(result)
+        await respond(ctx, genshin_app.claimDailyReward(ctx.author.id))
 
 def setup(client):
     client.add_cog(GenshinTool(client))
\ No newline at end of file
@@ -1,19 +1,30 @@
 import json
+import time
 import asyncio
 import discord
 from datetime import datetime
+from typing import Callable, Dict, List, Optional, Union
 from utility.GenshinApp import genshin_app
 from discord.ext import commands, tasks
 from utility.utils import log
+from utility.RateLimiter import TokenBucket, runRateLimited
+from utility.JobQueue import JobQueue, SKIPPED
+from utility.Outbox import Outbox
+from utility.Render import messages, maskUID
+from utility.Response import runInBackground
+from utility.ResinScheduler import ResinScheduler
+from utility.Metrics import JOB_SECONDS, JOB_BACKLOG
+from utility.Sharding import shard_config
+from utility.WriteBehind import WriteBehindJsonFile
 import os
-from dotenv import load_dotenv
-load_dotenv()
 
 class Schedule(commands.Cog, name='自動化(BETA)'):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.__daily_reward_filename = 'data/schedule_daily_reward.json'
         self.__resin_notifi_filename = 'data/schedule_resin_notification.json'
+        self.__redeem_code_filename = 'data/schedule_redeem_code.json'
+        self.__history_filename = 'data/schedule_history.json'
         try:
             with open(self.__daily_reward_filename, 'r', encoding='utf-8') as f:
                 self.__daily_dict = json.load(f)
@@ -24,19 +35,100 @@ class Schedule(commands.Cog, name='自動化(BETA)'):
                 self.__resin_dict = json.load(f)
         except:
             self.__resin_dict = { }
+        try:
+            with open(self.__redeem_code_filename, 'r', encoding='utf-8') as f:
+                self.__redeem_dict = json.load(f)
+        except:
+            self.__redeem_dict = { }
+        try:
+            with open(self.__history_filename, 'r', encoding='utf-8') as f:
+                self.__history_dict = json.load(f)
+        except:
+            self.__history_dict = { }
+        # 訂閱資料修改後延遲合併寫入，多個process共用檔案時只覆寫自己負責的訂閱
+        merge = self.__mergeScheduleData if shard_config.multi_process else None
+        self.__daily_file = WriteBehindJsonFile(self.__daily_reward_filename, self.__daily_dict, merge=merge)
+        self.__resin_file = WriteBehindJsonFile(self.__resin_notifi_filename, self.__resin_dict, merge=merge)
+        self.__redeem_file = WriteBehindJsonFile(self.__redeem_code_filename, self.__redeem_dict, merge=merge)
+        self.__history_file = WriteBehindJsonFile(self.__history_filename, self.__history_dict, merge=merge)
+        # 自動簽到的全域與各區域請求速率限制
+        self.__daily_concurrency = int(os.getenv('AUTO_DAILY_REWARD_CONCURRENCY', 10))
+        self.__daily_bucket = TokenBucket(float(os.getenv('AUTO_DAILY_REWARD_RPS', 2)))
+        self.__daily_region_buckets = {
+            region: TokenBucket(float(os.getenv('AUTO_DAILY_REWARD_REGION_RPS', 1))) for region in ('os', 'cn')
+        }
+        # 依照預測的樹脂達標與寶錢額滿時間排定檢查，每個角色各自排程(以 '使用者ID:UID' 區分)，啟動時全部角色先檢查一次
+        self.__resin_scheduler = ResinScheduler(int(os.getenv('AUTO_CHECK_RESIN_THRESHOLD')), window=self.loop_interval * 60)
+        self.__resin_bucket = TokenBucket(float(os.getenv('AUTO_CHECK_RESIN_RPS', 1)))
+        JOB_BACKLOG.setFunction(lambda: len(self.__resin_scheduler), 'resin_scheduled')
+        # 兌換碼批次兌換的並行數量與速率，同一時間只執行一個
+        self.__redeem_concurrency = int(os.getenv('REDEEM_ALL_CONCURRENCY', 5))
+        self.__redeem_bucket = TokenBucket(float(os.getenv('REDEEM_ALL_RPS', 1)))
+        self.__redeem_task: Optional[asyncio.Task] = None
+        # 每日同步歷史紀錄的請求速率
+        self.__history_bucket = TokenBucket(float(os.getenv('HISTORY_SYNC_RPS', 1)))
+        # 排程結果依頻道合併成彙整訊息，在背景依各頻道的速率發送
+        self.__outbox = Outbox(self.bot, float(os.getenv('OUTBOX_RPS', 10)))
+        # 在背景分批檢查訂閱使用者的Cookie，過期的Cookie在排程執行前就被標記，之後的排程與指令不再送出請求
+        self.__cookie_check_batch = int(os.getenv('COOKIE_CHECK_BATCH', 50))
+        self.__cookie_check_bucket = TokenBucket(float(os.getenv('COOKIE_CHECK_RPS', 0.5)))
+        self.__cookie_check_concurrency = int(os.getenv('COOKIE_CHECK_CONCURRENCY', 5))
+        self.__cookie_check_pending: List[str] = []
+        genshin_app.addCookieExpiredListener(self.__notifyCookieExpired)
+        # 自動簽到與歷史紀錄同步以可恢復的工作佇列執行，重新啟動或錯過時間後會繼續處理當天還沒完成的使用者
+        self.__jobs = JobQueue('data/jobs.db', owner=shard_config.label)
+        self.__job_tasks: Dict[str, asyncio.Task] = { }
+        self.__job_queues = {
+            'daily_reward': {
+                'name': '每日自動簽到',
+                'file': self.__daily_file,
+                'handler': self.__claimDailyReward,
+                'buckets': self.__dailyRewardBuckets
+            },
+            'history_sync': {
+                'name': '歷史紀錄同步',
+                'file': self.__history_file,
+                'handler': self.__syncHistory,
+                'buckets': lambda user_id: [self.__history_bucket]
+            }
+        }
         
-        self.schedule.start()
+        self.job_schedule.start()
+        self.resin_schedule.start()
+        self.cookie_schedule.start()
+
+    def cog_unload(self):
+        self.job_schedule.cancel()
+        self.resin_schedule.cancel()
+        self.cookie_schedule.cancel()
+        genshin_app.removeCookieExpiredListener(self.__notifyCookieExpired)
+        for task in self.__job_tasks.values():
+            task.cancel()
+        self.__outbox.close()
+        self.__jobs.close()
+        if self.__redeem_task is not None:
+            self.__redeem_task.cancel()
+        self.__daily_file.flushSync()
+        self.__resin_file.flushSync()
+        self.__redeem_file.flushSync()
+        self.__history_file.flushSync()
 
     @commands.command(
-        brief='設定自動化功能(論壇簽到、樹脂溢出提醒)',
+        brief='設定自動化功能(論壇簽到、樹脂溢出提醒、兌換碼、歷史紀錄)',
         description='設定自動化功能，會在特定時間執行功能，執行結果會在當初設定指令的頻道推送，若要更改頻道，請在新的頻道重新設定指令一次',
-        usage='<daily|resin> <on|off>',
+        usage='<daily|resin|redeem|history> <on|off>',
         help=f'每日 {os.getenv("AUTO_DAILY_REWARD_TIME")} 點左右自動論壇簽到（使用前請先用 {os.getenv("BOT_PREFIX")}d 指令確認機器人能簽到你的每日），使用範例：\n'
             f'{os.getenv("BOT_PREFIX")}set daily on　　　開啟每日自動簽到\n'
             f'{os.getenv("BOT_PREFIX")}set daily off 　　關閉每日自動簽到\n\n'
-            f'每小時檢查一次，當樹脂超過 {os.getenv("AUTO_CHECK_RESIN_THRESHOLD")} 時會發送提醒（使用前請先用 {os.getenv("BOT_PREFIX")}g 指令確認機器人能讀到你的樹脂資訊），使用範例：\n'
+            f'依照樹脂恢復時間自動檢查，當樹脂超過 {os.getenv("AUTO_CHECK_RESIN_THRESHOLD")} 或洞天寶錢額滿時會發送提醒（使用前請先用 {os.getenv("BOT_PREFIX")}g 指令確認機器人能讀到你的樹脂資訊），使用範例：\n'
             f'{os.getenv("BOT_PREFIX")}set resin on　　　開啟樹脂提醒\n'
-            f'{os.getenv("BOT_PREFIX")}set resin off 　　關閉樹脂提醒\n'
+            f'{os.getenv("BOT_PREFIX")}set resin off 　　關閉樹脂提醒\n\n'
+            f'有新的兌換碼時，由機器人管理者為所有開啟的使用者自動兌換，使用範例：\n'
+            f'{os.getenv("BOT_PREFIX")}set redeem on　　 開啟自動兌換\n'
+            f'{os.getenv("BOT_PREFIX")}set redeem off　　關閉自動兌換\n\n'
+            f'每天自動保存已結束月份的旅行者札記與上一期深境螺旋，之後可用 {os.getenv("BOT_PREFIX")}history 查詢超過三個月的紀錄，使用範例：\n'
+            f'{os.getenv("BOT_PREFIX")}set history on　　開啟歷史紀錄同步\n'
+            f'{os.getenv("BOT_PREFIX")}set history off 　關閉歷史紀錄同步\n'
     )
     async def set(self, ctx, cmd: str, switch: str):
         log.info(f'set(user_id={ctx.author.id}, cmd={cmd} , switch={switch})')
@@ -46,86 +138,365 @@ class Schedule(commands.Cog, name='自動化(BETA)'):
             return
         if cmd == 'daily':
             if switch == 'on':
-                self.__add_user(str(ctx.author.id), str(ctx.channel.id), self.__daily_dict, self.__daily_reward_filename)
+                self.__add_user(str(ctx.author.id), str(ctx.channel.id), ctx.guild, self.__daily_file)
                 await ctx.reply('每日自動簽到已開啟')
             elif switch == 'off':
-                self.__remove_user(str(ctx.author.id), self.__daily_dict, self.__daily_reward_filename)
+                self.__remove_user(str(ctx.author.id), self.__daily_file)
                 await ctx.reply('每日自動簽到已關閉')
         if cmd == 'resin':
             if switch == 'on':
-                self.__add_user(str(ctx.author.id), str(ctx.channel.id), self.__resin_dict, self.__resin_notifi_filename)
+                self.__add_user(str(ctx.author.id), str(ctx.channel.id), ctx.guild, self.__resin_file)
+                self.__scheduleResin(str(ctx.author.id))
                 await ctx.reply('樹脂額滿提醒已開啟')
             elif switch == 'off':
-                self.__remove_user(str(ctx.author.id), self.__resin_dict, self.__resin_notifi_filename)
+                self.__remove_user(str(ctx.author.id), self.__resin_file)
+                for uid in genshin_app.getUIDs(str(ctx.author.id)):
+                    self.__resin_scheduler.remove(f'{ctx.author.id}:{uid}')
                 await ctx.reply('樹脂額滿提醒已關閉')
+        if cmd == 'redeem':
+            if switch == 'on':
+                self.__add_user(str(ctx.author.id), str(ctx.channel.id), ctx.guild, self.__redeem_file)
+                await ctx.reply('自動兌換已開啟')
+            elif switch == 'off':
+                self.__remove_user(str(ctx.author.id), self.__redeem_file)
+                await ctx.reply('自動兌換已關閉')
+        if cmd == 'history':
+            if switch == 'on':
+                self.__add_user(str(ctx.author.id), str(ctx.channel.id), ctx.guild, self.__history_file)
+                # 開啟時立即同步一次，之後每天同步新結束的月份與期數
+                runInBackground(self.__syncHistory(str(ctx.author.id)), f'{ctx.author.id}: 歷史紀錄同步')
+                await ctx.reply('歷史紀錄同步已開啟')
+            elif switch == 'off':
+                self.__remove_user(str(ctx.author.id), self.__history_file)
+                await ctx.reply('歷史紀錄同步已關閉')
+
+    # 為所有開啟自動兌換的使用者使用兌換碼
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def redeem_all(self, ctx: commands.Context, code: str):
+        log.info(f'redeem_all(code={code})')
+        if self.__redeem_task is not None and not self.__redeem_task.done():
+            await ctx.reply('已有兌換碼正在兌換中，請等待完成')
+            return
+        # 只處理這個process負責的伺服器，略過Cookie已過期的使用者
+        redeem_dict = {
+            user_id: value for user_id, value in list(self.__redeem_dict.items())
+            if self.__ownsEntry(value, self.__redeem_file) and not genshin_app.isCookieExpired(user_id)
+        }
+        self.__redeem_task = asyncio.ensure_future(self.__redeemAll(code, redeem_dict, ctx.channel))
+        await ctx.reply(f'開始為 {len(redeem_dict)} 位使用者兌換 {code}，完成後會在此頻道回報結果')
 
     loop_interval = 10
-    @tasks.loop(minutes=loop_interval)
-    async def schedule(self):
-        log.debug(f'schedule() is called')
+    @tasks.loop(minutes=1)
+    async def job_schedule(self):
+        """每日 X 點之後建立當天的自動簽到與歷史紀錄同步，並在背景處理還沒完成的使用者
+        每個佇列各自執行，前一次還在處理時不會重複啟動；失敗的使用者在10分鐘後重試，最多3次
+        """
         now = datetime.now()
-        # 每日 X 點自動簽到
-        if now.hour == os.getenv("AUTO_DAILY_REWARD_TIME") and now.minute < self.loop_interval:
-            log.info('每日自動簽到開始')
-            # 複製一份避免衝突
-            daily_dict = dict(self.__daily_dict)
-            for user_id, value in daily_dict.items():
-                channel = self.bot.get_channel(int(value['channel']))
-                check, msg = genshin_app.checkUserData(str(user_id))
-                if channel == None or check == False:
-                    self.__remove_user(str(user_id), self.__daily_dict, self.__daily_reward_filename)
-                    continue
-                result = await genshin_app.claimDailyReward(user_id)
-                try:
-                    await channel.send(f'[自動簽到] <@{user_id}> {result}')
-                except:
-                    self.__remove_user(str(user_id), self.__daily_dict, self.__daily_reward_filename)
-                await asyncio.sleep(5)
-            log.info('每日自動簽到結束')
-        
-        # 每小時檢查樹脂
-        if 30 <= now.minute < 30 + self.loop_interval:
-            log.info('自動檢查樹脂開始')
-            resin_dict = dict(self.__resin_dict)
-            for user_id, value in resin_dict.items():
-                channel = self.bot.get_channel(int(value['channel']))
-                check, msg = genshin_app.checkUserData(str(user_id))
-                if channel == None or check == False:
-                    self.__remove_user(str(user_id), self.__resin_dict, self.__resin_notifi_filename)
-                    continue
-                result = await genshin_app.getRealtimeNote(user_id, True)
-                if result != None:
-                    embed = discord.Embed(title='', description=result, color=0xff2424)
-                    try:
-                        await channel.send(f'<@{user_id}>，樹脂(快要)溢出啦！', embed=embed)
-                    except:
-                        self.__remove_user(str(user_id), self.__resin_dict, self.__resin_notifi_filename)
-                await asyncio.sleep(5)
+        run_id = now.strftime('%Y-%m-%d')
+        for queue, config in self.__job_queues.items():
+            if now.hour >= int(os.getenv('AUTO_DAILY_REWARD_TIME')) and await self.__jobs.hasRun(queue, run_id) == False:
+                # 只處理這個process負責的伺服器，並先移除已經沒有使用者資料的訂閱
+                file: WriteBehindJsonFile = config['file']
+                user_ids = []
+                with file.batch():
+                    for user_id, value in list(file.data.items()):
+                        if self.__ownsEntry(value, file) != True:
+                            continue
+                        # Cookie過期的使用者保留訂閱，由處理時略過，重新設定Cookie後自動恢復
+                        check, msg = genshin_app.checkUserData(str(user_id), checkExpired=False)
+                        if check == False:
+                            self.__remove_user(str(user_id), file)
+                        else:
+                            user_ids.append(user_id)
+                count = await self.__jobs.createRun(queue, run_id, user_ids)
+                log.info(f'{config["name"]}開始，共 {count} 位使用者')
+            await self.__jobs.retryFailed(queue, run_id, max_attempts=3, retry_after=600)
+            task = self.__job_tasks.get(queue)
+            if task is None or task.done():
+                self.__job_tasks[queue] = asyncio.ensure_future(self.__runJobs(queue, run_id))
+
+    async def __runJobs(self, queue: str, run_id: str) -> None:
+        config = self.__job_queues[queue]
+        with config['file'].batch():
+            result = await self.__jobs.process(
+                queue, run_id, config['handler'], concurrency=self.__daily_concurrency, buckets=config['buckets'], name=config['name']
+            )
+        if result['total'] > 0:
+            stats = await self.__jobs.getStats(queue, run_id)
+            log.info(f'{config["name"]}結束，{run_id} 的進度：{stats}')
+
+    async def waitForJobs(self) -> None:
+        """等待背景執行中的排程工作完成，並等待結果通知發送完成"""
+        await asyncio.gather(*self.__job_tasks.values(), return_exceptions=True)
+        await self.__outbox.flush()
+
+    @tasks.loop(minutes=loop_interval)
+    async def resin_schedule(self):
+        log.debug(f'resin_schedule() is called')
+        start_time = time.monotonic()
+        # 只檢查預測樹脂已達門檻的角色
+        due_keys = []
+        for key in self.__resin_scheduler.popDue():
+            if key.split(':', 1)[0] in self.__resin_dict:
+                due_keys.append(key)
+            else:
+                # 已關閉樹脂提醒的使用者
+                self.__resin_scheduler.remove(key)
+        if len(due_keys) > 0:
+            log.info(f'自動檢查樹脂開始，共 {len(due_keys)}/{len(self.__resin_scheduler)} 個角色')
+            with self.__resin_file.batch():
+                await runRateLimited(
+                    due_keys,
+                    self.__checkResin,
+                    concurrency=self.__daily_concurrency,
+                    buckets=lambda key: [self.__resin_bucket],
+                    name='自動檢查樹脂',
+                    job='resin_check'
+                )
             log.info('自動檢查樹脂結束')
+        JOB_SECONDS.observe(time.monotonic() - start_time, 'schedule_loop')
+
+    @tasks.loop(minutes=loop_interval)
+    async def cookie_schedule(self):
+        """每次檢查一批訂閱使用者的Cookie，全部檢查完後開始下一輪"""
+        if len(self.__cookie_check_pending) == 0:
+            self.__cookie_check_pending = self.__subscribers()
+        batch = self.__cookie_check_pending[:self.__cookie_check_batch]
+        del self.__cookie_check_pending[:self.__cookie_check_batch]
+        if len(batch) > 0:
+            expired = await genshin_app.checkCookies(
+                batch, concurrency=self.__cookie_check_concurrency, bucket=self.__cookie_check_bucket
+            )
+            log.info(f'Cookie檢查：{len(batch)} 位使用者，{expired} 個Cookie已過期，本輪剩餘 {len(self.__cookie_check_pending)} 位')
+
+    def __subscribers(self) -> List[str]:
+        """這個process負責的所有訂閱使用者"""
+        user_ids: Dict[str, None] = { }
+        for file in (self.__daily_file, self.__resin_file, self.__redeem_file, self.__history_file):
+            for user_id, value in list(file.data.items()):
+                if self.__ownsEntry(value, file) != False:
+                    user_ids[user_id] = None
+        return list(user_ids)
+
+    def __notifyCookieExpired(self, user_id: str, uids: List[str]) -> None:
+        """Cookie被標記為過期時，在使用者其中一個訂閱的頻道發送一次重新登入通知"""
+        for file in (self.__daily_file, self.__resin_file, self.__redeem_file, self.__history_file):
+            value = file.data.get(user_id)
+            if value is not None and self.__ownsEntry(value, file) == True:
+                self.__outbox.post(
+                    value['channel'], '[Cookie過期]', user_id, ' '.join(maskUID(uid) for uid in uids),
+                    f'<@{user_id}> {messages["cookie_expired"]}', color=0xff2424
+                )
+                return
+
+    def __dailyRewardBuckets(self, user_id: str) -> List[TokenBucket]:
+        """每個要簽到的Hoyolab帳號各取得一次所屬區域的token；沒有要簽到的帳號(資料已刪除、Cookie過期)時不取得token"""
+        regions = genshin_app.getClaimRegions(user_id)
+        if len(regions) == 0:
+            return []
+        return [self.__daily_bucket] + [self.__daily_region_buckets[region] for region in regions]
+
+    async def __claimDailyReward(self, user_id: str) -> Union[bool, str]:
+        value = self.__daily_dict.get(user_id)
+        if value is None:
+            # 已關閉自動簽到
+            return SKIPPED
+        check, msg = genshin_app.checkUserData(str(user_id), checkExpired=False)
+        if check == False:
+            # 建立工作後使用者資料已被刪除
+            self.__remove_user(str(user_id), self.__daily_file)
+            return SKIPPED
+        channel = self.bot.get_channel(int(value['channel']))
+        if channel == None:
+            self.__remove_user(str(user_id), self.__daily_file)
+            return SKIPPED
+        if len(genshin_app.getUIDs(user_id, active_only=True)) == 0:
+            # Cookie已過期，已發送過重新登入通知
+            return SKIPPED
+        # 連線失敗等暫時性錯誤會拋出例外，由工作佇列稍後重試
+        result = await genshin_app.claimDailyReward(user_id, max_retries=3, raise_transient=True)
+        self.__outbox.post(channel.id, '[自動簽到]', user_id, '', f'<@{user_id}> {result}', on_failed=self.__unsubscriber(self.__daily_file))
+        # 簽到時才發現Cookie已過期，沒有實際簽到
+        return SKIPPED if result == messages['cookie_expired'] else True
+
+    async def __syncHistory(self, user_id: str) -> Union[bool, str]:
+        check, msg = genshin_app.checkUserData(str(user_id), checkExpired=False)
+        if check == False:
+            self.__remove_user(str(user_id), self.__history_file)
+            return SKIPPED
+        if genshin_app.isCookieExpired(user_id):
+            return SKIPPED
+        synced = await genshin_app.syncHistory(user_id)
+        log.debug(f'{user_id}: 歷史紀錄同步 {synced} 筆')
+        return True
+
+    async def __checkResin(self, key: str) -> None:
+        user_id, uid = key.split(':', 1)
+        value = self.__resin_dict.get(user_id)
+        if value is None:
+            self.__resin_scheduler.remove(key)
+            return
+        owns = self.__ownsEntry(value, self.__resin_file)
+        if owns == False:
+            self.__resin_scheduler.remove(key)
+            return
+        if owns is None:
+            # 還找不到頻道的舊資料，稍後再確認是否由這個process負責
+            self.__resin_scheduler.reschedule(key)
+            return
+        channel = self.bot.get_channel(int(value['channel']))
+        check, msg = genshin_app.checkUserData(str(user_id), checkExpired=False)
+        if channel == None or check == False:
+            self.__remove_user(str(user_id), self.__resin_file)
+            return
+        uids = genshin_app.getUIDs(user_id)
+        if uid not in uids:
+            # 角色已被移除(重新設定Cookie)，改為排程目前保存的角色
+            self.__resin_scheduler.remove(key)
+            self.__scheduleResin(user_id)
+            return
+        if genshin_app.isCookieExpired(user_id, uid):
+            # Cookie已過期，不送出請求，稍後確認是否已重新設定Cookie
+            self.__resin_scheduler.reschedule(key)
+            return
+        notes = None
+        try:
+            notes, msg = await genshin_app.getNotes(user_id, uid)
+            if notes is None:
+                return
+            alerts = []
+            if self.__resin_scheduler.isResinAlert(notes):
+                alerts.append('樹脂(快要)溢出啦！')
+            if self.__resin_scheduler.isRealmAlert(key, notes):
+                alerts.append('洞天寶錢(快要)額滿啦！')
+            if len(alerts) > 0:
+                result = await genshin_app.formatRealtimeNote(user_id, notes, uid=uid)
+                self.__outbox.post(
+                    channel.id, '[樹脂提醒]', user_id, ''.join(alerts), f'<@{user_id}>\n{result}',
+                    color=0xff2424, on_failed=self.__unsubscriber(self.__resin_file)
+                )
+        finally:
+            # 依照最新的即時便箋重新預測下次檢查時間，並排程之後新增的角色
+            if user_id in self.__resin_dict and uid in uids:
+                self.__resin_scheduler.reschedule(key, notes)
+                self.__scheduleResin(user_id)
+
+    def __scheduleResin(self, user_id: str) -> None:
+        """將使用者還沒有排程的角色加入樹脂檢查排程，新加入的角色立即檢查"""
+        for uid in genshin_app.getUIDs(user_id):
+            key = f'{user_id}:{uid}'
+            if key not in self.__resin_scheduler:
+                self.__resin_scheduler.add(key)
 
-    @schedule.before_loop
-    async def before_schedule(self):
+    async def __redeemAll(self, code: str, redeem_dict: Dict[str, dict], report_channel) -> None:
+        start_time = time.monotonic()
+        with self.__redeem_file.batch():
+            results = await genshin_app.redeemCodeForUsers(
+                redeem_dict.keys(), code, concurrency=self.__redeem_concurrency, bucket=self.__redeem_bucket
+            )
+            # 同一個頻道的結果合併成彙整訊息
+            for user_id, result in results.items():
+                self.__outbox.post(
+                    redeem_dict[user_id]['channel'], f'[自動兌換] {code}', user_id, '', f'<@{user_id}> {result}',
+                    on_failed=self.__unsubscriber(self.__redeem_file)
+                )
+            await self.__outbox.flush()
+        channel_count = len(set(value['channel'] for value in redeem_dict.values()))
+        succeeded = sum(1 for result in results.values() if '兌換碼使用成功！' in result)
+        summary = f'{code} 兌換完成：成功 {succeeded}/{len(results)}，發送到 {channel_count} 個頻道，耗時 {time.monotonic() - start_time:.0f} 秒'
+        log.info(summary)
+        try:
+            await report_channel.send(summary)
+        except Exception as e:
+            log.error(f'redeem_all report: {e}')
+
+    def __unsubscriber(self, file: WriteBehindJsonFile) -> Callable[[str], None]:
+        """結果通知無法發送到頻道時，移除該使用者的訂閱"""
+        def unsubscribe(user_id: str) -> None:
+            if user_id in file.data:
+                self.__remove_user(user_id, file)
+        return unsubscribe
+
+    @job_schedule.before_loop
+    async def before_job_schedule(self):
         await self.bot.wait_until_ready()
+        await genshin_app.waitUntilLoaded()
+        # 上次關閉時處理到一半的使用者重新處理，並清除一週前的紀錄
+        for queue in self.__job_queues.keys():
+            recovered = await self.__jobs.recover(queue)
+            if recovered > 0:
+                log.info(f'{self.__job_queues[queue]["name"]}：恢復 {recovered} 位上次未完成的使用者')
+        self.__jobs.prune(7 * 24 * 3600)
 
-    def __add_user(self, user_id: str, channel: str, data: dict, filename: str) -> None:
-        data[user_id] = { }
-        data[user_id]['channel'] = channel
-        self.__saveScheduleData(data, filename)
+    @cookie_schedule.before_loop
+    async def before_cookie_schedule(self):
+        await self.bot.wait_until_ready()
+        await genshin_app.waitUntilLoaded()
+
+    @resin_schedule.before_loop
+    async def before_resin_schedule(self):
+        await self.bot.wait_until_ready()
+        await genshin_app.waitUntilLoaded()
+        for user_id in self.__resin_dict.keys():
+            self.__scheduleResin(user_id)
 
-    def __remove_user(self, user_id: str, data: dict, filename: str) -> None:
+    def __ownsEntry(self, value: dict, file: WriteBehindJsonFile) -> Optional[bool]:
+        """訂閱是否由這個process負責；舊資料沒有記錄伺服器時，從頻道補上伺服器ID，仍無法判斷時回傳None"""
+        owns = shard_config.ownsEntry(value)
+        if owns is not None:
+            return owns
+        channel = self.bot.get_channel(int(value['channel']))
+        if channel == None:
+            return None
+        guild = getattr(channel, 'guild', None)
+        value['guild'] = str(guild.id) if guild else ''
+        file.markDirty()
+        return shard_config.ownsEntry(value)
+
+    def __add_user(self, user_id: str, channel: str, guild: Optional[discord.Guild], file: WriteBehindJsonFile) -> None:
+        file.data[user_id] = { }
+        file.data[user_id]['channel'] = channel
+        file.data[user_id]['guild'] = str(guild.id) if guild else ''
+        # 多個process共用檔案時，以設定時間判斷同一位使用者的哪一筆訂閱比較新
+        file.data[user_id]['updated_at'] = time.time()
+        file.markDirty()
+
+    def __remove_user(self, user_id: str, file: WriteBehindJsonFile) -> None:
         try:
-            del data[user_id]
+            del file.data[user_id]
         except:
-            log.error(f'__remove_user(self, user_id={user_id}, data: dict)')
+            log.error(f'__remove_user(self, user_id={user_id}, file={file.filename})')
         else:
-            self.__saveScheduleData(data, filename)
-    
-    def __saveScheduleData(self, data: dict, filename: str):
+            file.markDirty()
+
+    def __mergeScheduleData(self, data: dict, filename: str) -> dict:
+        """多個process共用同一個排程檔案時，只覆寫自己負責的訂閱，保留其他process的訂閱"""
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f)
-        except:
-            log.error(f'__saveScheduleData(data: dict, filename: {filename})')
+            with open(filename, 'r', encoding='utf-8') as f:
+                file_data = json.load(f)
+        except FileNotFoundError:
+            file_data = { }
+        merged, moved = shard_config.mergeEntries(data, file_data)
+        if len(moved) > 0:
+            # 在背景執行緒合併，移除記憶體中的舊訂閱需回到event loop執行
+            moved_at = {user_id: data[user_id].get('updated_at', 0) for user_id in moved}
+            try:
+                self.bot.loop.call_soon_threadsafe(self.__dropMovedEntries, filename, moved_at)
+            except RuntimeError:
+                pass
+        return merged
+
+    def __dropMovedEntries(self, filename: str, moved_at: Dict[str, float]) -> None:
+        """移除已改由其他process負責的舊訂閱，合併後才修改的訂閱保留"""
+        for file in (self.__daily_file, self.__resin_file, self.__redeem_file, self.__history_file):
+            if file.filename != filename:
+                continue
+            for user_id, updated_at in moved_at.items():
+                value = file.data.get(user_id)
+                if value is not None and value.get('updated_at', 0) <= updated_at:
+                    del file.data[user_id]
+                    log.info(f'{user_id}的訂閱已改由其他process負責 ({filename})')
 
 def setup(client):
     client.add_cog(Schedule(client))
\ No newline at end of file
@@ -1,16 +1,77 @@
+import time
+start_time = time.perf_counter()
+import os
+from dotenv import load_dotenv
+# 設定只在這裡讀取一次，之後匯入的模組直接使用環境變數
+load_dotenv()
+
 import discord
+import asyncio
 from discord.ext import commands
-from pathlib import Path
 
 from utility.CustomHelp import custom_help
+from utility.GenshinApp import genshin_app
 from utility.utils import log
-import os
-from dotenv import load_dotenv
-load_dotenv()
+from utility.LogPipeline import correlation_id
+from utility.Metrics import MetricsServer, COMMAND_SECONDS, COMMAND_ERRORS
+from utility.Sharding import shard_config
+from utility.Startup import StartupTimer, CogLoader
+from utility.Throttle import upstream_throttle
+
+startup_timer = StartupTimer(start_time)
+startup_timer.mark('匯入模組')
+startup_reported = False
+
+# 設定使用者呼叫指定的冷卻時間(秒數)，HoYoLAB請求被降速時冷卻時間等比例延長
+base_cooldown = float(os.getenv('BOT_COOLDOWN'))
+default_cooldown = commands.Cooldown(1, base_cooldown, commands.BucketType.user)
+
+# 設定METRICS_PORT時，在該埠匯出Prometheus格式的 /metrics
+metrics_server = MetricsServer(int(os.getenv('METRICS_PORT'))) if os.getenv('METRICS_PORT') else None
 
-# 設定使用者呼叫指定的冷卻時間(秒數)
-default_cooldown = commands.Cooldown(1, os.getenv('BOT_COOLDOWN'), commands.BucketType.user)
-client = commands.Bot(
+# 設定SHARD_COUNT時改用AutoShardedBot，詳見 utility/Sharding.py
+BotBase = commands.AutoShardedBot if shard_config.enabled else commands.Bot
+
+class GenshinBot(BotBase):
+    __user_sync_task = None
+
+    async def start(self, *args, **kwargs):
+        # 使用者資料在背景讀取，與連線Discord同時進行
+        genshin_app.startLoading().add_done_callback(lambda _: startup_timer.add('讀取使用者資料', genshin_app.load_seconds))
+        if metrics_server is not None:
+            await metrics_server.start()
+        # 多個process共用使用者資料時，定期同步其他process寫入的資料
+        self.__user_sync_task = asyncio.ensure_future(genshin_app.syncUserData()) if shard_config.multi_process else None
+        await super().start(*args, **kwargs)
+
+    async def get_context(self, message, *, cls=commands.Context):
+        ctx = await super().get_context(message, cls=cls)
+        # 延遲載入的cog在第一次使用其中的指令時才載入
+        if ctx.command is None and ctx.invoked_with is not None and cog_loader.loadFor(ctx.invoked_with):
+            ctx = await super().get_context(message, cls=cls)
+        elif ctx.command is not None and ctx.command.name == 'help':
+            cog_loader.loadAll()
+        # 每位使用者的冷卻在上次冷卻結束後才以範本重新建立，因此修改範本就會套用到之後的冷卻
+        default_cooldown.per = base_cooldown * upstream_throttle.pressure
+        return ctx
+
+    async def close(self):
+        # 關閉機器人時一併關閉共用的HoYoLAB連線，並等待使用者資料寫入完成
+        if metrics_server is not None:
+            await metrics_server.close()
+        if self.__user_sync_task is not None:
+            self.__user_sync_task.cancel()
+        await genshin_app.close()
+        await super().close()
+
+shard_kwargs = { }
+if shard_config.shard_count is not None:
+    shard_kwargs['shard_count'] = shard_config.shard_count
+if shard_config.shard_ids is not None:
+    shard_kwargs['shard_ids'] = shard_config.shard_ids
+
+client = GenshinBot(
+    **shard_kwargs,
     command_prefix=os.getenv("BOT_PREFIX"), 
     help_command=custom_help,
     description=f'Hello，原神小幫手的指令前綴為"{os.getenv("BOT_PREFIX")}"\n'
@@ -20,22 +81,51 @@ client = commands.Bot(
 
 @client.event
 async def on_ready():
+    global startup_reported
+    if startup_reported == False:
+        startup_timer.mark('連線Discord')
+        await genshin_app.waitUntilLoaded()
+        log.info(startup_timer.report())
+        startup_reported = True
     log.info(f'You have logged in as {client}')
     log.info(f'Total {len(client.guilds)} servers connected')
+    if shard_config.enabled:
+        log.info(f'Shards: {sorted(client.shards.keys())} / {client.shard_count}')
     for command in client.commands:
         command._buckets._cooldown = default_cooldown
     await client.change_presence(activity=discord.Game(name='Genshin Impact'))
 
+@client.before_invoke
+async def before_invoke(ctx):
+    ctx.start_time = time.perf_counter()
+    # 同一個指令產生的log都帶有相同的關聯ID
+    correlation_id.set(f'{ctx.command.qualified_name}-{ctx.message.id}')
+    # 剛啟動時使用者資料可能還在讀取中
+    await genshin_app.waitUntilLoaded()
+
+@client.after_invoke
+async def after_invoke(ctx):
+    if hasattr(ctx, 'start_time'):
+        COMMAND_SECONDS.observe(time.perf_counter() - ctx.start_time, ctx.command.qualified_name)
+
 @client.event
 async def on_command_error(ctx, error):
+    if ctx.command is not None:
+        COMMAND_ERRORS.inc(ctx.command.qualified_name)
     if isinstance(error, commands.CommandNotFound):
         return
     if isinstance(error, commands.MissingRequiredArgument):
         await ctx.send(f'指令缺少必要參數，請使用 `{os.getenv("BOT_PREFIX")}help {ctx.command}` 查看使用方式')
 
-# 從cogs資料夾載入所有cog
-for filepath in Path('./cogs').glob('**/*.py'):
-    cog_name = Path(filepath).stem
-    client.load_extension(f'cogs.{cog_name}')
+def on_cog_load(extension: str) -> None:
+    # 連線完成後才載入的cog也要套用冷卻時間
+    if client.is_ready():
+        for command in client.commands:
+            command._buckets._cooldown = default_cooldown
+
+# 從cogs資料夾載入cog，設定LAZY_COG_LOADING=0時在啟動時全部載入
+cog_loader = CogLoader(client, './cogs', lazy=os.getenv('LAZY_COG_LOADING', '1') != '0', on_load=on_cog_load)
+cog_loader.loadEager()
+startup_timer.mark('載入cog')
 
 client.run(os.getenv('BOT_TOKEN'))
\ No newline at end of file
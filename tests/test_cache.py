@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+from utility.Cache import AsyncTTLCache
+
+class AsyncTTLCacheTest(unittest.TestCase):
+    def test_single_flight(self) -> None:
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        async def run():
+            cache = AsyncTTLCache()
+            results = await asyncio.gather(*[cache.get('key', factory, 60) for _ in range(10)])
+            return results, await cache.get('key', factory, 60)
+        results, cached = asyncio.run(run())
+        # 同時發出的10次查詢只呼叫一次factory，之後的查詢命中快取
+        self.assertEqual(calls, 1)
+        self.assertEqual(results, ['value'] * 10)
+        self.assertEqual(cached, 'value')
+
+    def test_ttl_expiry(self) -> None:
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        async def run():
+            cache = AsyncTTLCache()
+            first = await cache.get('key', factory, 0.05)
+            second = await cache.get('key', factory, 0.05)
+            await asyncio.sleep(0.06)
+            third = await cache.get('key', factory, 0.05)
+            return first, second, third
+        self.assertEqual(asyncio.run(run()), (1, 1, 2))
+
+    def test_zero_ttl_is_not_stored(self) -> None:
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        async def run():
+            cache = AsyncTTLCache()
+            return [await cache.get('key', factory, 0) for _ in range(2)], len(cache)
+        self.assertEqual(asyncio.run(run()), ([1, 2], 0))
+
+    def test_failures_are_shared_and_not_cached(self) -> None:
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            if calls == 1:
+                raise ValueError('upstream')
+            return 'ok'
+
+        async def run():
+            cache = AsyncTTLCache()
+            results = await asyncio.gather(*[cache.get('key', factory, 60) for _ in range(3)], return_exceptions=True)
+            return results, await cache.get('key', factory, 60)
+        results, retried = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(retried, 'ok')
+        self.assertEqual(calls, 2)
+
+    def test_cancelled_waiter_does_not_cancel_others(self) -> None:
+        async def factory():
+            await asyncio.sleep(0.02)
+            return 'value'
+
+        async def run():
+            cache = AsyncTTLCache()
+            first = asyncio.ensure_future(cache.get('key', factory, 60))
+            second = asyncio.ensure_future(cache.get('key', factory, 60))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+        self.assertEqual(asyncio.run(run()), 'value')
+
+    def test_lru_eviction_and_invalidate(self) -> None:
+        cache = AsyncTTLCache(max_size=2)
+        cache.set(('1', 'notes'), 'a', 60)
+        cache.set(('2', 'notes'), 'b', 60)
+        cache.set(('3', 'notes'), 'c', 60)
+        self.assertEqual(len(cache), 2)
+
+        async def miss():
+            return 'miss'
+        # 最久沒使用的('1', 'notes')被淘汰
+        self.assertEqual(asyncio.run(cache.get(('1', 'notes'), miss, 0)), 'miss')
+        self.assertEqual(asyncio.run(cache.get(('2', 'notes'), miss, 0)), 'b')
+        cache.invalidate(lambda key: key[0] == '3')
+        self.assertEqual(len(cache), 1)
+
+if __name__ == '__main__':
+    unittest.main()
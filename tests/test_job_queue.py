@@ -0,0 +1,97 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from utility.JobQueue import JobQueue, DONE, FAILED, SKIPPED, IN_FLIGHT
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.jobs = JobQueue(os.path.join(self.tmpdir.name, 'jobs.db'))
+
+    def tearDown(self) -> None:
+        self.jobs.close()
+        self.tmpdir.cleanup()
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_skipped_users_are_not_recorded_as_success(self) -> None:
+        results = {'1': True, '2': SKIPPED, '3': False}
+
+        async def handler(user_id: str):
+            return results[user_id]
+
+        async def run():
+            await self.jobs.createRun('daily_reward', 'd1', results.keys())
+            await self.jobs.process('daily_reward', 'd1', handler, concurrency=3)
+            return (
+                await self.jobs.getStats('daily_reward', 'd1'),
+                [await self.jobs.getLastSuccess('daily_reward', user_id) for user_id in results]
+            )
+        stats, last_success = self.run_async(run())
+        self.assertEqual(stats, {DONE: 1, SKIPPED: 1, FAILED: 1})
+        self.assertIsNotNone(last_success[0])
+        self.assertIsNone(last_success[1])
+        self.assertIsNone(last_success[2])
+
+    def test_skipped_users_are_not_retried(self) -> None:
+        async def run():
+            await self.jobs.createRun('daily_reward', 'd1', ['1'])
+            await self.jobs.process('daily_reward', 'd1', lambda user_id: asyncio.sleep(0, SKIPPED), concurrency=1)
+            await self.jobs.retryFailed('daily_reward', 'd1', max_attempts=3, retry_after=0)
+            return await self.jobs.getPending('daily_reward', 'd1')
+        self.assertEqual(self.run_async(run()), [])
+
+    def test_recover_interrupted_jobs(self) -> None:
+        async def run():
+            started = asyncio.Event()
+
+            async def handler(user_id: str) -> bool:
+                started.set()
+                await asyncio.sleep(3600)
+                return True
+            await self.jobs.createRun('daily_reward', 'd1', ['1'])
+            task = asyncio.ensure_future(self.jobs.process('daily_reward', 'd1', handler, concurrency=1))
+            await started.wait()
+            # 模擬關閉時中斷的工作
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await self.jobs.getStats('daily_reward', 'd1')
+        self.assertEqual(self.run_async(run()), {IN_FLIGHT: 1})
+        self.jobs.close()
+
+        # 重新啟動後恢復為pending並再次處理
+        self.jobs = JobQueue(os.path.join(self.tmpdir.name, 'jobs.db'))
+
+        async def restart():
+            recovered = await self.jobs.recover('daily_reward')
+            pending = await self.jobs.getPending('daily_reward', 'd1')
+            await self.jobs.process('daily_reward', 'd1', lambda user_id: asyncio.sleep(0, True), concurrency=1)
+            return recovered, pending, await self.jobs.getStats('daily_reward', 'd1')
+        self.assertEqual(self.run_async(restart()), (1, ['1'], {DONE: 1}))
+
+    def test_retry_failed_until_max_attempts(self) -> None:
+        calls = []
+
+        async def handler(user_id: str) -> bool:
+            calls.append(user_id)
+            return False
+
+        async def run():
+            await self.jobs.createRun('daily_reward', 'd1', ['1'])
+            await self.jobs.process('daily_reward', 'd1', handler, concurrency=1)
+            # 失敗時間還沒超過retry_after時不重試
+            not_yet = await self.jobs.retryFailed('daily_reward', 'd1', max_attempts=2, retry_after=3600)
+            first = await self.jobs.retryFailed('daily_reward', 'd1', max_attempts=2, retry_after=0)
+            pending = await self.jobs.getPending('daily_reward', 'd1')
+            await self.jobs.process('daily_reward', 'd1', handler, concurrency=1)
+            # 已失敗max_attempts次，不再重試
+            second = await self.jobs.retryFailed('daily_reward', 'd1', max_attempts=2, retry_after=0)
+            return not_yet, first, pending, second, await self.jobs.getStats('daily_reward', 'd1')
+        self.assertEqual(self.run_async(run()), (0, 1, ['1'], 0, {FAILED: 1}))
+        self.assertEqual(calls, ['1', '1'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+import discord
+from utility.Outbox import Outbox
+
+def httpError(cls, status: int) -> discord.HTTPException:
+    return cls(SimpleNamespace(status=status, reason='error'), 'error')
+
+class FakeChannel:
+    def __init__(self, errors) -> None:
+        self.id = 1
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, content, embed=None):
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        self.sent.append((content, embed))
+
+class FakeBot:
+    def __init__(self, channel) -> None:
+        self.channel = channel
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+class OutboxTest(unittest.TestCase):
+    def run_outbox(self, channel, users: int = 3):
+        failed = []
+
+        async def run():
+            outbox = Outbox(FakeBot(channel), rate=100, channel_interval=0, delay=0, max_attempts=3, retry_delay=0)
+            for i in range(users):
+                outbox.post(1, '[自動簽到]', str(i), '', f'<@{i}> ok', on_failed=failed.append)
+            await outbox.flush()
+        asyncio.run(run())
+        return failed
+
+    def test_transient_error_is_retried(self) -> None:
+        channel = FakeChannel([httpError(discord.HTTPException, 503), asyncio.TimeoutError()])
+        failed = self.run_outbox(channel)
+        self.assertEqual(len(channel.sent), 1)
+        self.assertEqual(failed, [])
+
+    def test_transient_failure_keeps_subscriptions(self) -> None:
+        channel = FakeChannel([httpError(discord.HTTPException, 503)] * 3)
+        failed = self.run_outbox(channel)
+        self.assertEqual(channel.sent, [])
+        self.assertEqual(failed, [])
+
+    def test_invalid_message_is_dropped_without_unsubscribing(self) -> None:
+        channel = FakeChannel([httpError(discord.HTTPException, 400)])
+        failed = self.run_outbox(channel)
+        self.assertEqual(channel.sent, [])
+        self.assertEqual(failed, [])
+
+    def test_forbidden_unsubscribes_everyone_in_digest(self) -> None:
+        channel = FakeChannel([httpError(discord.Forbidden, 403)])
+        self.assertEqual(sorted(self.run_outbox(channel)), ['0', '1', '2'])
+
+    def test_missing_channel_unsubscribes(self) -> None:
+        self.assertEqual(sorted(self.run_outbox(None)), ['0', '1', '2'])
+
+class OutboxChunkTest(unittest.TestCase):
+    def post_all(self, entries):
+        """以(標題, user_id, 內容)發送所有結果，回傳頻道收到的訊息"""
+        channel = FakeChannel([])
+
+        async def run():
+            outbox = Outbox(FakeBot(channel), rate=100, channel_interval=0, delay=0)
+            for title, user_id, value in entries:
+                outbox.post(1, title, user_id, 'name', value)
+            await outbox.flush()
+        asyncio.run(run())
+        return channel.sent
+
+    def test_field_count_limit(self) -> None:
+        sent = self.post_all([('[自動簽到]', str(i), 'ok') for i in range(60)])
+        self.assertEqual([len(embed.fields) for _, embed in sent], [25, 25, 10])
+        mentions = ' '.join(content for content, _ in sent).split()
+        self.assertEqual(mentions, [f'<@{i}>' for i in range(60)])
+
+    def test_embed_length_limit(self) -> None:
+        sent = self.post_all([('[自動簽到]', str(i), 'x' * 1000) for i in range(20)])
+        self.assertGreater(len(sent), 1)
+        self.assertEqual(sum(len(embed.fields) for _, embed in sent), 20)
+        for _, embed in sent:
+            self.assertLessEqual(len(embed), Outbox.MAX_EMBED_LENGTH)
+
+    def test_content_length_limit(self) -> None:
+        user_ids = [str(i).zfill(200) for i in range(20)]
+        sent = self.post_all([('[自動簽到]', user_id, 'ok') for user_id in user_ids])
+        self.assertGreater(len(sent), 1)
+        for content, _ in sent:
+            self.assertLessEqual(len(content), Outbox.MAX_CONTENT_LENGTH)
+        self.assertEqual(' '.join(content for content, _ in sent).split(), [f'<@{user_id}>' for user_id in user_ids])
+
+    def test_long_value_is_truncated(self) -> None:
+        sent = self.post_all([('[自動簽到]', '1', 'x' * 2000)])
+        value = sent[0][1].fields[0].value
+        self.assertEqual(len(value), Outbox.MAX_FIELD_VALUE)
+        self.assertTrue(value.endswith('…'))
+
+    def test_titles_are_sent_separately(self) -> None:
+        sent = self.post_all([('[自動簽到]', '1', 'ok'), ('[自動兌換]', '2', 'ok'), ('[自動簽到]', '3', 'ok')])
+        self.assertEqual([(embed.title, content) for content, embed in sent], [('[自動簽到]', '<@1> <@3>'), ('[自動兌換]', '<@2>')])
+
+if __name__ == '__main__':
+    unittest.main()
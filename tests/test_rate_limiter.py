@@ -0,0 +1,81 @@
+import time
+import asyncio
+import unittest
+from utility.LogPipeline import correlation_id
+from utility.RateLimiter import TokenBucket, runRateLimited
+from utility.Throttle import upstream_priority, BULK, INTERACTIVE
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self) -> None:
+        async def run():
+            bucket = TokenBucket(rate=50, capacity=5)
+            start = time.monotonic()
+            # 前5個token立即取得，之後每個需要等待1/50秒
+            for _ in range(15):
+                await bucket.acquire()
+            return time.monotonic() - start
+        elapsed = asyncio.run(run())
+        self.assertGreaterEqual(elapsed, 10 / 50 * 0.9)
+        self.assertLess(elapsed, 10 / 50 + 0.2)
+
+class RunRateLimitedTest(unittest.TestCase):
+    def test_concurrency_limit_and_failures(self) -> None:
+        running = 0
+        max_running = 0
+
+        async def worker(item: int) -> None:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if item % 5 == 0:
+                raise Exception('failed')
+
+        stats = asyncio.run(runRateLimited(range(20), worker, concurrency=3, name='test'))
+        self.assertEqual(stats, {'total': 20, 'done': 16, 'failed': 4})
+        self.assertEqual(max_running, 3)
+
+    def test_buckets_are_acquired_per_item(self) -> None:
+        acquired = []
+
+        class RecordingBucket(TokenBucket):
+            async def acquire(self, tokens: float = 1.0) -> None:
+                acquired.append(self)
+                await super().acquire(tokens)
+
+        async def run():
+            global_bucket, region_bucket = RecordingBucket(1000), RecordingBucket(1000)
+            await runRateLimited(
+                range(4), lambda item: asyncio.sleep(0), concurrency=2,
+                buckets=lambda item: [global_bucket, region_bucket] if item % 2 else [global_bucket]
+            )
+            return global_bucket, region_bucket
+        global_bucket, region_bucket = asyncio.run(run())
+        self.assertEqual(acquired.count(global_bucket), 4)
+        self.assertEqual(acquired.count(region_bucket), 2)
+
+    def test_empty_items(self) -> None:
+        stats = asyncio.run(runRateLimited([], lambda item: asyncio.sleep(0), concurrency=3))
+        self.assertEqual(stats, {'total': 0, 'done': 0, 'failed': 0})
+
+    def test_context_is_restored_after_run(self) -> None:
+        seen = []
+
+        async def worker(item) -> None:
+            seen.append((upstream_priority.get(), correlation_id.get()))
+
+        async def run():
+            before = correlation_id.get()
+            stats = await runRateLimited(range(3), worker, concurrency=2, name='test')
+            # 執行結束後呼叫端回到互動優先順序，並且沒有沿用這次的關聯ID
+            return stats, before, upstream_priority.get(), correlation_id.get()
+        stats, before, priority, after = asyncio.run(run())
+        self.assertEqual(stats, {'total': 3, 'done': 3, 'failed': 0})
+        self.assertTrue(all(p == BULK for p, _ in seen))
+        self.assertEqual(len({c for _, c in seen}), 1)
+        self.assertEqual(priority, INTERACTIVE)
+        self.assertEqual(after, before)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import math
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from utility.ResinScheduler import ResinScheduler
+
+NOW = 1_700_000_000.0
+
+def notes(resin: int, realm: int = 0, max_realm: int = 0, realm_full_at: float = math.inf):
+    recovered_at = datetime.fromtimestamp(realm_full_at if realm_full_at != math.inf else NOW + 10 ** 8)
+    return SimpleNamespace(
+        current_resin=resin, max_resin=160,
+        current_realm_currency=realm, max_realm_currency=max_realm, realm_currency_recovered_at=recovered_at
+    )
+
+class ResinSchedulerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # 檢查間隔上限設得很長，只測試樹脂與寶錢的預測
+        self.scheduler = ResinScheduler(150, renotify_interval=3600, max_interval=10 ** 7, window=600)
+
+    def test_new_user_is_due_once(self) -> None:
+        self.scheduler.add('1', due=NOW)
+        self.assertEqual(self.scheduler.popDue(NOW - 1), [])
+        self.assertEqual(self.scheduler.popDue(NOW), ['1'])
+        # 取出後在reschedule之前不會再被取出
+        self.assertEqual(self.scheduler.popDue(NOW + 10 ** 6), [])
+
+    def test_resin_forecast(self) -> None:
+        self.scheduler.add('1', due=NOW)
+        self.scheduler.popDue(NOW)
+        due_at = self.scheduler.reschedule('1', notes(100), now=NOW)
+        # 還差50樹脂，每8分鐘恢復1，提前window秒檢查
+        self.assertEqual(due_at, NOW + 50 * ResinScheduler.RESIN_RECOVERY_SECONDS - 600)
+        self.assertEqual(self.scheduler.popDue(due_at - 1), [])
+        self.assertEqual(self.scheduler.popDue(due_at), ['1'])
+
+    def test_alerted_user_waits_renotify_interval(self) -> None:
+        self.scheduler.add('1', due=NOW)
+        self.scheduler.popDue(NOW)
+        self.scheduler.reschedule('1', notes(155), now=NOW)
+        self.assertEqual(self.scheduler.popDue(NOW + 3599), [])
+        self.assertEqual(self.scheduler.popDue(NOW + 3600), ['1'])
+
+    def test_failed_fetch_keeps_snapshot(self) -> None:
+        self.scheduler.add('1', due=NOW)
+        self.scheduler.popDue(NOW)
+        self.scheduler.reschedule('1', None, now=NOW)
+        self.assertEqual(self.scheduler.popDue(NOW + 3599), [])
+        self.assertEqual(self.scheduler.popDue(NOW + 3600), ['1'])
+
+    def test_realm_currency_notified_once(self) -> None:
+        self.scheduler.add('1', due=NOW)
+        self.scheduler.popDue(NOW)
+        full_at = NOW + 7200
+        self.scheduler.reschedule('1', notes(0, 1000, 2400, full_at), now=NOW)
+        self.assertEqual(self.scheduler.popDue(full_at - 601), [])
+        self.assertEqual(self.scheduler.popDue(full_at - 600), ['1'])
+        full_notes = notes(0, 2400, 2400, full_at)
+        self.assertTrue(self.scheduler.isRealmAlert('1', full_notes, now=full_at))
+        self.scheduler.reschedule('1', full_notes, now=full_at)
+        # 已提醒過，寶錢被使用前不會再提醒
+        self.assertFalse(self.scheduler.isRealmAlert('1', full_notes, now=full_at))
+        self.assertEqual(self.scheduler.popDue(full_at + 3600), [])
+
+    def test_remove_and_reuse_slot(self) -> None:
+        for i in range(100):
+            self.scheduler.add(str(i), due=NOW)
+        for i in range(0, 100, 2):
+            self.scheduler.remove(str(i))
+        self.assertEqual(len(self.scheduler), 50)
+        self.scheduler.add('new', due=NOW)
+        due = self.scheduler.popDue(NOW)
+        self.assertEqual(len(due), 51)
+        self.assertIn('new', due)
+        self.assertNotIn('0', due)
+
+if __name__ == '__main__':
+    unittest.main()
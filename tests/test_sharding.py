@@ -0,0 +1,80 @@
+import unittest
+from utility.Sharding import ShardConfig, parseShardIds
+
+# (guild_id >> 22) % 2 決定伺服器屬於哪個分片
+GUILD_SHARD_0 = str(2 << 22)
+GUILD_SHARD_1 = str(1 << 22)
+
+def entry(guild: str, updated_at: float) -> dict:
+    return {'channel': '1', 'guild': guild, 'updated_at': updated_at}
+
+class OwnershipTest(unittest.TestCase):
+    def test_single_process_owns_everything(self) -> None:
+        config = ShardConfig(None, None, False)
+        self.assertTrue(config.ownsGuild(GUILD_SHARD_1))
+        self.assertTrue(config.ownsEntry({'channel': '1'}))
+        self.assertEqual(config.label, 'all')
+
+    def test_multi_process_ownership(self) -> None:
+        config = ShardConfig(2, [0], True)
+        self.assertTrue(config.multi_process)
+        self.assertTrue(config.ownsGuild(GUILD_SHARD_0))
+        self.assertFalse(config.ownsGuild(GUILD_SHARD_1))
+        # 私訊由分片0負責
+        self.assertTrue(config.ownsGuild(None))
+        self.assertFalse(ShardConfig(2, [1], True).ownsGuild(None))
+
+    def test_entry_ownership(self) -> None:
+        config = ShardConfig(2, [1], True)
+        self.assertTrue(config.ownsEntry({'channel': '1', 'guild': GUILD_SHARD_1}))
+        self.assertFalse(config.ownsEntry({'channel': '1', 'guild': GUILD_SHARD_0}))
+        self.assertFalse(config.ownsEntry({'channel': '1', 'guild': ''}))
+        # 舊資料沒有記錄伺服器時無法判斷
+        self.assertIsNone(config.ownsEntry({'channel': '1'}))
+
+class MergeEntriesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # 兩個process各負責一個分片，共用同一個排程檔案
+        self.process0 = ShardConfig(2, [0], True)
+        self.process1 = ShardConfig(2, [1], True)
+
+    def test_keeps_other_process_entries(self) -> None:
+        shared = {'a': entry(GUILD_SHARD_0, 1), 'b': entry(GUILD_SHARD_1, 1)}
+        # process0 新增c、移除a
+        merged, moved = self.process0.mergeEntries({'c': entry(GUILD_SHARD_0, 2)}, shared)
+        self.assertEqual(set(merged), {'b', 'c'})
+        self.assertEqual(moved, [])
+        # process1 移除b，process0 的c仍保留
+        merged, moved = self.process1.mergeEntries({}, merged)
+        self.assertEqual(set(merged), {'c'})
+
+    def test_subscription_moved_to_other_process(self) -> None:
+        shared = {'u': entry(GUILD_SHARD_0, 1)}
+        local0 = {'u': entry(GUILD_SHARD_0, 1)}
+        # 使用者改在process1負責的伺服器設定，process1先寫入
+        shared, moved = self.process1.mergeEntries({'u': entry(GUILD_SHARD_1, 2)}, shared)
+        self.assertEqual(shared['u']['guild'], GUILD_SHARD_1)
+        self.assertEqual(moved, [])
+        # process0 之後寫入時不能以舊訂閱蓋掉新的訂閱
+        shared, moved = self.process0.mergeEntries(local0, shared)
+        self.assertEqual(shared['u']['guild'], GUILD_SHARD_1)
+        self.assertEqual(moved, ['u'])
+
+    def test_newer_local_subscription_wins(self) -> None:
+        # 使用者又改回process0的伺服器，process1還沒寫入，檔案中仍是process1的舊訂閱
+        shared = {'u': entry(GUILD_SHARD_1, 2)}
+        shared, moved = self.process0.mergeEntries({'u': entry(GUILD_SHARD_0, 3)}, shared)
+        self.assertEqual(shared['u']['guild'], GUILD_SHARD_0)
+        self.assertEqual(moved, [])
+        # process1 的舊訂閱比檔案中的舊，被捨棄
+        shared, moved = self.process1.mergeEntries({'u': entry(GUILD_SHARD_1, 2)}, shared)
+        self.assertEqual(shared['u']['guild'], GUILD_SHARD_0)
+        self.assertEqual(moved, ['u'])
+
+class ParseShardIdsTest(unittest.TestCase):
+    def test_ranges_and_lists(self) -> None:
+        self.assertEqual(parseShardIds('0-1,4'), [0, 1, 4])
+        self.assertEqual(parseShardIds('2, 0,2'), [0, 2])
+
+if __name__ == '__main__':
+    unittest.main()
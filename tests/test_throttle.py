@@ -0,0 +1,116 @@
+import time
+import asyncio
+import unittest
+from unittest import mock
+from utility.Throttle import PriorityTokenBucket, CircuitBreaker, INTERACTIVE, BULK
+
+class PriorityTokenBucketTest(unittest.TestCase):
+    def test_interactive_served_before_bulk(self) -> None:
+        async def run():
+            bucket = PriorityTokenBucket(rate=20, capacity=1)
+            await bucket.acquire()
+            order = []
+
+            async def take(priority: int, tag: str) -> None:
+                await bucket.acquire(priority)
+                order.append(tag)
+            # 排程請求先排隊，之後的互動指令仍然先取得token
+            bulk = [asyncio.ensure_future(take(BULK, f'bulk{i}')) for i in range(3)]
+            await asyncio.sleep(0)
+            interactive = asyncio.ensure_future(take(INTERACTIVE, 'interactive'))
+            await asyncio.gather(*bulk, interactive)
+            return order
+        self.assertEqual(asyncio.run(run()), ['interactive', 'bulk0', 'bulk1', 'bulk2'])
+
+    def test_acquire_timeout(self) -> None:
+        async def run():
+            bucket = PriorityTokenBucket(rate=1, capacity=1)
+            await bucket.acquire()
+            with self.assertRaises(asyncio.TimeoutError):
+                await bucket.acquire(INTERACTIVE, timeout=0.05)
+            # 逾時的請求不會佔用之後的token
+            await asyncio.sleep(1.0)
+            await asyncio.wait_for(bucket.acquire(), 0.1)
+        asyncio.run(run())
+
+    def test_penalize_and_reward(self) -> None:
+        bucket = PriorityTokenBucket(rate=16)
+        bucket.penalize()
+        self.assertEqual(bucket.rate, 8)
+        self.assertEqual(bucket.pressure, 2)
+        # 同一秒內多次減速只算一次
+        bucket.penalize()
+        self.assertEqual(bucket.rate, 8)
+        for _ in range(100):
+            bucket.reward()
+        self.assertEqual(bucket.rate, 16)
+        self.assertEqual(bucket.pressure, 1)
+
+    def test_penalize_stops_at_min_rate(self) -> None:
+        bucket = PriorityTokenBucket(rate=16, min_rate=4)
+        now = time.monotonic()
+        for i in range(5):
+            with mock.patch('utility.Throttle.time.monotonic', return_value=now + 2 * i):
+                bucket.penalize()
+        self.assertEqual(bucket.rate, 4)
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = time.monotonic()
+        patcher = mock.patch('utility.Throttle.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_opens_after_threshold(self) -> None:
+        breaker = CircuitBreaker('test_threshold', failure_threshold=3, open_seconds=30)
+        for _ in range(2):
+            breaker.failure()
+        self.assertEqual(breaker.retryAfter(), 0)
+        breaker.failure()
+        self.assertAlmostEqual(breaker.retryAfter(), 30)
+
+    def test_success_resets_failures(self) -> None:
+        breaker = CircuitBreaker('test_reset', failure_threshold=3)
+        breaker.failure()
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        breaker.failure()
+        self.assertEqual(breaker.retryAfter(), 0)
+
+    def test_half_open_allows_single_probe(self) -> None:
+        breaker = CircuitBreaker('test_probe', failure_threshold=1, open_seconds=30)
+        breaker.failure()
+        self.now += 31
+        self.assertEqual(breaker.retryAfter(), 0)
+        breaker.begin()
+        # 試探請求還沒有結果時其他請求需要等待
+        self.assertGreater(breaker.retryAfter(), 0)
+        breaker.success()
+        self.assertEqual(breaker.retryAfter(), 0)
+
+    def test_failed_probe_doubles_open_time(self) -> None:
+        breaker = CircuitBreaker('test_backoff', failure_threshold=1, open_seconds=30, max_open_seconds=100)
+        breaker.failure()
+        for expected in (60, 100, 100):
+            self.now += 200
+            breaker.begin()
+            breaker.failure()
+            self.assertAlmostEqual(breaker.retryAfter(), expected)
+        # 成功後開啟時間回到初始值
+        self.now += 200
+        breaker.begin()
+        breaker.success()
+        breaker.failure()
+        self.assertAlmostEqual(breaker.retryAfter(), 30)
+
+    def test_neutral_releases_probe(self) -> None:
+        breaker = CircuitBreaker('test_neutral', failure_threshold=1, open_seconds=30)
+        breaker.failure()
+        self.now += 31
+        breaker.begin()
+        breaker.neutral()
+        self.assertEqual(breaker.retryAfter(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
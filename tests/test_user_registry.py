@@ -0,0 +1,46 @@
+import unittest
+from utility.UserRegistry import UserRecord, UserRegistry
+
+class UserRegistryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = UserRegistry()
+        self.registry.set('123456789', UserRecord('ltuid=1; ltoken=abc', '800000001'))
+
+    def test_get_accepts_str_and_int(self) -> None:
+        self.assertIsNotNone(self.registry.get('123456789'))
+        self.assertIs(self.registry.get(123456789), self.registry.get('123456789'))
+
+    def test_non_numeric_id_is_missing(self) -> None:
+        # 指令參數不是提及或數字ID時(例如 `!g foo`)，應回覆找不到使用者而不是拋出例外
+        for user_id in ('', 'foo', 'pf', None):
+            self.assertIsNone(self.registry.get(user_id))
+            self.assertNotIn(user_id, self.registry)
+            self.assertIsNone(self.registry.pop(user_id))
+        self.assertEqual(len(self.registry), 1)
+
+    def test_set_uid_swaps_saved_accounts(self) -> None:
+        self.registry.addAccount('123456789', 'ltuid=1; ltoken=abc', '800000002')
+        self.registry.setUID('123456789', '800000002')
+        record = self.registry.get('123456789')
+        self.assertEqual([a.uid for a in record.accounts], ['800000002', '800000001'])
+        self.assertEqual(self.registry.findByUID('800000001'), {123456789})
+
+    def test_set_uid_rejects_unsaved_uid(self) -> None:
+        # 不屬於已保存角色的UID不能蓋掉原本的主要角色
+        self.registry.addAccount('123456789', 'ltuid=1; ltoken=abc', '800000002')
+        with self.assertRaises(ValueError):
+            self.registry.setUID('123456789', '800000009')
+        record = self.registry.get('123456789')
+        self.assertEqual([a.uid for a in record.accounts], ['800000001', '800000002'])
+        self.assertEqual(self.registry.findByUID('800000001'), {123456789})
+        self.assertEqual(self.registry.findByUID('800000009'), set())
+
+    def test_set_uid_on_record_without_uid(self) -> None:
+        # 舊資料只有Cookie、還沒有選擇UID時可以直接設定
+        self.registry.set('42', UserRecord('ltuid=2; ltoken=def'))
+        self.registry.setUID('42', '800000003')
+        self.assertEqual(self.registry.get('42').uid, '800000003')
+        self.assertEqual(self.registry.findByUID('800000003'), {42})
+
+if __name__ == '__main__':
+    unittest.main()
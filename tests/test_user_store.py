@@ -0,0 +1,49 @@
+import os
+import json
+import tempfile
+import unittest
+from utility.UserStore import UserStore, JsonUserStore, SQLiteUserStore
+
+class UserStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.json_filename = os.path.join(self.tmpdir.name, 'user_data.json')
+        self.db_filename = os.path.join(self.tmpdir.name, 'user_data.db')
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def test_base_class_is_abstract(self) -> None:
+        with self.assertRaises(TypeError):
+            UserStore()
+
+    def test_switch_between_json_and_sqlite_keeps_users(self) -> None:
+        with open(self.json_filename, 'w', encoding='utf-8') as f:
+            json.dump({'1': {'cookie': 'a', 'uid': '800000001'}}, f)
+        # json -> sqlite：匯入後JSON改名為.bak
+        store = SQLiteUserStore(self.db_filename, legacy_json_filename=self.json_filename)
+        self.assertEqual(set(store.load()), {'1'})
+        store.upsert('2', {'cookie': 'b', 'uid': '800000002'})
+        store.close()
+        self.assertFalse(os.path.exists(self.json_filename))
+        # sqlite -> json：從資料庫匯入，包含使用SQLite期間新增的使用者
+        store = JsonUserStore(self.json_filename, sqlite_filename=self.db_filename)
+        self.assertEqual(set(store.load()), {'1', '2'})
+        store.delete('1')
+        store.close()
+        self.assertFalse(os.path.exists(self.db_filename))
+        # json -> sqlite：再次從JSON匯入，包含使用JSON期間的變更
+        store = SQLiteUserStore(self.db_filename, legacy_json_filename=self.json_filename)
+        self.assertEqual(set(store.load()), {'2'})
+        store.close()
+
+    def test_json_falls_back_to_backup_without_database(self) -> None:
+        with open(self.json_filename + '.bak', 'w', encoding='utf-8') as f:
+            json.dump({'1': {'cookie': 'a'}}, f)
+        store = JsonUserStore(self.json_filename, sqlite_filename=self.db_filename)
+        self.assertEqual(store.load(), {'1': {'cookie': 'a'}})
+        store.close()
+        self.assertTrue(os.path.exists(self.json_filename))
+
+if __name__ == '__main__':
+    unittest.main()
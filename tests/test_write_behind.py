@@ -0,0 +1,104 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+import multiprocessing
+from utility.WriteBehind import WriteBehindJsonFile
+
+def mergeByPrefix(prefix: str):
+    """只覆寫以prefix開頭的key，其他key保留檔案中的內容(模擬多個process共用排程檔案)"""
+    def merge(data: dict, filename: str) -> dict:
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                file_data = json.load(f)
+        except FileNotFoundError:
+            file_data = { }
+        merged = {key: value for key, value in file_data.items() if not key.startswith(prefix)}
+        merged.update(data)
+        return merged
+    return merge
+
+def writeEntries(filename: str, prefix: str, count: int) -> None:
+    data = { }
+    file = WriteBehindJsonFile(filename, data, merge=mergeByPrefix(prefix))
+    for i in range(count):
+        data[f'{prefix}{i}'] = i
+        # 沒有event loop時markDirty立即寫入
+        file.markDirty()
+
+class WriteBehindJsonFileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'schedule.json')
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def read(self) -> dict:
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_writes_are_debounced(self) -> None:
+        writes = []
+
+        def merge(data: dict, filename: str) -> dict:
+            writes.append(dict(data))
+            return data
+
+        async def run():
+            data = { }
+            file = WriteBehindJsonFile(self.filename, data, delay=0.05, merge=merge)
+            for i in range(10):
+                data[str(i)] = i
+                file.markDirty()
+            self.assertFalse(os.path.exists(self.filename))
+            await asyncio.sleep(0.1)
+            self.assertFalse(file.dirty)
+        asyncio.run(run())
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(len(self.read()), 10)
+
+    def test_batch_defers_until_exit(self) -> None:
+        async def run():
+            data = { }
+            file = WriteBehindJsonFile(self.filename, data, delay=0.01)
+            with file.batch():
+                data['a'] = 1
+                file.markDirty()
+                await asyncio.sleep(0.05)
+                self.assertFalse(os.path.exists(self.filename))
+            await asyncio.sleep(0.05)
+        asyncio.run(run())
+        self.assertEqual(self.read(), {'a': 1})
+
+    def test_flush_sync_writes_pending_changes(self) -> None:
+        async def run():
+            data = {'a': 1}
+            file = WriteBehindJsonFile(self.filename, data, delay=60)
+            file.markDirty()
+            return file
+        file = asyncio.run(run())
+        self.assertTrue(file.dirty)
+        file.flushSync()
+        self.assertEqual(self.read(), {'a': 1})
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+    def test_merge_keeps_other_process_entries(self) -> None:
+        writeEntries(self.filename, 'a', 3)
+        writeEntries(self.filename, 'b', 2)
+        self.assertEqual(set(self.read()), {'a0', 'a1', 'a2', 'b0', 'b1'})
+
+    def test_concurrent_processes_do_not_lose_entries(self) -> None:
+        # 多個process同時讀取、合併、寫入同一個檔案，持有檔案鎖時不會蓋掉其他process的修改
+        processes = [
+            multiprocessing.Process(target=writeEntries, args=(self.filename, f'p{i}-', 100)) for i in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(len(self.read()), 400)
+
+if __name__ == '__main__':
+    unittest.main()
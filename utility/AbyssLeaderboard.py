@@ -0,0 +1,194 @@
+import json
+import time
+import sqlite3
+import asyncio
+import genshin
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from .utils import log, getCharacterName
+from .Metrics import USER_STORE_WRITE_SECONDS
+
+class AbyssLeaderboard:
+    """以SQLite保存每個伺服器、每一期深境螺旋的排行與角色、隊伍使用次數
+    成員在伺服器中查詢深淵時加入該伺服器的排行，之後每次取得此UID的深淵資料都只更新這位成員的一列，
+    使用次數依新舊隊伍的差異增減，查詢排行只需要讀取索引，不需要向HoYoLAB請求每位成員的資料
+    """
+    # 隊伍與角色使用次數只統計第12層
+    TEAM_FLOOR = 12
+
+    def __init__(self, filename: str) -> None:
+        self.__filename = filename
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AbyssLeaderboard')
+        self.__conn: Optional[sqlite3.Connection] = None
+
+    def join(self, guild_id: str, user_id: str, uid: str) -> None:
+        """使用者以此UID加入伺服器的排行，之後取得此UID的深淵資料時會更新排行"""
+        self.__write(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO guild_members (guild_id, user_id, uid) VALUES (?, ?, ?)', (str(guild_id), str(user_id), str(uid))
+        ))
+
+    def leave(self, user_id: str) -> None:
+        """將使用者從所有伺服器的排行移除，並扣除他的使用次數"""
+        user_id = str(user_id)
+
+        def run(conn: sqlite3.Connection) -> None:
+            rows = conn.execute('SELECT guild_id, season, teams FROM abyss_board WHERE user_id=?', (user_id,)).fetchall()
+            for guild_id, season, teams in rows:
+                self.__addUsage(conn, guild_id, season, json.loads(teams), -1)
+            conn.execute('DELETE FROM abyss_board WHERE user_id=?', (user_id,))
+            conn.execute('DELETE FROM guild_members WHERE user_id=?', (user_id,))
+        self.__write(run)
+
+    def update(self, uid: str, abyss: genshin.models.SpiralAbyss) -> None:
+        """以最新取得的深淵資料更新此UID所在的所有伺服器排行，資料沒有變動時不寫入"""
+        if abyss.season <= 0 or abyss.total_battles == 0:
+            return
+        summary = (abyss.total_stars, self.__floorNumber(abyss.max_floor), abyss.max_floor, abyss.total_battles)
+        teams = sorted({
+            tuple(getCharacterName(c) for c in sorted(battle.characters, key=lambda c: c.id))
+            for floor in abyss.floors if floor.floor == self.TEAM_FLOOR
+            for chamber in floor.chambers
+            for battle in chamber.battles
+        })
+        teams_json = json.dumps(teams, ensure_ascii=False)
+        uid = str(uid)
+
+        def run(conn: sqlite3.Connection) -> None:
+            members = conn.execute('SELECT guild_id, user_id FROM guild_members WHERE uid=?', (uid,)).fetchall()
+            for guild_id, user_id in members:
+                row = conn.execute(
+                    'SELECT stars, floor, max_floor, battles, teams FROM abyss_board WHERE guild_id=? AND season=? AND user_id=?',
+                    (guild_id, abyss.season, user_id)
+                ).fetchone()
+                if row is not None and tuple(row[:4]) == summary and row[4] == teams_json:
+                    continue
+                if row is not None:
+                    self.__addUsage(conn, guild_id, abyss.season, json.loads(row[4]), -1)
+                self.__addUsage(conn, guild_id, abyss.season, teams, 1)
+                conn.execute(
+                    'INSERT OR REPLACE INTO abyss_board (guild_id, season, user_id, uid, stars, floor, max_floor, battles, teams) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (guild_id, abyss.season, user_id, uid, *summary, teams_json)
+                )
+        self.__write(run)
+
+    async def getRank(self, guild_id: str, previous: bool = False, limit: int = 20) -> Tuple[Optional[int], List[Tuple[str, str, int, int]], int]:
+        """伺服器的深淵排行，依星數、最深抵達、戰鬥次數(少者優先)排序
+        :return: (期數, [(使用者ID, 最深抵達, 星數, 戰鬥次數)], 有紀錄的成員數)，沒有紀錄時期數為None
+        """
+        def run(conn: sqlite3.Connection):
+            season = self.__season(conn, str(guild_id), previous)
+            if season is None:
+                return None, [], 0
+            rows = conn.execute(
+                'SELECT user_id, max_floor, stars, battles FROM abyss_board WHERE guild_id=? AND season=? '
+                'ORDER BY stars DESC, floor DESC, battles ASC LIMIT ?', (str(guild_id), season, limit)
+            ).fetchall()
+            return season, rows, self.__memberCount(conn, str(guild_id), season)
+        return await self.__execute(run)
+
+    async def getUsage(self, guild_id: str, previous: bool = False, limit: int = 10) -> Tuple[Optional[int], List[Tuple[str, int]], List[Tuple[str, int]], int]:
+        """伺服器第12層的角色與隊伍使用人數
+        :return: (期數, [(角色, 人數)], [(隊伍, 人數)], 有紀錄的成員數)，沒有紀錄時期數為None
+        """
+        def run(conn: sqlite3.Connection):
+            season = self.__season(conn, str(guild_id), previous)
+            if season is None:
+                return None, [], [], 0
+            usage = [
+                conn.execute(
+                    'SELECT name, count FROM abyss_usage WHERE guild_id=? AND season=? AND kind=? ORDER BY count DESC, name LIMIT ?',
+                    (str(guild_id), season, kind, limit)
+                ).fetchall()
+                for kind in ('character', 'team')
+            ]
+            return season, usage[0], usage[1], self.__memberCount(conn, str(guild_id), season)
+        return await self.__execute(run)
+
+    def close(self) -> None:
+        self.__executor.submit(self.__close)
+        self.__executor.shutdown(wait=True)
+
+    @staticmethod
+    def __floorNumber(max_floor: str) -> int:
+        """'12-3' 轉為 123 供排序使用"""
+        try:
+            floor, chamber = max_floor.split('-')
+            return int(floor) * 10 + int(chamber)
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def __season(conn: sqlite3.Connection, guild_id: str, previous: bool) -> Optional[int]:
+        """伺服器有紀錄的最新一期，previous為True時為前一期"""
+        seasons = conn.execute(
+            'SELECT DISTINCT season FROM abyss_board WHERE guild_id=? ORDER BY season DESC LIMIT 2', (guild_id,)
+        ).fetchall()
+        index = 1 if previous else 0
+        return seasons[index][0] if len(seasons) > index else None
+
+    @staticmethod
+    def __memberCount(conn: sqlite3.Connection, guild_id: str, season: int) -> int:
+        return conn.execute('SELECT COUNT(*) FROM abyss_board WHERE guild_id=? AND season=?', (guild_id, season)).fetchone()[0]
+
+    @staticmethod
+    def __addUsage(conn: sqlite3.Connection, guild_id: str, season: int, teams: List[List[str]], delta: int) -> None:
+        """以一位成員的隊伍增減使用人數，同一位成員重複使用的角色只計算一次"""
+        names: Dict[Tuple[str, str], int] = { }
+        for team in teams:
+            names[('team', '.'.join(team))] = delta
+        characters: Set[str] = {c for team in teams for c in team}
+        for character in characters:
+            names[('character', character)] = delta
+        conn.executemany(
+            'INSERT INTO abyss_usage (guild_id, season, kind, name, count) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(guild_id, season, kind, name) DO UPDATE SET count=count+excluded.count',
+            [(guild_id, season, kind, name, count) for (kind, name), count in names.items()]
+        )
+        if delta < 0:
+            conn.execute('DELETE FROM abyss_usage WHERE guild_id=? AND season=? AND count<=0', (guild_id, season))
+
+    def __write(self, func) -> None:
+        def run():
+            start = time.perf_counter()
+            try:
+                with self.__connect() as conn:
+                    func(conn)
+            except Exception as e:
+                log.error(f'AbyssLeaderboard: {e}')
+            finally:
+                USER_STORE_WRITE_SECONDS.observe(time.perf_counter() - start, 'AbyssLeaderboard', 'update')
+        self.__executor.submit(run)
+
+    async def __execute(self, func):
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, lambda: func(self.__connect()))
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__conn is None:
+            self.__conn = sqlite3.connect(self.__filename, check_same_thread=False)
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('PRAGMA synchronous=NORMAL')
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS guild_members (guild_id TEXT NOT NULL, user_id TEXT NOT NULL, uid TEXT NOT NULL, '
+                'PRIMARY KEY (guild_id, user_id))'
+            )
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS guild_members_uid ON guild_members (uid)')
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS abyss_board (guild_id TEXT NOT NULL, season INTEGER NOT NULL, user_id TEXT NOT NULL, '
+                'uid TEXT NOT NULL, stars INTEGER NOT NULL, floor INTEGER NOT NULL, max_floor TEXT NOT NULL, battles INTEGER NOT NULL, '
+                'teams TEXT NOT NULL, PRIMARY KEY (guild_id, season, user_id))'
+            )
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS abyss_board_rank ON abyss_board (guild_id, season, stars DESC, floor DESC, battles)')
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS abyss_board_user ON abyss_board (user_id)')
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS abyss_usage (guild_id TEXT NOT NULL, season INTEGER NOT NULL, kind TEXT NOT NULL, '
+                'name TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (guild_id, season, kind, name))'
+            )
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS abyss_usage_count ON abyss_usage (guild_id, season, kind, count DESC)')
+            self.__conn.commit()
+        return self.__conn
+
+    def __close(self) -> None:
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
@@ -0,0 +1,70 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+from .Metrics import CACHE_LOOKUPS
+
+class AsyncTTLCache:
+    """非同步的TTL快取，並合併同時發出的相同請求(single-flight)
+    同一個key在取得結果之前又被查詢時，會等待同一個上游請求，而不是再送出一次；
+    只有成功的結果會被快取，請求失敗時所有等待者都會收到同一個例外
+    """
+    def __init__(self, name: str = 'default', max_size: int = 10000) -> None:
+        """
+        :param name: 快取名稱，用於metrics
+        :param max_size: 最多保留的項目數量，超過時淘汰最久沒使用的項目
+        """
+        self.name = name
+        self.__max_size = max_size
+        self.__data: 'OrderedDict[Hashable, Tuple[Any, float]]' = OrderedDict()
+        self.__inflight: Dict[Hashable, asyncio.Future] = { }
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, factory: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        """取得快取內容，沒有快取或已過期時呼叫factory取得並保存
+        :param key: 快取鍵，例如(uid, endpoint, 參數...)
+        :param factory: 取得資料的coroutine function
+        :param ttl: 結果保存的秒數，小於等於0時不保存，但仍會合併同時發出的請求
+        """
+        item = self.__data.get(key)
+        if item is not None:
+            value, expires_at = item
+            if expires_at > time.monotonic():
+                self.__data.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(self.name, 'hit')
+                return value
+            del self.__data[key]
+        self.misses += 1
+        CACHE_LOOKUPS.inc(self.name, 'miss')
+        future = self.__inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self.__inflight[key] = future
+            future.add_done_callback(lambda f: self.__onDone(key, f, ttl))
+        # 使用shield，避免其中一個等待者被取消時連帶取消其他人共用的請求
+        return await asyncio.shield(future)
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        """直接寫入快取，用於從其他請求的結果順便取得的資料"""
+        if ttl <= 0:
+            return
+        self.__data[key] = (value, time.monotonic() + ttl)
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.__max_size:
+            self.__data.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> None:
+        """刪除所有符合條件的快取項目"""
+        for key in [key for key in self.__data.keys() if predicate(key)]:
+            del self.__data[key]
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __onDone(self, key: Hashable, future: asyncio.Future, ttl: float) -> None:
+        self.__inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.set(key, future.result(), ttl)
@@ -0,0 +1,79 @@
+import time
+import asyncio
+import aiohttp
+import genshin
+from collections import OrderedDict
+from typing import Optional, Tuple
+from .utils import log
+
+class GenshinClientPool:
+    """依照(region, cookie)重複使用genshin client，避免每個指令都重新建立HTTP session與TLS連線
+    所有client的session共用同一個aiohttp connector(連線池)，cookie則各自保存在自己的session中
+    """
+    def __init__(self, max_size: int = 1000, idle_timeout: float = 600.0) -> None:
+        """
+        :param max_size: 最多保留的client數量，超過時淘汰最久沒使用的client
+        :param idle_timeout: client閒置超過此秒數後會被關閉
+        """
+        self.__max_size = max_size
+        self.__idle_timeout = idle_timeout
+        self.__clients: 'OrderedDict[Tuple[str, str], Tuple[genshin.GenshinClient, float]]' = OrderedDict()
+        self.__connector: Optional[aiohttp.TCPConnector] = None
+
+    def get(self, region: str, cookie: str) -> genshin.GenshinClient:
+        """取得指定區域與cookie的client，不存在時建立新的client
+        :param region: 'cn' 為國服，其餘為國際服
+        :param cookie: Hoyolab cookie
+        """
+        now = time.monotonic()
+        self.__evictIdle(now)
+        key = (region, cookie)
+        if key in self.__clients:
+            client, _ = self.__clients.pop(key)
+        else:
+            client = self.__createClient(region, cookie)
+        self.__clients[key] = (client, now)
+        while len(self.__clients) > self.__max_size:
+            _, (old_client, _) = self.__clients.popitem(last=False)
+            self.__closeLater(old_client)
+        return client
+
+    def discard(self, region: str, cookie: str) -> None:
+        """移除並關閉指定的client，用於使用者更換或刪除cookie時"""
+        item = self.__clients.pop((region, cookie), None)
+        if item is not None:
+            self.__closeLater(item[0])
+
+    async def close(self) -> None:
+        """關閉全部client與共用的connector，於機器人關閉時呼叫"""
+        clients = [client for client, _ in self.__clients.values()]
+        self.__clients.clear()
+        await asyncio.gather(*[client.close() for client in clients], return_exceptions=True)
+        if self.__connector is not None:
+            await self.__connector.close()
+            self.__connector = None
+        log.info(f'GenshinClientPool已關閉 {len(clients)} 個client')
+
+    def __len__(self) -> int:
+        return len(self.__clients)
+
+    def __createClient(self, region: str, cookie: str) -> genshin.GenshinClient:
+        if self.__connector is None or self.__connector.closed:
+            self.__connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300)
+        client = genshin.ChineseClient() if region == 'cn' else genshin.GenshinClient(lang='zh-tw')
+        # 先指定共用connector的session，再設定cookie，cookie才會存到這個session中
+        client._session = aiohttp.ClientSession(connector=self.__connector, connector_owner=False)
+        client.set_cookies(cookie)
+        return client
+
+    def __evictIdle(self, now: float) -> None:
+        # OrderedDict依照最後使用時間排序，最前面的就是閒置最久的
+        while len(self.__clients) > 0:
+            key, (client, last_used) = next(iter(self.__clients.items()))
+            if now - last_used < self.__idle_timeout:
+                break
+            del self.__clients[key]
+            self.__closeLater(client)
+
+    def __closeLater(self, client: genshin.GenshinClient) -> None:
+        asyncio.get_event_loop().create_task(client.close())
@@ -1,77 +1,145 @@
-import json
+import re
+import time
+import asyncio
 import discord
 import genshin
 from datetime import datetime
-from typing import Union, Tuple
-from .utils import log, getCharacterName, trimCookie
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Union, Tuple
+from .utils import log, trimCookie, isTransientError
+from .UserStore import createUserStore
+from .UserRegistry import COOKIE_EXPIRED, GameAccount, UserRecord, UserRegistry
+from .ClientPool import GenshinClientPool
+from .Cache import AsyncTTLCache
+from .HistoryStore import HistoryStore
+from .AbyssLeaderboard import AbyssLeaderboard
+from .Throttle import upstream_throttle
+from .RateLimiter import TokenBucket, runRateLimited
+from .Render import messages, maskUID, renderNotesHeader, renderNotes, renderSpiralAbyss, renderTravelerDiary, renderHistory, renderAbyssRank, renderAbyssTeams
 import os
-from dotenv import load_dotenv
-load_dotenv()
 
 class GenshinApp:
     def __init__(self) -> None:
-        self.__server_dict = {'os_usa': '美服', 'os_euro': '歐服', 'os_asia': '亞服', 'os_cht': '台港澳服'}
-        self.__weekday_dict = {0: '週一', 1: '週二', 2: '週三', 3: '週四', 4: '週五', 5: '週六', 6: '週日'}
+        self.__client_pool = GenshinClientPool()
+        # 各種查詢結果的快取秒數，已結束的深淵期數與過去月份的札記不會再變動，可以保存較久
+        self.__cache = AsyncTTLCache(name='genshin_app')
+        self.__cache_ttl = {
+            'notes': 20, 'abyss': 300, 'abyss_previous': 6 * 3600,
+            'diary': 300, 'diary_previous': 24 * 3600, 'account': 24 * 3600
+        }
+        # 一個指令內所有上游請求共用的逾時秒數
+        self.__request_timeout = 15
+        # 同一個Hoyolab帳號兩次使用兌換碼之間需要間隔的秒數
+        self.__redeem_cooldown = 5.5
+        self.__user_store = createUserStore()
+        # 已結束的札記月份與深淵期數保存在本地，之後查詢不需要再向HoYoLAB請求
+        self.__history = HistoryStore('data/history.db')
+        # 各伺服器的深淵排行與使用率，取得深淵資料時增量更新
+        self.__leaderboard = AbyssLeaderboard('data/abyss_leaderboard.db')
+        # 使用者資料在背景讀取，指令執行前需先await waitUntilLoaded()
+        self.__users = UserRegistry()
+        self.__load_task: Optional[asyncio.Future] = None
+        self.load_seconds: Optional[float] = None
+        # 同步其他process的資料期間被本process修改過的使用者，同步完成後保留本地的修改
+        self.__sync_modified: Optional[set] = None
+        # Cookie被標記為過期時呼叫，參數為(使用者Discord ID, 過期的UID)
+        self.__cookie_expired_listeners: List[Callable[[str, List[str]], None]] = []
+
+    def startLoading(self) -> asyncio.Future:
+        """開始在背景執行緒讀取使用者資料，不阻塞event loop；重複呼叫時回傳同一個工作"""
+        if self.__load_task is None:
+            self.__load_task = asyncio.ensure_future(self.__loadUsers())
+        return self.__load_task
+
+    async def waitUntilLoaded(self) -> None:
+        """等待使用者資料讀取完成，尚未開始讀取時會先開始讀取"""
+        await asyncio.shield(self.startLoading())
+
+    async def __loadUsers(self) -> None:
+        start = time.perf_counter()
         try:
-            with open('data/user_data.json', 'r', encoding="utf-8") as f:
-                self.__user_data = json.load(f)
-        except:
-            self.__user_data = { }
+            self.__users = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: UserRegistry.fromDict(self.__user_store.load())
+            )
+        except Exception as e:
+            log.error(f'讀取使用者資料失敗: {e}')
+        self.load_seconds = time.perf_counter() - start
+        log.info(f'已讀取 {len(self.__users)} 位使用者資料 ({self.load_seconds:.2f} 秒)')
 
-    async def setCookie(self, user_id: str, cookie: str) -> str:
-        """設定使用者Cookie
+    async def setCookie(self, user_id: str, cookie: str, append: bool = False) -> str:
+        """設定使用者Cookie，保存帳號內的全部角色
         :param user_id: 使用者Discord ID
         :cookie: Hoyolab cookie
+        :param append: 設為True時保留已保存的其他Cookie與角色，用於同時使用多個Hoyolab帳號
         """
         log.info(f'setCookie(user_id={user_id}, cookie={cookie})') 
-        user_id = str(user_id)
         cookie = trimCookie(cookie)
         if cookie == None:
-            return f'無效的Cookie，請重新輸入(使用 `{os.getenv("BOT_PREFIX")}help cookie` 查看教學)'
-        client = genshin.GenshinClient()
-        client.set_cookies(cookie)
+            return messages['cookie_invalid']
+        client = self.__client_pool.get('os', cookie)
         try:
-            accounts = await client.genshin_accounts()
+            accounts = await asyncio.wait_for(upstream_throttle.call('genshin_accounts', client.genshin_accounts()), self.__request_timeout)
         except genshin.errors.GenshinException as e:
             log.error(f'{user_id}: [{e.retcode}] {e.msg}')
             result = e.msg
+        except asyncio.TimeoutError:
+            log.error(f'{user_id}: genshin_accounts逾時')
+            result = '與Hoyolab連線逾時，請稍後再試'
         else:
+            # 帳號列表已包含角色名稱與伺服器，直接放入快取，之後查詢即時便箋不需再取得
+            for account in accounts:
+                self.__cache.set((str(account.uid), 'account'), (account.nickname, account.server), self.__cache_ttl['account'])
             if len(accounts) == 0:
                 log.info('帳號內沒有任何角色')
                 result = '發生錯誤，該帳號內沒有任何角色'
             else:
-                self.__user_data[user_id] = {}
-                self.__user_data[user_id]['cookie'] = cookie
+                old_record = self.__users.get(user_id)
+                primary_uid = old_record.uid if old_record is not None else None
+                if append and old_record is not None and old_record.cookie is not None:
+                    record = old_record
+                else:
+                    record = UserRecord()
+                    if old_record is not None:
+                        for old_cookie in {old_record.cookie, *(a.cookie for a in old_record.extra_accounts)} - {None}:
+                            self.__client_pool.discard('os', old_cookie)
+                            self.__client_pool.discard('cn', old_cookie)
+                self.__users.set(user_id, record)
+                for account in accounts:
+                    self.__users.addAccount(user_id, cookie, str(account.uid))
+                # 之前選擇的主要角色仍在時保留，否則以第一個角色為主要角色
+                if primary_uid is not None and record.getAccount(primary_uid) is not None:
+                    self.__users.setUID(user_id, primary_uid)
+                self.__saveUserData(user_id)
                 log.info(f'{user_id}的Cookie設置成功')
                 
-                if len(accounts) == 1:
-                    self.setUID(user_id, str(accounts[0].uid))
+                if len(record.accounts) == 1:
                     result = 'Cookie設定完成！'
                 else:
-                    result = f'```帳號內共有{len(accounts)}個角色\n'
+                    result = f'```帳號內共有{len(accounts)}個角色，已保存全部{len(record.accounts)}個角色\n'
                     for account in accounts:
                         result += f'UID:{account.uid} 等級:{account.level} 角色名字:{account.nickname}\n'
-                    result += f'```\n請用`{os.getenv("BOT_PREFIX")}uid`指定要保存的角色(例: `{os.getenv("BOT_PREFIX")}uid 812345678`)'
-                    self.__saveUserData()
+                    result += f'```\n主要角色: {record.uid}，{messages["choose_uid"]}'
         finally:
-            await client.close()
             return result
     
     def setUID(self, user_id: str, uid: str) -> str:
-        """設定原神UID，當帳號內有多名角色時，保存指定的UID
+        """設定主要角色的原神UID，深淵、札記與兌換碼使用主要角色
         :param user_id: 使用者Discord ID
         :param uid: 欲保存的原神UID
         """
         if all(char.isdigit() for char in uid) == False:
             return 'UID格式錯誤，只能包含數字，請重新輸入'
         try:
-            self.__user_data[user_id]['uid'] = uid
-            self.__saveUserData()
+            self.__users.setUID(user_id, uid)
+            self.__saveUserData(user_id)
             log.info(f'{user_id}角色UID:{uid}已保存')
             return f'角色UID: {uid} 已設定完成'
+        except ValueError:
+            log.info(f'{user_id}角色UID:{uid}不在已保存的角色中')
+            uids = '、'.join(self.getUIDs(user_id))
+            return f'角色UID: {uid} {messages["uid_not_saved"]}，目前保存的角色：{uids}'
         except:
             log.error(f'{user_id}角色UID:{uid}保存失敗')
-            return f'角色UID: {uid} 設定失敗，請先設定Cookie(輸入 `{os.getenv("BOT_PREFIX")}help cookie` 取得詳情)'
+            return f'角色UID: {uid} {messages["uid_set_failed"]}'
 
     async def getRealtimeNote(self, user_id: str, check_resin_excess = False) -> str:
         """取得使用者即時便箋(樹脂、洞天寶錢、派遣、每日、週本)
@@ -79,38 +147,107 @@ class GenshinApp:
         :param check_resin_excess: 設為True時，只有當樹脂超過設定標準時才會回傳即時便箋結果，用於自動檢查樹脂
         """
         log.info(f'getRealtimeNote(user_id={user_id}, check_resin_excess={check_resin_excess})')
-        user_id = str(user_id)
-        check, msg = self.checkUserData(user_id)
+        # 過期的角色在getNotes直接回傳錯誤訊息，不送出請求
+        check, msg = self.checkUserData(user_id, checkExpired=False)
         if check == False:
             return msg
-   
-        uid = self.__user_data[user_id]['uid']
-        client = self.__getGenshinClient(user_id)
-        result = None
+        user_id = int(user_id)
+        deadline = time.monotonic() + self.__request_timeout
+        uids = [account.uid for account in self.__users.get(user_id).accounts]
+        # 全部角色同時查詢，合併成一份結果
+        results = await asyncio.gather(*[
+            self.__getRealtimeNote(user_id, uid, check_resin_excess, deadline, show_uid=len(uids) > 1) for uid in uids
+        ])
+        results = [result for result in results if result is not None]
+        if check_resin_excess == True and len(results) == 0:
+            return None
+        return '\n'.join(result for result in results if result)
+
+    async def __getRealtimeNote(self, user_id: int, uid: str, check_resin_excess: bool, deadline: float, show_uid: bool) -> Optional[str]:
+        """單一角色的即時便箋，show_uid為True時錯誤訊息前加上UID以區分角色"""
+        # 角色名稱與即時便箋同時查詢；自動檢查樹脂時大部分結果用不到標頭，因此不預先查詢
+        account_task = None if check_resin_excess else asyncio.ensure_future(self.getAccountInfo(user_id, uid))
+        notes, msg = await self.getNotes(user_id, uid, timeout=max(deadline - time.monotonic(), 0))
+        if notes is None:
+            if check_resin_excess == True and msg == messages['cookie_expired']:
+                return None
+            return renderNotesHeader(uid) + (msg or '') if show_uid else msg
+        if check_resin_excess == True and notes.current_resin < int(os.getenv('AUTO_CHECK_RESIN_THRESHOLD')):
+            return None
+        return await self.formatRealtimeNote(user_id, notes, account_task, timeout=max(deadline - time.monotonic(), 0), uid=uid)
+
+    async def getNotes(self, user_id: str, uid: str = None, timeout: float = None) -> Tuple[Optional[genshin.models.Notes], Optional[str]]:
+        """取得使用者即時便箋的原始資料，呼叫前需先通過checkUserData
+        :param user_id: 使用者Discord ID
+        :param uid: 要查詢的角色UID，None為主要角色
+        :param timeout: 最多等待的秒數，None為不限制
+        :return: (即時便箋, None)；失敗時為(None, 錯誤訊息)
+        """
+        account = self.__users.get(user_id).getAccount(uid)
+        if account is None:
+            return None, messages['uid_not_found']
+        if account.status == COOKIE_EXPIRED:
+            return None, messages['cookie_expired']
+        uid = account.uid
+        client = self.__getGenshinClient(account)
         try:
-            notes = await client.get_notes(uid)
+            notes = await asyncio.wait_for(
+                self.__cache.get((uid, 'notes'), lambda: upstream_throttle.call('notes', client.get_notes(uid)), self.__cache_ttl['notes']),
+                timeout
+            )
         except genshin.errors.DataNotPublic as e:
             log.error(e.msg)
-            result = '即時便箋功能未開啟\n請從HOYOLAB網頁或App開啟即時便箋功能'
+            return None, '即時便箋功能未開啟\n請從HOYOLAB網頁或App開啟即時便箋功能'
+        except genshin.errors.InvalidCookies as e:
+            log.error(f'{user_id}: {e.msg}')
+            self.__expireCookie(account)
+            return None, messages['cookie_expired']
         except genshin.errors.GenshinException as e:
             log.error(e.msg)
-            result = e.msg
+            return None, e.msg
+        except asyncio.TimeoutError:
+            log.error(f'{user_id}: getNotes逾時')
+            return None, '與Hoyolab連線逾時，請稍後再試'
         except Exception as e:
             log.error(e)
-        else:
-            if check_resin_excess == True and notes.current_resin < os.getenv('AUTO_CHECK_RESIN_THRESHOLD'):
-                result = None
-            else:
-                try:
-                    account = await client.get_diary(uid)
-                    result = f'{account.nickname} {self.__server_dict[account.region]} {uid.replace(uid[3:-3], "***", 1)}\n'
-                except:
-                    result = f'{uid.replace(uid[3:-3], "***", 1)}\n'
-                result += f'--------------------\n'
-                result += self.__parseNotes(notes)
-        finally:
-            await client.close()
-            return result
+            return None, None
+        return notes, None
+
+    async def getAccountInfo(self, user_id: str, uid: str = None) -> Optional[Tuple[str, str]]:
+        """取得使用者已保存UID的角色名稱與伺服器，角色名稱與伺服器幾乎不會變動，因此長時間快取
+        :param user_id: 使用者Discord ID
+        :param uid: 要查詢的角色UID，None為主要角色
+        :return: (角色名稱, 伺服器)，失敗時為None
+        """
+        account = self.__users.get(user_id).getAccount(uid)
+        if account is None or account.status == COOKIE_EXPIRED:
+            return None
+        uid = account.uid
+        client = self.__getGenshinClient(account)
+        try:
+            return await self.__cache.get((uid, 'account'), lambda: self.__fetchAccount(client, uid), self.__cache_ttl['account'])
+        except Exception as e:
+            log.error(f'{user_id}: getAccountInfo: {e}')
+            return None
+
+    async def formatRealtimeNote(self, user_id: str, notes: genshin.models.Notes, account_task: Awaitable = None, timeout: float = None, uid: str = None) -> str:
+        """將即時便箋轉換成要顯示的文字，包含角色名稱與伺服器的標頭
+        :param user_id: 使用者Discord ID
+        :param notes: 由getNotes取得的即時便箋
+        :param account_task: 已經開始查詢的getAccountInfo，為None時才在這裡查詢
+        :param timeout: 標頭最多等待的秒數，逾時只顯示UID，不影響便箋內容
+        :param uid: 便箋所屬的角色UID，None為主要角色
+        """
+        uid = uid if uid is not None else self.__users.get(user_id).uid
+        if account_task is None:
+            account_task = self.getAccountInfo(user_id, uid)
+        try:
+            # 使用shield，逾時不會取消查詢，結果仍會進入快取供下次使用
+            account = await asyncio.wait_for(asyncio.shield(account_task), timeout)
+        except asyncio.TimeoutError:
+            account = None
+        header = renderNotesHeader(uid, *account) if account is not None else renderNotesHeader(uid)
+        return header + renderNotes(notes)
     
     async def redeemCode(self, user_id: str, code: str) -> str:
         """為使用者使用指定的兌換碼
@@ -118,88 +255,318 @@ class GenshinApp:
         :param code: Hoyolab兌換碼
         """
         log.info(f'redeemCode(uesr_id={user_id}, code={code})')
-        user_id = str(user_id)
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
+        user = self.__users.get(user_id)
+        client = self.__getGenshinClient(user)
         try:
-            await client.redeem_code(code, self.__user_data[user_id]['uid'])
+            await upstream_throttle.call('redeem_code', client.redeem_code(code, user.uid))
         except genshin.errors.GenshinException as e:
             log.error(f'{e.msg}')
             result = e.msg
         else:
             result = '兌換碼使用成功！'
         finally:
-            await client.close()
             return result
     
-    async def claimDailyReward(self, user_id: str) -> str:
-        """為使用者在Hoyolab簽到
+    async def redeemCodeForUsers(self, user_ids: Iterable[str], code: str, *, concurrency: int = 5, bucket: TokenBucket = None) -> Dict[str, str]:
+        """為多位使用者的全部角色使用同一個兌換碼
+        保存相同UID的使用者只兌換一次並共用結果，同一個Hoyolab帳號的兌換之間會間隔冷卻時間，
+        兌換碼無效或已過期時停止送出請求，剩下的角色直接回傳相同的結果；Cookie已過期的角色略過
+        :param user_ids: 使用者Discord ID
+        :param code: Hoyolab兌換碼
+        :param concurrency: 同時兌換的帳號數量
+        :param bucket: 限制兌換請求速率的token bucket
+        :return: {使用者Discord ID: 結果訊息}，有多個角色時每個角色一行
+        """
+        results: Dict[str, str] = { }
+        # 每位使用者要兌換的UID
+        user_uids: Dict[str, List[str]] = { }
+        # 依UID分組，同一個UID只需要兌換一次
+        groups: Dict[str, List[str]] = { }
+        for user_id in user_ids:
+            check, msg = self.checkUserData(user_id, checkExpired=False)
+            if check == False:
+                results[user_id] = msg
+                continue
+            uids = [account.uid for account in self.__users.get(user_id).active_accounts]
+            if len(uids) == 0:
+                results[user_id] = messages['cookie_expired']
+                continue
+            user_uids[user_id] = uids
+            for uid in uids:
+                groups.setdefault(uid, []).append(user_id)
+        log.info(f'redeemCodeForUsers(code={code}, users={len(results) + len(user_uids)}, uids={len(groups)})')
+        uid_results: Dict[str, str] = { }
+        account_locks: Dict[str, asyncio.Lock] = { }
+        last_redeemed: Dict[str, float] = { }
+        stop_result: Optional[str] = None
+
+        async def redeem(item: Tuple[str, List[str]]) -> None:
+            nonlocal stop_result
+            uid, group = item
+            user = self.__users.get(group[0])
+            account = user.getAccount(uid) if user is not None else None
+            if stop_result is not None:
+                result = stop_result
+            elif account is None:
+                result = messages['user_not_found']
+            else:
+                # Cookie的ltuid代表Hoyolab帳號，同一個帳號的多個UID依序兌換
+                match = re.search('ltuid=([0-9]+)', account.cookie)
+                hoyolab_account = match.group(1) if match else account.cookie
+                async with account_locks.setdefault(hoyolab_account, asyncio.Lock()):
+                    result = await self.__redeemWithCooldown(account, code, last_redeemed, hoyolab_account)
+                if isinstance(result, genshin.errors.RedemptionInvalid):
+                    stop_result = result = result.msg
+                    log.warning(f'兌換碼 {code} 無效或已過期，停止兌換')
+            uid_results[uid] = result
+
+        await runRateLimited(
+            groups.items(),
+            redeem,
+            concurrency=concurrency,
+            # 停止兌換後不需要再等待token
+            buckets=lambda item: [bucket] if bucket is not None and stop_result is None else [],
+            name=f'兌換碼 {code}',
+            job='redeem_code'
+        )
+        for user_id, uids in user_uids.items():
+            # 兌換時發生例外的UID沒有結果
+            lines = [(uid, uid_results.get(uid, '與Hoyolab連線失敗，請稍後再試')) for uid in uids]
+            results[user_id] = lines[0][1] if len(lines) == 1 else '\n'.join(f'{maskUID(uid)}: {result}' for uid, result in lines)
+        return results
+
+    async def __redeemWithCooldown(self, user: Union[UserRecord, GameAccount], code: str, last_redeemed: Dict[str, float], account: str, max_retries: int = 2) -> Union[str, genshin.errors.RedemptionInvalid]:
+        """為單一角色兌換，距離上次兌換未滿冷卻時間時先等待，兌換碼無效時回傳例外讓呼叫端停止"""
+        client = self.__getGenshinClient(user)
+        for attempt in range(max_retries + 1):
+            wait = last_redeemed.get(account, 0) + self.__redeem_cooldown - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            last_redeemed[account] = time.monotonic()
+            try:
+                await upstream_throttle.call('redeem_code', client.redeem_code(code, user.uid))
+            except genshin.errors.RedemptionInvalid as e:
+                return e
+            except genshin.errors.RedemptionCooldown as e:
+                if attempt < max_retries:
+                    continue
+                return e.msg
+            except genshin.errors.GenshinException as e:
+                return e.msg
+            except Exception as e:
+                log.error(f'{user.uid}: {e}')
+                return '與Hoyolab連線失敗，請稍後再試'
+            else:
+                return '兌換碼使用成功！'
+
+    async def claimDailyReward(self, user_id: str, *, max_retries: int = 0, raise_transient: bool = False) -> str:
+        """為使用者在Hoyolab簽到，保存多個Hoyolab帳號時同時簽到並合併結果
         :param user_id: 使用者Discord ID
+        :param max_retries: 遇到暫時性錯誤(請求過於頻繁、連線失敗)時的最大重試次數，每次重試的等待時間加倍
+        :param raise_transient: 重試後仍是暫時性錯誤時拋出例外而不是回傳錯誤訊息，讓排程工作稍後再重試
         """
         log.info(f'claimDailyReward(uesr_id={user_id})')
-        user_id = str(user_id)
-        check, msg = self.checkUserData(user_id)
+        check, msg = self.checkUserData(user_id, checkExpired=False)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
-        try:
-            reward = await client.claim_daily_reward()
-        except genshin.errors.AlreadyClaimed:
-            result = '今日獎勵已經領過了！'
-        except genshin.errors.GenshinException as e:
-            log.error(e.msg)
-            result = e.msg
-        else:
-            result = f'Hoyolab今日簽到成功！獲得 {reward.amount}x {reward.name}'
-        finally:
-            await client.close()
-            return result
+        targets = self.__claimTargets(self.__users.get(user_id))
+        if len(targets) == 0:
+            return messages['cookie_expired']
+        results = await asyncio.gather(*[
+            self.__claimDailyReward(user_id, account, max_retries, raise_transient) for account in targets.values()
+        ], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        if len(results) == 1:
+            return results[0]
+        return '\n'.join(f'{maskUID(account.uid)}: {result}' for account, result in zip(targets.values(), results))
 
-    async def getSpiralAbyss(self, user_id: str, uid: str = None, previous: bool = False, full_data: bool = False) -> Union[str, discord.Embed]:
+    def getClaimRegions(self, user_id: str) -> List[str]:
+        """自動簽到時每次請求所屬的區域('cn' 為國服，'os' 為國際服)，用於各區域的速率限制
+        :param user_id: 使用者Discord ID
+        :return: 每個需要簽到的Hoyolab帳號各一個區域；使用者不存在或Cookie都已過期時為空list
+        """
+        user = self.__users.get(user_id)
+        if user is None:
+            return []
+        return [region for region, cookie in self.__claimTargets(user).keys()]
+
+    @staticmethod
+    def __claimTargets(user: UserRecord) -> Dict[Tuple[str, str], Union[UserRecord, GameAccount]]:
+        """簽到以Hoyolab帳號與區域為單位，同一個Cookie的多個角色只需簽到一次；Cookie已過期的帳號略過"""
+        targets: Dict[Tuple[str, str], Union[UserRecord, GameAccount]] = { }
+        for account in user.active_accounts:
+            targets.setdefault((account.region, account.cookie), account)
+        return targets
+
+    async def __claimDailyReward(self, user_id: str, account: Union[UserRecord, GameAccount], max_retries: int, raise_transient: bool) -> str:
+        client = self.__getGenshinClient(account)
+        for attempt in range(max_retries + 1):
+            try:
+                reward = await upstream_throttle.call('daily_reward', client.claim_daily_reward())
+            except genshin.errors.AlreadyClaimed:
+                return '今日獎勵已經領過了！'
+            except genshin.errors.InvalidCookies as e:
+                log.error(f'{user_id}: {e.msg}')
+                self.__expireCookie(account)
+                return messages['cookie_expired']
+            except Exception as e:
+                if isTransientError(e) and attempt < max_retries:
+                    log.warning(f'{user_id}: 簽到失敗，{2 ** attempt * 5} 秒後重試: {e}')
+                    await asyncio.sleep(2 ** attempt * 5)
+                    continue
+                if raise_transient and isTransientError(e):
+                    raise
+                if isinstance(e, genshin.errors.GenshinException):
+                    log.error(e.msg)
+                    return e.msg
+                log.error(f'{user_id}: {e}')
+                return '與Hoyolab連線失敗，請稍後再試'
+            else:
+                return f'Hoyolab今日簽到成功！獲得 {reward.amount}x {reward.name}'
+
+    def getUIDs(self, user_id: str, active_only: bool = False) -> List[str]:
+        """取得使用者保存的全部角色UID，主要角色在最前面；使用者不存在時為空list
+        :param user_id: 使用者Discord ID
+        :param active_only: 設為True時不包含Cookie已過期的角色
+        """
+        user = self.__users.get(user_id)
+        if user is None:
+            return []
+        return [account.uid for account in (user.active_accounts if active_only else user.accounts)]
+
+    def isCookieExpired(self, user_id: str, uid: str = None) -> bool:
+        """角色的Cookie是否已被標記為過期
+        :param user_id: 使用者Discord ID
+        :param uid: 角色UID，None為主要角色
+        """
+        user = self.__users.get(user_id)
+        account = user.getAccount(uid) if user is not None else None
+        return account is not None and account.status == COOKIE_EXPIRED
+
+    def addCookieExpiredListener(self, listener: Callable[[str, List[str]], None]) -> None:
+        """註冊Cookie被標記為過期時的通知，每個Cookie過期只會通知一次，重新設定Cookie後才會再次通知
+        :param listener: 以(使用者Discord ID, 過期的UID)呼叫
+        """
+        self.__cookie_expired_listeners.append(listener)
+
+    def removeCookieExpiredListener(self, listener: Callable[[str, List[str]], None]) -> None:
+        if listener in self.__cookie_expired_listeners:
+            self.__cookie_expired_listeners.remove(listener)
+
+    async def checkCookies(self, user_ids: Iterable[str], *, concurrency: int = 5, bucket: TokenBucket = None) -> int:
+        """以帳號列表API檢查使用者的Cookie是否有效，無效的Cookie標記為過期
+        同一個Cookie只檢查一次，已標記過期的Cookie不再檢查；連線失敗等暫時性錯誤不影響狀態，下次再檢查
+        :param user_ids: 使用者Discord ID
+        :param concurrency: 同時檢查的Cookie數量
+        :param bucket: 限制檢查請求速率的token bucket
+        :return: 這次標記為過期的Cookie數量
+        """
+        targets: Dict[Tuple[str, str], Union[UserRecord, GameAccount]] = { }
+        for user_id in user_ids:
+            user = self.__users.get(user_id)
+            for account in (user.active_accounts if user is not None else []):
+                targets.setdefault((account.region, account.cookie), account)
+        expired = 0
+
+        async def check(account: Union[UserRecord, GameAccount]) -> None:
+            nonlocal expired
+            client = self.__getGenshinClient(account)
+            try:
+                await upstream_throttle.call('genshin_accounts', client.genshin_accounts())
+            except genshin.errors.InvalidCookies:
+                expired += 1
+                self.__expireCookie(account)
+
+        await runRateLimited(
+            targets.values(),
+            check,
+            concurrency=concurrency,
+            buckets=lambda account: [bucket] if bucket is not None else [],
+            name='Cookie檢查',
+            job='cookie_check'
+        )
+        return expired
+
+    def __expireCookie(self, expired_account: Union[UserRecord, GameAccount]) -> None:
+        """將所有使用者中使用此Cookie的角色標記為過期，並通知剛被標記的使用者"""
+        cookie = expired_account.cookie
+        for user_id in self.__users.findByUID(expired_account.uid):
+            user = self.__users.get(user_id)
+            uids = []
+            for account in user.accounts:
+                if account.cookie == cookie and account.status != COOKIE_EXPIRED:
+                    account.status = COOKIE_EXPIRED
+                    uids.append(account.uid)
+            if len(uids) == 0:
+                continue
+            log.warning(f'{user_id}: Cookie已過期，暫停 {len(uids)} 個角色的請求')
+            self.__saveUserData(user_id)
+            for listener in self.__cookie_expired_listeners:
+                try:
+                    listener(str(user_id), uids)
+                except Exception as e:
+                    log.error(f'cookie expired listener: {e}')
+
+    async def getSpiralAbyss(self, user_id: str, uid: str = None, previous: bool = False, full_data: bool = False, guild_id: str = None) -> Union[str, discord.Embed]:
         """取得深境螺旋資訊
         :param user_id: 欲登入的使用者Discord ID
         :param uid: 欲查詢的原神UID，若為None，則查詢使用者自己已保存的UID
         :param previous: 是否查詢前一期的資訊
         :param full_data: 若為True，結果完整顯示9~12層資訊；若為False，結果只顯示最後一層資訊
+        :param guild_id: 在伺服器中查詢自己的UID時，加入該伺服器的深淵排行
         """
         log.info(f'getSpiralAbyss(user_id={user_id}, uid={uid})')
-        user_id = str(user_id)
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
+        user = self.__users.get(user_id)
+        join_leaderboard = guild_id is not None and uid is None
         if uid is None:
-            uid = self.__user_data[user_id]['uid']
-        client = self.__getGenshinClient(user_id)
+            uid = user.uid
+        if join_leaderboard:
+            self.__leaderboard.join(guild_id, user_id, uid)
+        client = self.__getGenshinClient(user)
         try:
-            abyss = await client.get_spiral_abyss(uid, previous=previous)
+            abyss = await self.__cache.get(
+                (str(uid), 'abyss', previous),
+                lambda: self.__loadSpiralAbyss(client, str(uid), previous),
+                self.__cache_ttl['abyss_previous' if previous else 'abyss']
+            )
         except genshin.errors.GenshinException as e:
             log.error(e.msg)
             result = e.msg
         else:
-            result = discord.Embed(title=f'深境螺旋第 {abyss.season} 期戰績', color=0x7fbcf5)
-            result.add_field(
-                name=f'最深抵達：{abyss.max_floor}　戰鬥次數：{abyss.total_battles}　★：{abyss.total_stars}', 
-                value=f'統計週期：{abyss.start_time.strftime("%Y.%m.%d")} ~ {abyss.end_time.strftime("%Y.%m.%d")}', 
-                inline=False
-            )
-            # 取得深淵每一層資料
-            for floor in abyss.floors:
-                if full_data == False and floor is not abyss.floors[-1]:
-                    continue
-                for chamber in floor.chambers:
-                    name = f'{floor.floor}-{chamber.chamber}　★{chamber.stars}'
-                    # 取得深淵上下半層角色名字
-                    chara_list = [[], []]
-                    for i, battle in enumerate(chamber.battles):
-                        for chara in battle.characters:
-                            chara_list[i].append(getCharacterName(chara))
-                    value = f'[{".".join(chara_list[0])}]／[{".".join(chara_list[1])}]'
-                    result.add_field(name=name, value=value)
+            if join_leaderboard:
+                # 快取中的資料不會經過__loadSpiralAbyss，剛加入的成員也要更新排行
+                self.__leaderboard.update(uid, abyss)
+            result = renderSpiralAbyss(abyss, full_data)
         finally:
-            await client.close()
             return result
+
+    async def getAbyssRank(self, guild_id: str, previous: bool = False) -> Union[str, discord.Embed]:
+        """取得伺服器的深淵排行，只讀取本地的排行資料
+        :param guild_id: Discord伺服器ID
+        :param previous: 是否查詢前一期
+        """
+        season, rows, members = await self.__leaderboard.getRank(guild_id, previous)
+        if season is None:
+            return messages['abyss_rank_not_found']
+        return renderAbyssRank(season, rows, members)
+
+    async def getAbyssTeams(self, guild_id: str, previous: bool = False) -> Union[str, discord.Embed]:
+        """取得伺服器第12層的角色與隊伍使用人數，只讀取本地的排行資料
+        :param guild_id: Discord伺服器ID
+        :param previous: 是否查詢前一期
+        """
+        season, characters, teams, members = await self.__leaderboard.getUsage(guild_id, previous)
+        if season is None:
+            return messages['abyss_rank_not_found']
+        return renderAbyssTeams(season, characters, teams, members)
     
     async def getTravelerDiary(self, user_id: str, month: str) -> Union[str, discord.Embed]:
         """取得使用者旅行者札記
@@ -207,104 +574,207 @@ class GenshinApp:
         :param month: 欲查詢的月份
         """
         log.info(f'getTravelerDiary(user_id={user_id}, month={month})')
-        user_id = str(user_id)
         check, msg = self.checkUserData(user_id)
         if check == False:
             return msg
-        client = self.__getGenshinClient(user_id)
+        user = self.__users.get(user_id)
+        uid = user.uid
+        client = self.__getGenshinClient(user)
         try:
-            diary = await client.get_diary(self.__user_data[user_id]['uid'], month=month)
+            is_current_month = str(month) == str(datetime.now().month)
+            diary = await self.__cache.get(
+                (uid, 'diary', str(month)),
+                lambda: self.__loadTravelerDiary(client, uid, month),
+                self.__cache_ttl['diary' if is_current_month else 'diary_previous']
+            )
         except genshin.errors.GenshinException as e:
             log.error(e.msg)
             result = e.msg
         else:    
-            d = diary.data
-            result = discord.Embed(
-                title=f'{diary.nickname}的旅行者札記：{month}月',
-                description=f'原石收入比上個月{"增加" if d.primogems_rate > 0 else "減少"}了{abs(d.primogems_rate)}%，摩拉收入比上個月{"增加" if d.mora_rate > 0 else "減少"}了{abs(d.mora_rate)}%',
-                color=0xfd96f4
-            )
-            result.add_field(
-                name='當月共獲得', 
-                value=f'原石：{d.current_primogems}　上個月：{d.last_primogems}\n'
-                    f'摩拉：{d.current_mora}　上個月：{d.last_mora}',
-                inline=False
-            )
-            # 將札記原石組成平分成兩個field
-            for i in range(0, 2):
-                msg = ''
-                length = len(d.categories)
-                for j in range(round(length/2*i), round(length/2*(i+1))):
-                    msg += f'{d.categories[j].name[0:2]}：{d.categories[j].percentage}%\n'
-                result.add_field(name=f'原石收入組成 {i+1}', value=msg, inline=True)
+            self.__cache.set((uid, 'account'), (diary.nickname, diary.region), self.__cache_ttl['account'])
+            result = renderTravelerDiary(diary, month)
         finally:
-            await client.close()
             return result
     
-    def checkUserData(self, user_id: str, *,checkUserID = True, checkCookie = True, checkUID = True) -> Tuple[bool, str]:
-        if checkUserID and user_id not in self.__user_data.keys():
+    async def getHistory(self, user_id: str) -> Union[str, discord.Embed]:
+        """取得使用者保存在本地的歷史紀錄(近一年每月原石收入、近期深境螺旋星數)，不需要向HoYoLAB請求
+        :param user_id: 使用者Discord ID
+        """
+        log.info(f'getHistory(user_id={user_id})')
+        # 只讀取本地的紀錄，Cookie過期也可以查詢
+        check, msg = self.checkUserData(user_id, checkExpired=False)
+        if check == False:
+            return msg
+        uid = self.__users.get(user_id).uid
+        now = datetime.now()
+        since = (now.year - 1) * 100 + now.month + 1 if now.month < 12 else now.year * 100 + 1
+        primogems = await self.__history.getPrimogemsByMonth(uid, since)
+        abyss = await self.__history.getAbyssTrend(uid, 8)
+        if len(primogems) == 0 and len(abyss) == 0:
+            return messages['history_not_found']
+        return renderHistory(uid, primogems, abyss)
+
+    async def syncHistory(self, user_id: str) -> int:
+        """增量同步使用者已結束的札記月份(官方只保留前兩個月)與上一期深境螺旋，只請求本地還沒有的資料
+        :param user_id: 使用者Discord ID
+        :return: 這次新取得的資料數量
+        """
+        check, msg = self.checkUserData(user_id)
+        if check == False:
+            return 0
+        user = self.__users.get(user_id)
+        uid = user.uid
+        client = self.__getGenshinClient(user)
+        now = datetime.now()
+        known_months = await self.__history.getDiaryMonths(uid)
+        synced = 0
+        for offset in (1, 2):
+            month = str((now.month - offset - 1) % 12 + 1)
+            if self.__diaryMonth(month) not in known_months:
+                await self.__cache.get((uid, 'diary', month), lambda: self.__loadTravelerDiary(client, uid, month), self.__cache_ttl['diary_previous'])
+                synced += 1
+        season_start = await self.__getAbyssSeasonStart(client, uid)
+        if season_start is None or await self.__history.getAbyss(uid, season_start) is None:
+            await self.__cache.get((uid, 'abyss', True), lambda: self.__loadSpiralAbyss(client, uid, True), self.__cache_ttl['abyss_previous'])
+            synced += 1
+        return synced
+
+    def checkUserData(self, user_id: str, *,checkUserID = True, checkCookie = True, checkUID = True, checkExpired = True) -> Tuple[bool, str]:
+        user = self.__users.get(user_id)
+        if checkUserID and user is None:
             log.info('找不到使用者，請先設定Cookie(輸入 `%h` 顯示說明)')
-            return False, f'找不到使用者，請先設定Cookie(輸入 `{os.getenv("BOT_PREFIX")}help cookie` 顯示說明)'
+            return False, messages['user_not_found']
         else:
-            if checkCookie and 'cookie' not in self.__user_data[user_id].keys():
+            if checkCookie and user.cookie is None:
                 log.info('找不到Cookie，請先設定Cookie(輸入 `%h` 顯示說明)')
-                return False, f'找不到Cookie，請先設定Cookie(輸入 `{os.getenv("BOT_PREFIX")}help cookie` 顯示說明)'
-            if checkUID and 'uid' not in self.__user_data[user_id].keys():
+                return False, messages['cookie_not_found']
+            if checkUID and user.uid is None:
                 log.info('找不到角色UID，請先設定UID(輸入 `%h` 顯示說明)')
-                return False, f'找不到角色UID，請先設定UID(輸入 `{os.getenv("BOT_PREFIX")}help` 顯示說明)'
+                return False, messages['uid_not_found']
+            if checkExpired and user.status == COOKIE_EXPIRED:
+                log.info('Cookie已過期，請重新設定Cookie')
+                return False, messages['cookie_expired']
         return True, None
     
     def clearUserData(self, user_id: str) -> str:
-        try:
-            del self.__user_data[user_id]
-        except:
+        user = self.__users.pop(user_id)
+        if user is None:
             return '刪除失敗，找不到使用者資料'
-        else:
-            self.__saveUserData()
-            return '使用者資料已全部刪除'
-
-    def __parseNotes(self, notes: genshin.models.Notes) -> str:
-        result = ''
-        result += f'當前樹脂：{notes.current_resin}/{notes.max_resin}\n'
-        
-        if notes.current_resin == notes.max_resin:
-            recover_time = '已額滿！'  
-        else:
-            day_msg = '今天' if notes.resin_recovered_at.day == datetime.now().day else '明天'
-            recover_time = f'{day_msg} {notes.resin_recovered_at.strftime("%H:%M")}'
-        result += f'樹脂全部恢復時間：{recover_time}\n'
-        result += f'每日委託任務：{notes.completed_commissions} 已完成\n'
-        result += f'當前洞天寶錢/上限：{notes.current_realm_currency}/{notes.max_realm_currency}\n'
-        result += f'寶錢全部恢復時間：{self.__weekday_dict[notes.realm_currency_recovered_at.weekday()]} {notes.realm_currency_recovered_at.strftime("%H:%M")}\n'
-        result += f'週本樹脂減半：剩餘 {notes.remaining_resin_discounts} 次\n'
-        result += f'--------------------\n'
-
-        exped_finished = 0
-        exped_msg = ''
-        for expedition in notes.expeditions:
-            exped_msg += f'· {getCharacterName(expedition.character)}'
-            if expedition.finished:
-                exped_finished += 1
-                exped_msg += '：已完成\n'
-            else:
-                day_msg = '今天' if expedition.completed_at.day == datetime.now().day else '明天'
-                exped_msg += f' 完成時間：{day_msg} {expedition.completed_at.strftime("%H:%M")}\n'
-        result += f'探索派遣已完成/總數量：{exped_finished}/{len(notes.expeditions)}\n'
-        result += exped_msg
-        
-        return result
-        
-    def __saveUserData(self) -> None:
+        uids = {account.uid for account in user.accounts} | ({user.uid} if user.uid is not None else set())
+        self.__cache.invalidate(lambda key: key[0] in uids)
+        for uid in uids:
+            if len(self.__users.findByUID(uid)) == 0:
+                self.__history.deleteUID(uid)
+        self.__leaderboard.leave(user_id)
+        self.__saveUserData(user_id)
+        return '使用者資料已全部刪除'
+
+    def __saveUserData(self, user_id: str) -> None:
+        """將單一使用者的變更寫入儲存後端，寫入在背景執行緒進行，不阻塞event loop
+        :param user_id: 使用者Discord ID，若該使用者已不存在則從儲存後端刪除
+        """
         try:
-            with open('data/user_data.json', 'w', encoding='utf-8') as f:
-                json.dump(self.__user_data, f)
+            user_id = int(user_id)
+            if self.__sync_modified is not None:
+                self.__sync_modified.add(user_id)
+            user = self.__users.get(user_id)
+            if user is not None:
+                self.__user_store.upsert(str(user_id), user.toDict())
+            else:
+                self.__user_store.delete(str(user_id))
         except:
-            log.error('__saveUserData(self)')
+            log.error(f'__saveUserData(self, user_id={user_id})')
+
+    async def syncUserData(self, interval: float = 30.0) -> None:
+        """多個process共用同一個使用者資料庫時，定期載入其他process寫入的變更
+        :param interval: 檢查間隔秒數
+        """
+        await self.waitUntilLoaded()
+        while True:
+            await asyncio.sleep(interval)
+            self.__sync_modified = set()
+            try:
+                data = await self.__user_store.reloadIfChanged()
+            except Exception as e:
+                log.error(f'syncUserData: {e}')
+                data = None
+            if data is not None:
+                users = UserRegistry.fromDict(data)
+                for user_id in self.__sync_modified:
+                    user = self.__users.get(user_id)
+                    if user is not None:
+                        users.set(user_id, user)
+                    else:
+                        users.pop(user_id)
+                self.__users = users
+                log.info(f'已同步其他process的使用者資料，共 {len(users)} 位使用者')
+            self.__sync_modified = None
+
+    async def close(self) -> None:
+        """關閉所有HoYoLAB連線並等待使用者資料寫入完成，於機器人關閉時呼叫"""
+        await self.__client_pool.close()
+        self.__user_store.close()
+        self.__history.close()
+        self.__leaderboard.close()
+
+    async def __loadTravelerDiary(self, client: genshin.GenshinClient, uid: str, month: str) -> genshin.models.Diary:
+        """已結束的月份優先從歷史紀錄讀取，沒有時才向HoYoLAB請求並保存"""
+        key = self.__diaryMonth(month)
+        is_past = key is not None and key != self.__diaryMonth(datetime.now().month)
+        if is_past:
+            diary = await self.__history.getDiary(uid, key)
+            if diary is not None:
+                return diary
+        diary = await upstream_throttle.call('diary', client.get_diary(uid, month=month))
+        if is_past:
+            self.__history.putDiary(uid, key, diary)
+        return diary
+
+    async def __loadSpiralAbyss(self, client: genshin.GenshinClient, uid: str, previous: bool) -> genshin.models.SpiralAbyss:
+        """上一期優先從歷史紀錄讀取，向HoYoLAB取得已結束的一期後保存"""
+        if previous:
+            season_start = await self.__getAbyssSeasonStart(client, uid)
+            abyss = await self.__history.getAbyss(uid, season_start) if season_start is not None else None
+            if abyss is not None:
+                return abyss
+        abyss = await upstream_throttle.call('spiral_abyss', client.get_spiral_abyss(uid, previous=previous))
+        if abyss.season > 0 and abyss.end_time.timestamp() <= time.time():
+            self.__history.putAbyss(uid, abyss)
+        if previous == False and abyss.season > 0:
+            # 這一期的開始時間在這一期結束前都不會變，用來從歷史紀錄找出上一期
+            self.__cache.set((uid, 'abyss_start'), abyss.start_time.timestamp(), abyss.end_time.timestamp() - time.time())
+        self.__leaderboard.update(uid, abyss)
+        return abyss
+
+    async def __getAbyssSeasonStart(self, client: genshin.GenshinClient, uid: str) -> Optional[float]:
+        """目前這一期深境螺旋的開始時間(epoch秒)，沒有資料時回傳None
+        每期長度不固定，上一期以「在這一期開始時結束」判斷；取得這一期的資料後保存到這一期結束
+        """
+        async def load() -> Optional[float]:
+            abyss = await self.__cache.get((uid, 'abyss', False), lambda: self.__loadSpiralAbyss(client, uid, False), self.__cache_ttl['abyss'])
+            return abyss.start_time.timestamp() if abyss.season > 0 else None
+        # 由__loadSpiralAbyss寫入快取，這裡只合併同時發出的請求
+        return await self.__cache.get((uid, 'abyss_start'), load, 0)
+
+    @staticmethod
+    def __diaryMonth(month: Union[int, str]) -> Optional[int]:
+        """將札記的月份轉為YYYYMM，大於目前月份的視為去年，不是月份時回傳None"""
+        now = datetime.now()
+        try:
+            month = int(month)
+        except ValueError:
+            return None
+        if month < 1 or month > 12:
+            return None
+        return (now.year if month <= now.month else now.year - 1) * 100 + month
+
+    async def __fetchAccount(self, client: genshin.GenshinClient, uid: str) -> Tuple[str, str]:
+        """透過旅行者札記取得角色名稱與伺服器"""
+        diary = await upstream_throttle.call('diary', client.get_diary(uid))
+        return diary.nickname, diary.region
 
-    def __getGenshinClient(self, user_id: str) -> genshin.GenshinClient:
-        uid = str(self.__user_data[user_id]['uid'])
-        client = genshin.ChineseClient() if uid.startswith('1') else genshin.GenshinClient(lang='zh-tw')
-        client.set_cookies(self.__user_data[user_id]['cookie'])
-        return client
+    def __getGenshinClient(self, user: Union[UserRecord, GameAccount]) -> genshin.GenshinClient:
+        """從client pool取得該使用者(或其中一個角色)的client，client在指令之間重複使用，不需要關閉"""
+        return self.__client_pool.get(user.region, user.cookie)
 
 genshin_app = GenshinApp()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import time
+import sqlite3
+import asyncio
+import genshin
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+from .utils import log
+from .Metrics import USER_STORE_WRITE_SECONDS
+
+class HistoryStore:
+    """以SQLite保存已結束的旅行者札記月份與深境螺旋期數
+    已結束的資料不會再變動，保存後查詢不需要再向HoYoLAB請求，也可以查詢超過官方保留期限的紀錄；
+    月份以YYYYMM的整數表示，所有讀寫都在單一背景執行緒中依序執行
+    """
+    def __init__(self, filename: str) -> None:
+        self.__filename = filename
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='HistoryStore')
+        self.__conn: Optional[sqlite3.Connection] = None
+
+    async def getDiary(self, uid: str, month: int) -> Optional[genshin.models.Diary]:
+        row = await self.__query('SELECT data FROM diary WHERE uid=? AND month=?', (str(uid), month), one=True)
+        return genshin.models.Diary.parse_raw(row[0]) if row is not None else None
+
+    async def getDiaryMonths(self, uid: str) -> Set[int]:
+        """已保存的月份"""
+        return {row[0] for row in await self.__query('SELECT month FROM diary WHERE uid=?', (str(uid),))}
+
+    def putDiary(self, uid: str, month: int, diary: genshin.models.Diary) -> None:
+        self.__write(
+            'INSERT OR REPLACE INTO diary (uid, month, primogems, mora, data) VALUES (?, ?, ?, ?, ?)',
+            (str(uid), month, diary.data.current_primogems, diary.data.current_mora, diary.json())
+        )
+
+    async def getAbyss(self, uid: str, next_season_start: float) -> Optional[genshin.models.SpiralAbyss]:
+        """取得在next_season_start(epoch秒)開始的那一期之前的一期深境螺旋，也就是在它開始前一小時內結束的一期"""
+        row = await self.__query(
+            'SELECT data FROM abyss WHERE uid=? AND end_time<=? AND end_time>? ORDER BY season DESC LIMIT 1',
+            (str(uid), next_season_start, next_season_start - 3600), one=True
+        )
+        return genshin.models.SpiralAbyss.parse_raw(row[0]) if row is not None else None
+
+    def putAbyss(self, uid: str, abyss: genshin.models.SpiralAbyss) -> None:
+        self.__write(
+            'INSERT OR REPLACE INTO abyss (uid, season, end_time, max_floor, total_stars, total_battles, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (str(uid), abyss.season, abyss.end_time.timestamp(), abyss.max_floor, abyss.total_stars, abyss.total_battles, abyss.json())
+        )
+
+    async def getPrimogemsByMonth(self, uid: str, since: int) -> List[Tuple[int, int]]:
+        """since(YYYYMM)之後每個月的原石收入 [(月份, 原石)]"""
+        return await self.__query('SELECT month, primogems FROM diary WHERE uid=? AND month>=? ORDER BY month', (str(uid), since))
+
+    async def getAbyssTrend(self, uid: str, limit: int) -> List[Tuple[int, float, str, int, int]]:
+        """最近limit期的深境螺旋統計 [(期數, 結束時間, 最深抵達, 星數, 戰鬥次數)]，由舊到新排序"""
+        rows = await self.__query(
+            'SELECT season, end_time, max_floor, total_stars, total_battles FROM abyss WHERE uid=? ORDER BY season DESC LIMIT ?', (str(uid), limit)
+        )
+        return rows[::-1]
+
+    def deleteUID(self, uid: str) -> None:
+        """刪除此UID的全部紀錄"""
+        self.__write('DELETE FROM diary WHERE uid=?', (str(uid),))
+        self.__write('DELETE FROM abyss WHERE uid=?', (str(uid),))
+
+    def close(self) -> None:
+        self.__executor.submit(self.__close)
+        self.__executor.shutdown(wait=True)
+
+    async def __query(self, sql: str, params: tuple, one: bool = False):
+        def run():
+            cursor = self.__connect().execute(sql, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, run)
+
+    def __write(self, sql: str, params: tuple) -> None:
+        def run():
+            start = time.perf_counter()
+            try:
+                with self.__connect() as conn:
+                    conn.execute(sql, params)
+            except Exception as e:
+                log.error(f'HistoryStore: {e}')
+            finally:
+                USER_STORE_WRITE_SECONDS.observe(time.perf_counter() - start, 'HistoryStore', sql.split(' ', 1)[0].lower())
+        self.__executor.submit(run)
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__conn is None:
+            self.__conn = sqlite3.connect(self.__filename, check_same_thread=False)
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('PRAGMA synchronous=NORMAL')
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS diary (uid TEXT NOT NULL, month INTEGER NOT NULL, primogems INTEGER NOT NULL, '
+                'mora INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (uid, month))'
+            )
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS abyss (uid TEXT NOT NULL, season INTEGER NOT NULL, end_time REAL NOT NULL, '
+                'max_floor TEXT NOT NULL, total_stars INTEGER NOT NULL, total_battles INTEGER NOT NULL, data TEXT NOT NULL, '
+                'PRIMARY KEY (uid, season))'
+            )
+            self.__conn.commit()
+        return self.__conn
+
+    def __close(self) -> None:
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
@@ -0,0 +1,210 @@
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Union
+from .utils import log
+from .RateLimiter import TokenBucket, runRateLimited
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+# 不需要處理的使用者(例如已取消訂閱、Cookie已過期)，不會重試，也不記錄為成功
+SKIPPED = 'skipped'
+
+class JobQueue:
+    """以SQLite保存排程工作中每位使用者的狀態(pending、in_flight、done、failed、skipped)與最後成功時間
+    每次排程(例如某一天的自動簽到)以queue與run_id區分，重新啟動後可以從還沒完成的使用者繼續；
+    多個process共用同一個資料庫時，以owner區分各自負責的工作
+    """
+    def __init__(self, filename: str, owner: str = 'all') -> None:
+        self.__filename = filename
+        self.owner = owner
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='JobQueue')
+        self.__conn: Optional[sqlite3.Connection] = None
+
+    async def hasRun(self, queue: str, run_id: str) -> bool:
+        row = await self.__query('SELECT 1 FROM job_runs WHERE queue=? AND run_id=? AND owner=?', (queue, run_id, self.owner), one=True)
+        return row is not None
+
+    async def createRun(self, queue: str, run_id: str, user_ids: Iterable[str]) -> int:
+        """建立一次排程，所有使用者的狀態為pending；同一個run_id只會建立一次
+        :return: 加入的使用者數量
+        """
+        user_ids = [str(user_id) for user_id in user_ids]
+        now = time.time()
+
+        def run(conn: sqlite3.Connection) -> int:
+            with conn:
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO job_runs (queue, run_id, owner, created_at) VALUES (?, ?, ?, ?)', (queue, run_id, self.owner, now)
+                )
+                if cursor.rowcount == 0:
+                    return 0
+                conn.executemany(
+                    'INSERT OR IGNORE INTO jobs (queue, run_id, user_id, owner, state, attempts, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?)',
+                    [(queue, run_id, user_id, self.owner, PENDING, now) for user_id in user_ids]
+                )
+            return len(user_ids)
+        return await self.__execute(run)
+
+    async def recover(self, queue: str) -> int:
+        """將上次執行中斷時還在處理的工作改回pending，於啟動時呼叫
+        :return: 恢復的工作數量
+        """
+        def run(conn: sqlite3.Connection) -> int:
+            with conn:
+                return conn.execute(
+                    'UPDATE jobs SET state=? WHERE queue=? AND owner=? AND state=?', (PENDING, queue, self.owner, IN_FLIGHT)
+                ).rowcount
+        return await self.__execute(run)
+
+    async def retryFailed(self, queue: str, run_id: str, max_attempts: int, retry_after: float) -> int:
+        """將失敗次數少於max_attempts、且失敗超過retry_after秒的工作改回pending
+        :return: 重試的工作數量
+        """
+        def run(conn: sqlite3.Connection) -> int:
+            with conn:
+                return conn.execute(
+                    'UPDATE jobs SET state=? WHERE queue=? AND run_id=? AND owner=? AND state=? AND attempts<? AND updated_at<=?',
+                    (PENDING, queue, run_id, self.owner, FAILED, max_attempts, time.time() - retry_after)
+                ).rowcount
+        return await self.__execute(run)
+
+    async def getPending(self, queue: str, run_id: str) -> List[str]:
+        rows = await self.__query(
+            'SELECT user_id FROM jobs WHERE queue=? AND run_id=? AND owner=? AND state=? ORDER BY rowid', (queue, run_id, self.owner, PENDING)
+        )
+        return [row[0] for row in rows]
+
+    async def getStats(self, queue: str, run_id: str) -> Dict[str, int]:
+        """各狀態的工作數量"""
+        rows = await self.__query(
+            'SELECT state, COUNT(*) FROM jobs WHERE queue=? AND run_id=? AND owner=? GROUP BY state', (queue, run_id, self.owner)
+        )
+        return {state: count for state, count in rows}
+
+    async def getLastSuccess(self, queue: str, user_id: str) -> Optional[float]:
+        """使用者最後一次成功的時間(epoch秒)"""
+        row = await self.__query('SELECT at FROM last_success WHERE queue=? AND user_id=?', (queue, str(user_id)), one=True)
+        return row[0] if row is not None else None
+
+    async def process(
+        self,
+        queue: str,
+        run_id: str,
+        handler: Callable[[str], Awaitable[Union[bool, str]]],
+        *,
+        concurrency: int,
+        buckets: Callable[[str], List[TokenBucket]] = None,
+        name: str = None
+    ) -> Dict[str, int]:
+        """以runRateLimited處理所有pending的工作，並記錄每位使用者的狀態
+        :param handler: 處理單一使用者的coroutine function，回傳False或拋出例外視為失敗，
+            回傳SKIPPED表示這次不需要處理，不會重試也不會更新最後成功時間
+        """
+        async def run_job(user_id: str) -> None:
+            self.__setState(queue, run_id, user_id, IN_FLIGHT)
+            try:
+                # 在工作內取得token，取得失敗(例如使用者資料已刪除)時也會記錄為失敗
+                for bucket in (buckets(user_id) if buckets else []):
+                    await bucket.acquire()
+                ok = await handler(user_id)
+            except asyncio.CancelledError:
+                # 關閉時中斷的工作，下次啟動時由recover恢復
+                raise
+            except Exception:
+                self.__setState(queue, run_id, user_id, FAILED)
+                raise
+            if ok == SKIPPED:
+                self.__setState(queue, run_id, user_id, SKIPPED)
+                return
+            if ok == False:
+                self.__setState(queue, run_id, user_id, FAILED)
+                raise Exception('失敗，稍後重試')
+            self.__setState(queue, run_id, user_id, DONE)
+
+        user_ids = await self.getPending(queue, run_id)
+        if len(user_ids) == 0:
+            return {'total': 0, 'done': 0, 'failed': 0}
+        return await runRateLimited(
+            user_ids,
+            run_job,
+            concurrency=concurrency,
+            name=name or queue,
+            job=queue
+        )
+
+    def prune(self, keep_seconds: float) -> None:
+        """刪除建立超過keep_seconds秒的排程紀錄"""
+        def run(conn: sqlite3.Connection) -> None:
+            before = time.time() - keep_seconds
+            with conn:
+                conn.execute(
+                    'DELETE FROM jobs WHERE owner=? AND (queue, run_id) IN (SELECT queue, run_id FROM job_runs WHERE owner=? AND created_at<?)',
+                    (self.owner, self.owner, before)
+                )
+                conn.execute('DELETE FROM job_runs WHERE owner=? AND created_at<?', (self.owner, before))
+        self.__executor.submit(self.__run, run)
+
+    def close(self) -> None:
+        self.__executor.submit(self.__close)
+        self.__executor.shutdown(wait=True)
+
+    def __setState(self, queue: str, run_id: str, user_id: str, state: str) -> None:
+        """更新工作狀態，寫入在背景執行緒依序進行；失敗時累計次數，完成時記錄最後成功時間"""
+        now = time.time()
+
+        def run(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(
+                    'UPDATE jobs SET state=?, attempts=attempts+?, updated_at=? WHERE queue=? AND run_id=? AND user_id=?',
+                    (state, 1 if state == FAILED else 0, now, queue, run_id, user_id)
+                )
+                if state == DONE:
+                    conn.execute(
+                        'INSERT INTO last_success (queue, user_id, at) VALUES (?, ?, ?) ON CONFLICT(queue, user_id) DO UPDATE SET at=excluded.at',
+                        (queue, user_id, now)
+                    )
+        self.__executor.submit(self.__run, run)
+
+    def __run(self, func: Callable[[sqlite3.Connection], None]) -> None:
+        try:
+            func(self.__connect())
+        except Exception as e:
+            log.error(f'JobQueue: {e}')
+
+    async def __execute(self, func: Callable[[sqlite3.Connection], int]) -> int:
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, lambda: func(self.__connect()))
+
+    async def __query(self, sql: str, params: tuple, one: bool = False):
+        def run(conn: sqlite3.Connection):
+            cursor = conn.execute(sql, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+        return await self.__execute(run)
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__conn is None:
+            self.__conn = sqlite3.connect(self.__filename, check_same_thread=False)
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('PRAGMA synchronous=NORMAL')
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS job_runs (queue TEXT NOT NULL, run_id TEXT NOT NULL, owner TEXT NOT NULL, '
+                'created_at REAL NOT NULL, PRIMARY KEY (queue, run_id, owner))'
+            )
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (queue TEXT NOT NULL, run_id TEXT NOT NULL, user_id TEXT NOT NULL, owner TEXT NOT NULL, '
+                'state TEXT NOT NULL, attempts INTEGER NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (queue, run_id, user_id))'
+            )
+            self.__conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (queue, owner, state)')
+            self.__conn.execute(
+                'CREATE TABLE IF NOT EXISTS last_success (queue TEXT NOT NULL, user_id TEXT NOT NULL, at REAL NOT NULL, PRIMARY KEY (queue, user_id))'
+            )
+            self.__conn.commit()
+        return self.__conn
+
+    def __close(self) -> None:
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
@@ -0,0 +1,100 @@
+import re
+import json
+import time
+import queue
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Tuple
+
+# 目前指令或排程工作的關聯ID，asyncio task建立時會複製context，因此同一個指令內的所有log都會帶有相同的ID
+correlation_id: contextvars.ContextVar = contextvars.ContextVar('correlation_id', default='-')
+
+__cookie_pattern = re.compile(r'((?:ltoken|cookie_token|ltoken_v2|cookie_token_v2|login_ticket)=)[^\s;,)\'"]+')
+
+def redactCookie(text: str) -> str:
+    """將文字中的cookie token值遮蔽為***"""
+    return __cookie_pattern.sub(r'\1***', text)
+
+class RedactingQueueHandler(QueueHandler):
+    """在呼叫端(event loop)只做格式化、遮蔽cookie與記錄關聯ID，實際寫入交給背景執行緒"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.msg = redactCookie(record.msg)
+        record.message = record.msg
+        record.correlation_id = correlation_id.get()
+        return record
+
+class DeduplicatingQueueListener(QueueListener):
+    """背景寫入log的執行緒，相同的WARNING以上訊息在interval秒內只輸出一次，之後補上被略過的次數"""
+    def __init__(self, log_queue: queue.Queue, *handlers: logging.Handler, interval: float = 60.0, max_keys: int = 1000) -> None:
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.__interval = interval
+        self.__max_keys = max_keys
+        # (等級, 訊息) -> [上次輸出時間, 之後被略過的次數]
+        self.__seen: Dict[Tuple[int, str], List[float]] = { }
+
+    def handle(self, record: logging.LogRecord) -> None:
+        if record.levelno >= logging.WARNING:
+            key = (record.levelno, record.msg)
+            item = self.__seen.get(key)
+            if item is not None and record.created - item[0] < self.__interval:
+                item[1] += 1
+                return
+            if item is not None and item[1] > 0:
+                record.msg = f'{record.msg} (前 {self.__interval:.0f} 秒內重複 {int(item[1])} 次)'
+                record.message = record.msg
+            if len(self.__seen) >= self.__max_keys:
+                self.__seen = {k: v for k, v in self.__seen.items() if record.created - v[0] < self.__interval}
+            self.__seen[key] = [record.created, 0]
+        super().handle(record)
+
+class JsonFormatter(logging.Formatter):
+    """每筆log輸出成一行JSON"""
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'correlation_id': getattr(record, 'correlation_id', '-'),
+            'message': record.getMessage()
+        }, ensure_ascii=False)
+
+class SizeTimedRotatingFileHandler(RotatingFileHandler):
+    """檔案超過max_bytes或距離上次輪替超過interval秒時輪替，舊檔案依序命名為.1 .2 ..."""
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, interval: float, encoding: str = 'utf-8') -> None:
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.__interval = interval
+        self.__rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if super().shouldRollover(record):
+            return 1
+        if time.time() >= self.__rollover_at:
+            self.__rollover_at = time.time() + self.__interval
+            # 檔案是空的就不需要輪替
+            return 1 if self.stream is not None and self.stream.tell() > 0 else 0
+        return 0
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.__rollover_at = time.time() + self.__interval
+
+def setupLogging(filename: str, *, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, interval: float = 24 * 3600) -> QueueListener:
+    """將root logger改為佇列式的非同步log：呼叫端只放入佇列，檔案與終端機的輸出由背景執行緒處理
+    :return: 已啟動的QueueListener，程式結束前呼叫stop()確保全部寫入
+    """
+    file_handler = SizeTimedRotatingFileHandler(filename, max_bytes, backup_count, interval)
+    file_handler.setLevel(logging.WARNING)
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(correlation_id)s] %(message)s', '%Y-%m-%d %H:%M:%S'))
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    listener = DeduplicatingQueueListener(log_queue, file_handler, console_handler)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(RedactingQueueHandler(log_queue))
+    listener.start()
+    return listener
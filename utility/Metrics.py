@@ -0,0 +1,194 @@
+import time
+import asyncio
+import threading
+import genshin
+from aiohttp import web
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from .utils import log
+
+class Metric:
+    """Prometheus格式指標的基底類別，標籤值以tuple保存，可以從任何執行緒更新"""
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def _labels(self, labelvalues: Tuple, extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labelnames, labelvalues)) + list((extra or { }).items())
+        if len(pairs) == 0:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.__values: Dict[Tuple, float] = { }
+
+    def inc(self, *labelvalues, amount: float = 1.0) -> None:
+        with self._lock:
+            self.__values[labelvalues] = self.__values.get(labelvalues, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{self._labels(k)} {v}' for k, v in self.__values.items()]
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.__values: Dict[Tuple, float] = { }
+        self.__functions: Dict[Tuple, Callable[[], float]] = { }
+
+    def set(self, value: float, *labelvalues) -> None:
+        with self._lock:
+            self.__values[labelvalues] = value
+
+    def setFunction(self, func: Callable[[], float], *labelvalues) -> None:
+        """匯出時才呼叫func取得目前的值"""
+        with self._lock:
+            self.__functions[labelvalues] = func
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self.__values)
+            functions = dict(self.__functions)
+        for k, func in functions.items():
+            try:
+                values[k] = func()
+            except Exception as e:
+                log.error(f'Gauge {self.name}: {e}')
+        return [f'{self.name}{self._labels(k)} {v}' for k, v in values.items()]
+
+class Histogram(Metric):
+    type = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.__buckets = tuple(sorted(buckets))
+        # 每組標籤保存 [各bucket計數..., 總和, 總數]
+        self.__values: Dict[Tuple, List[float]] = { }
+
+    def observe(self, value: float, *labelvalues) -> None:
+        with self._lock:
+            data = self.__values.get(labelvalues)
+            if data is None:
+                data = self.__values[labelvalues] = [0.0] * (len(self.__buckets) + 2)
+            for i, bound in enumerate(self.__buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(k, list(v)) for k, v in self.__values.items()]
+        for k, data in items:
+            for i, bound in enumerate(self.__buckets):
+                lines.append(f'{self.name}_bucket{self._labels(k, {"le": repr(bound)})} {data[i]}')
+            lines.append(f'{self.name}_bucket{self._labels(k, {"le": "+Inf"})} {data[-1]}')
+            lines.append(f'{self.name}_sum{self._labels(k)} {data[-2]}')
+            lines.append(f'{self.name}_count{self._labels(k)} {data[-1]}')
+        return lines
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.__metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self.__metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.__metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+COMMAND_SECONDS = Histogram('genshin_bot_command_seconds', 'Discord command latency', ['command'])
+COMMAND_ERRORS = Counter('genshin_bot_command_errors_total', 'Discord commands that raised an error', ['command'])
+UPSTREAM_CALLS = Counter('genshin_bot_upstream_calls_total', 'HoYoLAB API calls by endpoint and retcode', ['endpoint', 'retcode'])
+UPSTREAM_SECONDS = Histogram('genshin_bot_upstream_seconds', 'HoYoLAB API call latency', ['endpoint'])
+CACHE_LOOKUPS = Counter('genshin_bot_cache_lookups_total', 'Result cache lookups', ['cache', 'result'])
+JOB_SECONDS = Histogram('genshin_bot_job_seconds', 'Scheduled job run duration', ['job'], buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+JOB_ITEMS = Counter('genshin_bot_job_items_total', 'Scheduled job items processed', ['job', 'result'])
+JOB_BACKLOG = Gauge('genshin_bot_job_backlog', 'Scheduled job items waiting to be processed', ['job'])
+EVENT_LOOP_LAG = Histogram('genshin_bot_event_loop_lag_seconds', 'Delay of a 1 s timer on the asyncio event loop', buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+USER_STORE_WRITE_SECONDS = Histogram('genshin_bot_user_store_write_seconds', 'User store write latency', ['backend', 'operation'])
+
+async def observeUpstream(endpoint: str, awaitable: Awaitable[Any]) -> Any:
+    """等待HoYoLAB請求並記錄呼叫次數、延遲與retcode
+    :param endpoint: API名稱，例如 'notes'、'diary'
+    :param awaitable: genshin client的請求
+    """
+    start = time.perf_counter()
+    retcode = '0'
+    try:
+        return await awaitable
+    except genshin.errors.GenshinException as e:
+        retcode = str(e.retcode)
+        raise
+    except asyncio.CancelledError:
+        retcode = 'cancelled'
+        raise
+    except Exception as e:
+        retcode = type(e).__name__
+        raise
+    finally:
+        UPSTREAM_CALLS.inc(endpoint, retcode)
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint)
+
+class MetricsServer:
+    """在本機HTTP埠匯出 /metrics，並定期量測event loop的延遲"""
+    def __init__(self, port: int, host: str = '0.0.0.0') -> None:
+        self.__port = port
+        self.__host = host
+        self.__runner: Optional[web.AppRunner] = None
+        self.__lag_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.__runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.__handleMetrics)
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, self.__host, self.__port).start()
+        self.__lag_task = asyncio.ensure_future(self.__measureLag())
+        log.info(f'Metrics已於 http://{self.__host}:{self.__port}/metrics 匯出')
+
+    async def close(self) -> None:
+        if self.__lag_task is not None:
+            self.__lag_task.cancel()
+            self.__lag_task = None
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    async def __handleMetrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def __measureLag(self, interval: float = 1.0) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            EVENT_LOOP_LAG.observe(max(loop.time() - start - interval, 0))
@@ -0,0 +1,158 @@
+import time
+import asyncio
+import aiohttp
+import discord
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from .utils import log
+from .RateLimiter import TokenBucket
+from .Metrics import Counter, JOB_BACKLOG
+
+OUTBOX_MESSAGES = Counter('genshin_bot_outbox_messages_total', 'Digest messages sent by the outbox', ['result'])
+
+class DigestEntry(NamedTuple):
+    user_id: str
+    name: str
+    value: str
+    on_failed: Optional[Callable[[str], None]]
+
+class Outbox:
+    """排程工作的訊息發送佇列
+    結果先依頻道與標題分組，短暫等待更多結果後合併成彙整embed發送，提及的使用者放在訊息內容讓使用者收到通知；
+    每個頻道由各自的背景工作依序發送並保持最小間隔，全部頻道共用一個token bucket，排程工作交出結果後不需要等待發送
+    """
+    # Discord embed的限制
+    MAX_FIELDS = 25
+    MAX_FIELD_VALUE = 1024
+    MAX_EMBED_LENGTH = 6000
+    MAX_CONTENT_LENGTH = 2000
+
+    def __init__(self, bot, rate: float, channel_interval: float = 1.0, delay: float = 2.0,
+                 max_attempts: int = 3, retry_delay: float = 5.0) -> None:
+        """
+        :param rate: 每秒最多發送的訊息數量(全部頻道合計)
+        :param channel_interval: 同一個頻道兩則訊息之間的最短間隔(秒)
+        :param delay: 收到第一筆結果後等待多久再發送，讓同一個頻道的結果合併
+        :param max_attempts: 暫時性錯誤(Discord 5xx、連線失敗、逾時)時最多發送幾次，每次重試的等待時間加倍
+        :param retry_delay: 第一次重試前等待的秒數
+        """
+        self.bot = bot
+        self.channel_interval = channel_interval
+        self.delay = delay
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.__bucket = TokenBucket(rate)
+        # {頻道ID: {(標題, 顏色): [結果...]}}
+        self.__pending: Dict[int, Dict[Tuple[str, int], List[DigestEntry]]] = { }
+        self.__tasks: Dict[int, asyncio.Task] = { }
+        JOB_BACKLOG.setFunction(lambda: sum(len(e) for groups in self.__pending.values() for e in groups.values()), 'outbox')
+
+    def post(self, channel_id: int, title: str, user_id: str, name: str, value: str, color: int = 0x7fbcf5,
+             on_failed: Callable[[str], None] = None) -> None:
+        """加入一筆要發送的結果，不會等待發送完成
+        :param name: embed欄位的標題
+        :param value: embed欄位的內容，超過長度限制時截斷
+        :param on_failed: 頻道已刪除或沒有權限時以user_id呼叫；暫時性的錯誤重試後仍失敗只會捨棄訊息，不會呼叫
+        """
+        channel_id = int(channel_id)
+        if len(value) > self.MAX_FIELD_VALUE:
+            value = value[:self.MAX_FIELD_VALUE - 1] + '…'
+        groups = self.__pending.setdefault(channel_id, { })
+        groups.setdefault((title, color), []).append(DigestEntry(str(user_id), name or '\u200b', value, on_failed))
+        task = self.__tasks.get(channel_id)
+        if task is None or task.done():
+            self.__tasks[channel_id] = asyncio.ensure_future(self.__drain(channel_id))
+
+    async def flush(self) -> None:
+        """等待目前所有的結果發送完成"""
+        while len(self.__tasks) > 0:
+            await asyncio.gather(*self.__tasks.values(), return_exceptions=True)
+            self.__tasks = {channel_id: task for channel_id, task in self.__tasks.items() if not task.done()}
+
+    def close(self) -> None:
+        for task in self.__tasks.values():
+            task.cancel()
+
+    async def __drain(self, channel_id: int) -> None:
+        await asyncio.sleep(self.delay)
+        last_sent = 0.0
+        try:
+            while len(self.__pending.get(channel_id, { })) > 0:
+                groups = self.__pending[channel_id]
+                (title, color), entries = next(iter(groups.items()))
+                del groups[(title, color)]
+                for chunk in self.__chunk(title, entries):
+                    wait = last_sent + self.channel_interval - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    await self.__bucket.acquire()
+                    await self.__send(channel_id, title, color, chunk)
+                    last_sent = time.monotonic()
+        finally:
+            if len(self.__pending.get(channel_id, { })) == 0:
+                self.__pending.pop(channel_id, None)
+
+    async def __send(self, channel_id: int, title: str, color: int, entries: List[DigestEntry]) -> None:
+        embed = discord.Embed(title=title, color=color)
+        for entry in entries:
+            embed.add_field(name=entry.name, value=entry.value, inline=False)
+        content = ' '.join(dict.fromkeys(f'<@{entry.user_id}>' for entry in entries))
+        channel = self.bot.get_channel(channel_id)
+        if channel == None:
+            self.__fail(channel_id, entries, '找不到頻道')
+            return
+        for attempt in range(self.max_attempts):
+            try:
+                await channel.send(content, embed=embed)
+            except (discord.Forbidden, discord.NotFound) as e:
+                # 頻道已刪除或沒有權限，之後也不會成功
+                self.__fail(channel_id, entries, e)
+                return
+            except Exception as e:
+                if self.__isTransient(e) and attempt < self.max_attempts - 1:
+                    log.warning(f'Outbox: {channel_id}: {e}，{self.retry_delay * 2 ** attempt} 秒後重試')
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                    continue
+                # 暫時性錯誤重試後仍失敗、或訊息內容錯誤時只捨棄這則訊息，保留使用者的訂閱
+                OUTBOX_MESSAGES.inc('dropped')
+                log.error(f'Outbox: {channel_id}: {e}')
+                return
+            else:
+                OUTBOX_MESSAGES.inc('sent')
+                return
+
+    @staticmethod
+    def __fail(channel_id: int, entries: List[DigestEntry], reason) -> None:
+        OUTBOX_MESSAGES.inc('failed')
+        log.error(f'Outbox: {channel_id}: {reason}')
+        for entry in entries:
+            if entry.on_failed is not None:
+                entry.on_failed(entry.user_id)
+
+    @staticmethod
+    def __isTransient(e: Exception) -> bool:
+        if isinstance(e, discord.HTTPException):
+            return e.status >= 500 or e.status == 429
+        return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+    def __chunk(self, title: str, entries: List[DigestEntry]) -> List[List[DigestEntry]]:
+        """依embed欄位數量、embed總長度與訊息內容長度限制分成多則訊息"""
+        chunks: List[List[DigestEntry]] = []
+        chunk: List[DigestEntry] = []
+        embed_length = content_length = 0
+        for entry in entries:
+            entry_length = len(entry.name) + len(entry.value)
+            mention_length = len(entry.user_id) + 4
+            if len(chunk) > 0 and (
+                len(chunk) >= self.MAX_FIELDS
+                or len(title) + embed_length + entry_length > self.MAX_EMBED_LENGTH
+                or content_length + mention_length > self.MAX_CONTENT_LENGTH
+            ):
+                chunks.append(chunk)
+                chunk = []
+                embed_length = content_length = 0
+            chunk.append(entry)
+            embed_length += entry_length
+            content_length += mention_length
+        if len(chunk) > 0:
+            chunks.append(chunk)
+        return chunks
@@ -0,0 +1,106 @@
+import time
+import uuid
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from .utils import log
+from .Metrics import JOB_SECONDS, JOB_ITEMS, JOB_BACKLOG
+from .LogPipeline import correlation_id
+from .Throttle import upstream_priority, BULK
+
+class TokenBucket:
+    """非同步token bucket，每秒補充rate個token，最多累積capacity個，用來限制對外請求的速率"""
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        """
+        :param rate: 每秒補充的token數量
+        :param capacity: 最多累積的token數量(允許的瞬間爆量)，預設與rate相同
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.__tokens = self.capacity
+        self.__updated_at = time.monotonic()
+        self.__lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """取得token，token不足時等待至補充完成"""
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            while True:
+                self.__refill()
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.__tokens) / self.rate)
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated_at) * self.rate)
+        self.__updated_at = now
+
+async def runRateLimited(
+    items: Iterable[Any],
+    worker: Callable[[Any], Awaitable[None]],
+    *,
+    concurrency: int,
+    buckets: Callable[[Any], List[TokenBucket]] = None,
+    name: str = 'job',
+    job: str = None,
+    progress_interval: float = 30.0
+) -> Dict[str, int]:
+    """以固定數量的worker並行處理items，每個item執行前先從對應的token bucket取得token
+    :param items: 要處理的項目
+    :param worker: 處理單一項目的coroutine function，拋出例外視為失敗
+    :param concurrency: 同時執行的worker數量
+    :param buckets: 回傳該項目需要取得token的bucket列表(例如全域+區域)，為None時不限速
+    :param name: 記錄進度時顯示的名稱
+    :param job: metrics使用的工作名稱，預設與name相同
+    :param progress_interval: 每隔多少秒記錄一次進度與預估剩餘時間
+    :return: {'total': 總數, 'done': 成功數, 'failed': 失敗數}
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    stats = {'total': queue.qsize(), 'done': 0, 'failed': 0}
+    job = job or name
+    JOB_BACKLOG.setFunction(queue.qsize, job)
+    # worker由gather建立成task時會複製目前的context，因此這次執行的所有log都帶有相同的關聯ID
+    correlation_token = correlation_id.set(f'{job}-{uuid.uuid4().hex[:8]}')
+    # 排程工作對HoYoLAB的請求排在互動指令之後
+    priority_token = upstream_priority.set(BULK)
+    start_time = time.monotonic()
+    last_report = start_time
+
+    async def run_worker():
+        nonlocal last_report
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                for bucket in (buckets(item) if buckets else []):
+                    await bucket.acquire()
+                await worker(item)
+            except Exception as e:
+                stats['failed'] += 1
+                JOB_ITEMS.inc(job, 'failed')
+                log.error(f'{name}: {item}: {e}')
+            else:
+                stats['done'] += 1
+                JOB_ITEMS.inc(job, 'done')
+            now = time.monotonic()
+            if now - last_report >= progress_interval:
+                last_report = now
+                finished = stats['done'] + stats['failed']
+                eta = (now - start_time) / finished * (stats['total'] - finished)
+                log.info(f'{name}進度：{finished}/{stats["total"]}，失敗 {stats["failed"]}，預估剩餘 {eta:.0f} 秒')
+
+    try:
+        await asyncio.gather(*[run_worker() for _ in range(max(1, min(concurrency, stats['total'])))])
+        JOB_SECONDS.observe(time.monotonic() - start_time, job)
+        log.info(f'{name}完成：成功 {stats["done"]}，失敗 {stats["failed"]}，耗時 {time.monotonic() - start_time:.1f} 秒')
+        return stats
+    finally:
+        # 還原呼叫端的context，之後的請求與從它建立的task(例如快取的single-flight請求)不會沿用排程的優先順序與關聯ID
+        upstream_priority.reset(priority_token)
+        correlation_id.reset(correlation_token)
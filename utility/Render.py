@@ -0,0 +1,218 @@
+import copy
+import discord
+import genshin
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Hashable, List, Tuple
+from .utils import getCharacterName
+import os
+
+# 啟動時就把指令前綴套入固定的訊息，之後不需要每次讀取環境變數
+__prefix = os.getenv('BOT_PREFIX')
+messages = {
+    'cookie_invalid': f'無效的Cookie，請重新輸入(使用 `{__prefix}help cookie` 查看教學)',
+    'choose_uid': f'即時便箋、樹脂提醒、自動簽到與自動兌換包含全部角色，深淵、札記與兌換碼指令使用主要角色，可用`{__prefix}uid`切換(例: `{__prefix}uid 812345678`)',
+    'uid_not_saved': f'不在已保存的角色中，其他Hoyolab帳號的角色請先用`{__prefix}addcookie`加入',
+    'uid_set_failed': f'設定失敗，請先設定Cookie(輸入 `{__prefix}help cookie` 取得詳情)',
+    'user_not_found': f'找不到使用者，請先設定Cookie(輸入 `{__prefix}help cookie` 顯示說明)',
+    'cookie_not_found': f'找不到Cookie，請先設定Cookie(輸入 `{__prefix}help cookie` 顯示說明)',
+    'abyss_rank_not_found': f'這個伺服器還沒有深境螺旋紀錄，成員在伺服器中使用 `{__prefix}abyss` 查詢後會加入排行',
+    'cookie_expired': f'Cookie已過期，請重新登入Hoyolab後再設定Cookie(輸入 `{__prefix}help cookie` 顯示說明)',
+    'uid_not_found': f'找不到角色UID，請先設定UID(輸入 `{__prefix}help` 顯示說明)',
+    'history_not_found': f'尚無歷史紀錄，請先開啟歷史紀錄同步(輸入 `{__prefix}help set` 顯示說明)',
+}
+
+server_names = {'os_usa': '美服', 'os_euro': '歐服', 'os_asia': '亞服', 'os_cht': '台港澳服'}
+weekday_names = ('週一', '週二', '週三', '週四', '週五', '週六', '週日')
+
+__notes_template = (
+    '當前樹脂：{current_resin}/{max_resin}\n'
+    '樹脂全部恢復時間：{resin_recover_time}\n'
+    '每日委託任務：{completed_commissions} 已完成\n'
+    '當前洞天寶錢/上限：{current_realm_currency}/{max_realm_currency}\n'
+    '寶錢全部恢復時間：{realm_recover_time}\n'
+    '週本樹脂減半：剩餘 {remaining_resin_discounts} 次\n'
+    '--------------------\n'
+    '探索派遣已完成/總數量：{expedition_finished}/{expedition_total}\n'
+).format
+
+class RenderMemo:
+    """保存渲染結果的LRU快取
+    key相同且pin為同一個物件時直接回傳之前的結果；pin用來綁定快取中的原始資料物件，
+    只要結果快取還保存著同一個物件，就不需要重新渲染
+    """
+    def __init__(self, max_size: int = 4096) -> None:
+        self.__max_size = max_size
+        self.__data: 'OrderedDict[Hashable, Tuple[Any, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, render: Callable[[], Any], pin: Any = None) -> Any:
+        item = self.__data.get(key)
+        if item is not None and item[0] is pin:
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+        self.misses += 1
+        value = render()
+        self.__data[key] = (pin, value)
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.__max_size:
+            self.__data.popitem(last=False)
+        return value
+
+__notes_memo = RenderMemo()
+__embed_memo = RenderMemo(max_size=1024)
+
+def __dayTime(time: datetime, today: int) -> str:
+    return f'{"今天" if time.day == today else "明天"} {time.strftime("%H:%M")}'
+
+def __minute(time: datetime) -> int:
+    return int(time.timestamp() // 60)
+
+def maskUID(uid: str) -> str:
+    """遮蔽UID中間的數字"""
+    return uid.replace(uid[3:-3], '***', 1)
+
+def renderNotesHeader(uid: str, nickname: str = None, region: str = None) -> str:
+    """即時便箋的標頭，沒有角色名稱時只顯示遮蔽後的UID"""
+    masked_uid = maskUID(uid)
+    if nickname is None:
+        return f'{masked_uid}\n--------------------\n'
+    return f'{nickname} {server_names.get(region, region)} {masked_uid}\n--------------------\n'
+
+def renderNotes(notes: genshin.models.Notes) -> str:
+    """即時便箋內容，顯示到分鐘，因此顯示內容相同的便箋只會渲染一次"""
+    today = datetime.now().day
+    key = (
+        today, notes.current_resin, notes.max_resin, __minute(notes.resin_recovered_at),
+        notes.completed_commissions, notes.current_realm_currency, notes.max_realm_currency,
+        __minute(notes.realm_currency_recovered_at), notes.remaining_resin_discounts,
+        tuple((e.character.id, e.finished, __minute(e.completed_at)) for e in notes.expeditions)
+    )
+    return __notes_memo.get(key, lambda: __renderNotes(notes, today))
+
+def __renderNotes(notes: genshin.models.Notes, today: int) -> str:
+    expedition_lines = [
+        f'· {getCharacterName(e.character)}：已完成\n' if e.finished
+        else f'· {getCharacterName(e.character)} 完成時間：{__dayTime(e.completed_at, today)}\n'
+        for e in notes.expeditions
+    ]
+    realm_time = notes.realm_currency_recovered_at
+    return __notes_template(
+        current_resin=notes.current_resin,
+        max_resin=notes.max_resin,
+        resin_recover_time='已額滿！' if notes.current_resin == notes.max_resin else __dayTime(notes.resin_recovered_at, today),
+        completed_commissions=notes.completed_commissions,
+        current_realm_currency=notes.current_realm_currency,
+        max_realm_currency=notes.max_realm_currency,
+        realm_recover_time=f'{weekday_names[realm_time.weekday()]} {realm_time.strftime("%H:%M")}',
+        remaining_resin_discounts=notes.remaining_resin_discounts,
+        expedition_finished=sum(1 for e in notes.expeditions if e.finished),
+        expedition_total=len(notes.expeditions)
+    ) + ''.join(expedition_lines)
+
+def renderSpiralAbyss(abyss: genshin.models.SpiralAbyss, full_data: bool = False) -> discord.Embed:
+    """深境螺旋戰績，full_data為False時只顯示最後一層；同一份快取中的資料只渲染一次"""
+    data = __embed_memo.get(('abyss', id(abyss), full_data), lambda: __renderSpiralAbyss(abyss, full_data).to_dict(), pin=abyss)
+    # Embed.from_dict會直接使用傳入的dict，複製一份避免呼叫端修改到快取內容
+    return discord.Embed.from_dict(copy.deepcopy(data))
+
+def __renderSpiralAbyss(abyss: genshin.models.SpiralAbyss, full_data: bool) -> discord.Embed:
+    result = discord.Embed(title=f'深境螺旋第 {abyss.season} 期戰績', color=0x7fbcf5)
+    result.add_field(
+        name=f'最深抵達：{abyss.max_floor}　戰鬥次數：{abyss.total_battles}　★：{abyss.total_stars}',
+        value=f'統計週期：{abyss.start_time.strftime("%Y.%m.%d")} ~ {abyss.end_time.strftime("%Y.%m.%d")}',
+        inline=False
+    )
+    floors = abyss.floors if full_data else abyss.floors[-1:]
+    for floor in floors:
+        for chamber in floor.chambers:
+            # 深淵上下半層角色名字
+            halves = [".".join(getCharacterName(chara) for chara in battle.characters) for battle in chamber.battles]
+            halves += [''] * (2 - len(halves))
+            result.add_field(name=f'{floor.floor}-{chamber.chamber}　★{chamber.stars}', value=f'[{halves[0]}]／[{halves[1]}]')
+    return result
+
+def renderTravelerDiary(diary: genshin.models.Diary, month: str) -> discord.Embed:
+    """旅行者札記，同一份快取中的資料只渲染一次"""
+    data = __embed_memo.get(('diary', id(diary), str(month)), lambda: __renderTravelerDiary(diary, month).to_dict(), pin=diary)
+    return discord.Embed.from_dict(copy.deepcopy(data))
+
+def __renderTravelerDiary(diary: genshin.models.Diary, month: str) -> discord.Embed:
+    d = diary.data
+    result = discord.Embed(
+        title=f'{diary.nickname}的旅行者札記：{month}月',
+        description=f'原石收入比上個月{"增加" if d.primogems_rate > 0 else "減少"}了{abs(d.primogems_rate)}%，摩拉收入比上個月{"增加" if d.mora_rate > 0 else "減少"}了{abs(d.mora_rate)}%',
+        color=0xfd96f4
+    )
+    result.add_field(
+        name='當月共獲得',
+        value=f'原石：{d.current_primogems}　上個月：{d.last_primogems}\n'
+            f'摩拉：{d.current_mora}　上個月：{d.last_mora}',
+        inline=False
+    )
+    # 將札記原石組成平分成兩個field
+    length = len(d.categories)
+    for i in range(0, 2):
+        categories = d.categories[round(length/2*i):round(length/2*(i+1))]
+        result.add_field(name=f'原石收入組成 {i+1}', value=''.join(f'{c.name[0:2]}：{c.percentage}%\n' for c in categories), inline=True)
+    return result
+
+def renderHistory(uid: str, primogems: List[Tuple[int, int]], abyss: List[Tuple[int, float, str, int, int]]) -> discord.Embed:
+    """本地保存的歷史紀錄
+    :param primogems: [(YYYYMM, 原石)]
+    :param abyss: [(期數, 結束時間, 最深抵達, 星數, 戰鬥次數)]
+    """
+    result = discord.Embed(title=f'{uid.replace(uid[3:-3], "***", 1)} 的歷史紀錄', color=0x7fbcf5)
+    if len(primogems) > 0:
+        result.add_field(
+            name=f'近一年原石收入：共 {sum(p for _, p in primogems)}',
+            value=''.join(f'{month // 100}.{month % 100:02d}：{p}\n' for month, p in primogems),
+            inline=True
+        )
+    if len(abyss) > 0:
+        result.add_field(
+            name='深境螺旋',
+            value=''.join(
+                f'第 {season} 期 ({datetime.fromtimestamp(end_time).strftime("%m.%d")})：{max_floor} ★{stars}\n'
+                for season, end_time, max_floor, stars, _ in abyss
+            ),
+            inline=True
+        )
+    return result
+
+def renderAbyssRank(season: int, rows: List[Tuple[str, str, int, int]], members: int) -> discord.Embed:
+    """伺服器的深淵排行
+    :param rows: [(使用者ID, 最深抵達, 星數, 戰鬥次數)]
+    """
+    result = discord.Embed(
+        title=f'深境螺旋第 {season} 期伺服器排行',
+        description=''.join(
+            f'{i}. <@{user_id}>　{max_floor}　★{stars}　戰鬥 {battles} 次\n' for i, (user_id, max_floor, stars, battles) in enumerate(rows, 1)
+        ),
+        color=0x7fbcf5
+    )
+    result.set_footer(text=f'共 {members} 位成員有紀錄')
+    return result
+
+def renderAbyssTeams(season: int, characters: List[Tuple[str, int]], teams: List[Tuple[str, int]], members: int) -> discord.Embed:
+    """伺服器第12層的角色與隊伍使用人數
+    :param characters: [(角色, 人數)]
+    :param teams: [(隊伍, 人數)]
+    """
+    result = discord.Embed(title=f'深境螺旋第 {season} 期伺服器第12層使用率', color=0x7fbcf5)
+    if len(characters) > 0:
+        result.add_field(
+            name='角色',
+            value=''.join(f'{name}：{count} 人 ({count / members:.0%})\n' for name, count in characters),
+            inline=False
+        )
+    if len(teams) > 0:
+        result.add_field(
+            name='隊伍',
+            value=''.join(f'[{team}]：{count} 人\n' for team, count in teams),
+            inline=False
+        )
+    result.set_footer(text=f'共 {members} 位成員有紀錄')
+    return result
@@ -0,0 +1,154 @@
+import math
+import time
+import genshin
+import numpy as np
+from typing import Dict, List, Optional
+
+class ResinScheduler:
+    """以欄位陣列保存每位使用者最後一次取得的即時便箋快照(時間、樹脂、上限、洞天寶錢)
+    樹脂以固定速度恢復、洞天寶錢的額滿時間由即時便箋提供，因此每次排程只要一次向量運算，
+    就能找出在接下來window秒內樹脂會超過提醒門檻、或洞天寶錢會額滿的使用者，只向Hoyolab取得這些人的即時便箋
+    """
+    RESIN_RECOVERY_SECONDS = 8 * 60
+    # 快照時間、樹脂、樹脂上限、洞天寶錢、寶錢上限、寶錢額滿時間、最早可再檢查的時間、是否仍在排程、寶錢額滿是否已提醒
+    __columns = ('snapshot', 'resin', 'max_resin', 'realm', 'max_realm', 'realm_full_at', 'not_before', 'active', 'realm_notified')
+
+    def __init__(self, threshold: int, renotify_interval: float = 3600, max_interval: float = 3 * 3600, window: float = 0) -> None:
+        """
+        :param threshold: 樹脂提醒門檻
+        :param renotify_interval: 已發送提醒或取得資料失敗後，隔多久再檢查一次(秒)
+        :param max_interval: 兩次檢查的最長間隔(秒)，避免使用脆弱樹脂等無法預測的情況讓提醒延遲太久
+        :param window: 預測的提前量(秒)，通常是排程的執行間隔，讓下次排程前就會超過門檻的使用者在這次就被提醒
+        """
+        self.threshold = threshold
+        self.renotify_interval = renotify_interval
+        self.max_interval = max_interval
+        self.window = window
+        self.__slots: Dict[str, int] = { }
+        self.__user_ids: List[Optional[str]] = []
+        self.__free: List[int] = []
+        self.__cols: Dict[str, np.ndarray] = {name: self.__newColumn(0) for name in self.__columns}
+
+    def add(self, user_id: str, due: float = 0) -> None:
+        """新增使用者，沒有快照的使用者在due(epoch秒，預設為立即)之後檢查"""
+        i = self.__slot(str(user_id))
+        self.__setRow(i, snapshot=0, resin=0, max_resin=0, realm=0, max_realm=0, realm_full_at=math.inf,
+                      not_before=due, active=1, realm_notified=0)
+
+    def remove(self, user_id: str) -> None:
+        """移除使用者，空出的位置留給之後新增的使用者"""
+        i = self.__slots.pop(str(user_id), None)
+        if i is None:
+            return
+        self.__cols['active'][i] = 0
+        self.__user_ids[i] = None
+        self.__free.append(i)
+
+    def popDue(self, now: float = None) -> List[str]:
+        """取出所有需要檢查的使用者，取出後需再呼叫add或reschedule重新排定"""
+        now = time.time() if now is None else now
+        due_index = self.__dueIndex(now + self.window, now)
+        for i in due_index:
+            # 檢查中的使用者在reschedule之前不會再被取出
+            self.__cols['not_before'][i] = math.inf
+        return [self.__user_ids[i] for i in due_index]
+
+    def reschedule(self, user_id: str, notes: genshin.models.Notes = None, now: float = None) -> float:
+        """以最新的即時便箋更新快照並重新排定
+        :param notes: 剛取得的即時便箋，為None(取得失敗)時保留舊的快照，於renotify_interval後再檢查
+        :return: 預測的下次檢查時間(epoch秒)
+        """
+        now = time.time() if now is None else now
+        i = self.__slots.get(str(user_id))
+        if i is None:
+            self.add(user_id)
+            i = self.__slots[str(user_id)]
+        if notes is None:
+            self.__cols['not_before'][i] = now + self.renotify_interval
+        else:
+            self.__setRow(
+                i,
+                snapshot=now,
+                resin=notes.current_resin,
+                max_resin=notes.max_resin,
+                realm=notes.current_realm_currency,
+                max_realm=notes.max_realm_currency,
+                realm_full_at=notes.realm_currency_recovered_at.timestamp() if notes.max_realm_currency > 0 else math.inf,
+                # 已發送樹脂提醒時，隔一段時間再提醒；否則依照預測決定
+                not_before=now + self.renotify_interval if self.isResinAlert(notes) else now,
+                # 寶錢額滿只提醒一次，寶錢被使用後才會再次提醒
+                realm_notified=1 if self.__isRealmFull(notes, now) else 0
+            )
+        return self.__predictDue(i, now)
+
+    def isResinAlert(self, notes: genshin.models.Notes) -> bool:
+        """樹脂已超過門檻，或在window秒內就會超過門檻"""
+        return notes.current_resin + self.window // self.RESIN_RECOVERY_SECONDS >= self.threshold
+
+    def isRealmAlert(self, user_id: str, notes: genshin.models.Notes, now: float = None) -> bool:
+        """洞天寶錢已額滿或在window秒內就會額滿，且還沒有提醒過"""
+        i = self.__slots.get(str(user_id))
+        notified = i is not None and self.__cols['realm_notified'][i] == 1
+        return self.__isRealmFull(notes, time.time() if now is None else now) and notified == False
+
+    def __isRealmFull(self, notes: genshin.models.Notes, now: float) -> bool:
+        if notes.max_realm_currency <= 0:
+            return False
+        return notes.current_realm_currency >= notes.max_realm_currency or notes.realm_currency_recovered_at.timestamp() <= now + self.window
+
+    def __dueIndex(self, horizon: float, now: float) -> List[int]:
+        c = self.__cols
+        n = len(self.__user_ids)
+        # 預測horizon時的樹脂 = min(上限, 快照樹脂 + 經過時間/恢復速度)
+        predicted = np.minimum(c['max_resin'][:n], c['resin'][:n] + np.floor((horizon - c['snapshot'][:n]) / self.RESIN_RECOVERY_SECONDS))
+        mask = (c['active'][:n] == 1) & (c['not_before'][:n] <= now) & (
+            (predicted >= self.threshold)
+            | ((c['realm_full_at'][:n] <= horizon) & (c['realm_notified'][:n] == 0))
+            | (c['snapshot'][:n] + self.max_interval <= now)
+        )
+        return np.nonzero(mask)[0].tolist()
+
+    def __predictDue(self, i: int, now: float) -> float:
+        c = self.__cols
+        stale_at = c['snapshot'][i] + self.max_interval
+        if self.threshold <= c['max_resin'][i]:
+            resin_at = c['snapshot'][i] + (self.threshold - c['resin'][i]) * self.RESIN_RECOVERY_SECONDS - self.window
+        else:
+            resin_at = math.inf
+        realm_at = c['realm_full_at'][i] - self.window if c['realm_notified'][i] == 0 else math.inf
+        return float(max(min(stale_at, resin_at, realm_at), c['not_before'][i], now))
+
+    def __slot(self, user_id: str) -> int:
+        i = self.__slots.get(user_id)
+        if i is not None:
+            return i
+        if len(self.__free) > 0:
+            i = self.__free.pop()
+            self.__user_ids[i] = user_id
+        else:
+            i = len(self.__user_ids)
+            self.__user_ids.append(user_id)
+            if i >= len(self.__cols['active']):
+                self.__grow(max(64, i * 2))
+        self.__slots[user_id] = i
+        return i
+
+    def __setRow(self, i: int, **values: float) -> None:
+        for name, value in values.items():
+            self.__cols[name][i] = value
+
+    def __grow(self, capacity: int) -> None:
+        for name, column in self.__cols.items():
+            new_column = self.__newColumn(capacity)
+            new_column[:len(column)] = column
+            self.__cols[name] = new_column
+
+    @staticmethod
+    def __newColumn(capacity: int) -> np.ndarray:
+        return np.zeros(capacity, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.__slots)
+
+    def __contains__(self, user_id: str) -> bool:
+        return str(user_id) in self.__slots
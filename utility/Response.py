@@ -0,0 +1,54 @@
+import asyncio
+import discord
+from discord.ext import commands
+from typing import Awaitable, Optional, Set, Union
+from .utils import log
+
+# 背景執行的工作，保留參考避免執行中被回收
+__background_tasks: Set[asyncio.Future] = set()
+
+def runInBackground(coro: Awaitable, description: str) -> None:
+    """在背景執行不影響回覆內容的工作(例如刪除訊息、顯示輸入中、開啟功能後的首次同步)，失敗只記錄log"""
+    async def run():
+        try:
+            await coro
+        except Exception as e:
+            log.warning(f'{description}: {e}')
+    task = asyncio.ensure_future(run())
+    __background_tasks.add(task)
+    task.add_done_callback(__background_tasks.discard)
+
+def canManageMessages(ctx: commands.Context) -> bool:
+    """機器人在此伺服器是否有管理訊息的權限，私訊時為False"""
+    permissions = getattr(ctx.me, 'guild_permissions', None)
+    return permissions is not None and permissions.manage_messages
+
+async def respond(
+    ctx: commands.Context,
+    work: Awaitable[Union[str, discord.Embed, None]],
+    *,
+    delete_command: bool = False,
+    typing_delay: float = 0.5
+) -> Optional[discord.Message]:
+    """執行指令的工作並以一則訊息回覆結果
+    取代「送出讀取中→刪除→回覆」的流程：工作超過typing_delay秒還沒完成時才在背景顯示輸入中，
+    結果只送出一次；刪除使用者的指令訊息也在背景進行，不會延遲回覆
+    :param work: 產生回覆內容的coroutine，回傳文字或embed，None時不回覆
+    :param delete_command: 刪除使用者的指令訊息(例如包含Cookie)，此時以提及使用者的訊息回覆而不是reply
+    :param typing_delay: 工作超過幾秒才顯示輸入中，快取命中等快速的指令不需要額外的請求
+    """
+    if delete_command and canManageMessages(ctx):
+        runInBackground(ctx.message.delete(), 'delete command message')
+    task = asyncio.ensure_future(work)
+    done, _ = await asyncio.wait({task}, timeout=typing_delay)
+    if len(done) == 0:
+        runInBackground(ctx.trigger_typing(), 'trigger typing')
+    result = await task
+    if result is None:
+        return None
+    content, embed = (None, result) if isinstance(result, discord.Embed) else (str(result), None)
+    if delete_command:
+        # 原本的訊息已被刪除，無法使用reply
+        content = f'<@{ctx.author.id}> {content}' if content is not None else f'<@{ctx.author.id}>'
+        return await ctx.send(content, embed=embed)
+    return await ctx.reply(content, embed=embed)
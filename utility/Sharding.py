@@ -0,0 +1,87 @@
+import os
+from typing import Dict, List, Optional, Tuple
+from .utils import log
+
+class ShardConfig:
+    """分片設定，決定機器人的連線方式，以及這個process負責哪些伺服器的自動化排程
+
+    SHARD_COUNT 未設定：單一連線(commands.Bot)
+    SHARD_COUNT=auto：由Discord建議分片數量，全部分片在同一個process(AutoShardedBot)
+    SHARD_COUNT=N：共N個分片；若再設定 SHARD_IDS(例: 0-3 或 0,2,4)，這個process只執行這些分片，
+                   其餘分片由其他process執行，每個process只處理自己負責的伺服器的排程
+    """
+    def __init__(self, shard_count: Optional[int], shard_ids: Optional[List[int]], enabled: bool) -> None:
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.enabled = enabled
+
+    @property
+    def multi_process(self) -> bool:
+        """是否由多個process分別執行不同的分片"""
+        return self.shard_ids is not None
+
+    @property
+    def label(self) -> str:
+        """這個process負責的分片，用來區分多個process共用的資料"""
+        return ','.join(str(i) for i in self.shard_ids) if self.multi_process else 'all'
+
+    def ownsGuild(self, guild_id: Optional[int]) -> bool:
+        """該伺服器是否由這個process負責，私訊固定由分片0處理"""
+        if self.multi_process == False:
+            return True
+        if guild_id is None:
+            return 0 in self.shard_ids
+        return (int(guild_id) >> 22) % self.shard_count in self.shard_ids
+
+    def ownsEntry(self, entry: dict) -> Optional[bool]:
+        """排程訂閱資料是否由這個process負責；舊資料沒有記錄伺服器時回傳None"""
+        if self.multi_process == False:
+            return True
+        if 'guild' not in entry:
+            return None
+        return self.ownsGuild(int(entry['guild']) if entry['guild'] else None)
+
+    def mergeEntries(self, local: Dict[str, dict], shared: Dict[str, dict]) -> Tuple[Dict[str, dict], List[str]]:
+        """多個process共用同一個排程檔案時，合併這個process的訂閱與檔案中的訂閱
+        其他process負責的訂閱保留檔案中的內容，這個process負責的訂閱以local為準；
+        同一位使用者在檔案中的訂閱已由其他process負責且不比local舊時(使用者改到其他process的伺服器設定)，捨棄local的舊訂閱
+        :return: (要寫入的資料, 被捨棄的使用者ID)
+        """
+        merged = {user_id: value for user_id, value in shared.items() if self.ownsEntry(value) != True}
+        moved = []
+        for user_id, value in local.items():
+            if self.ownsEntry(value) == False:
+                continue
+            other = shared.get(user_id)
+            if other is not None and self.ownsEntry(other) == False and other.get('updated_at', 0) >= value.get('updated_at', 0):
+                moved.append(user_id)
+                continue
+            merged[user_id] = value
+        return merged, moved
+
+def parseShardIds(text: str) -> List[int]:
+    """解析 '0-3' 或 '0,2,4' 或 '0-1,4' 格式的分片ID"""
+    ids = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-')
+            ids.extend(range(int(start), int(end) + 1))
+        elif part != '':
+            ids.append(int(part))
+    return sorted(set(ids))
+
+def loadShardConfig() -> ShardConfig:
+    shard_count = os.getenv('SHARD_COUNT', '').strip().lower()
+    shard_ids = os.getenv('SHARD_IDS', '').strip()
+    if shard_count == '':
+        return ShardConfig(None, None, False)
+    if shard_count == 'auto':
+        return ShardConfig(None, None, True)
+    ids = parseShardIds(shard_ids) if shard_ids != '' else None
+    if ids is not None and any(i >= int(shard_count) for i in ids):
+        raise ValueError(f'SHARD_IDS={shard_ids} 超出 SHARD_COUNT={shard_count} 的範圍')
+    log.info(f'分片設定：共 {shard_count} 個分片，本process負責 {ids if ids is not None else "全部"}')
+    return ShardConfig(int(shard_count), ids, True)
+
+shard_config = loadShardConfig()
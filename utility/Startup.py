@@ -0,0 +1,106 @@
+import ast
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Set, Tuple
+from discord.ext import commands
+from .utils import log
+
+class StartupTimer:
+    """記錄啟動時各階段的耗時，連線完成後輸出報告"""
+    def __init__(self, start: float = None) -> None:
+        """
+        :param start: 開始計時的time.perf_counter()，通常在main.py最上方取得
+        """
+        self.__start = time.perf_counter() if start is None else start
+        self.__last = self.__start
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        """記錄從上一個階段結束到現在的耗時"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.__last))
+        self.__last = now
+
+    def add(self, phase: str, seconds: float) -> None:
+        """記錄與其他階段同時進行的背景工作耗時(例如讀取使用者資料)"""
+        self.phases.append((f'{phase}(背景)', seconds))
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.__start
+        return f'啟動完成，共 {total:.2f} 秒：' + '、'.join(f'{phase} {seconds:.2f} 秒' for phase, seconds in self.phases)
+
+class CogLoader:
+    """載入cogs資料夾內的cog
+    lazy模式下，有背景工作(tasks.loop)或事件監聽(Cog.listener)的cog在啟動時載入，
+    其餘的cog在第一次有人使用其中的指令時才載入；指令名稱在啟動時以解析原始碼的方式取得，不需要先匯入模組
+    """
+    def __init__(self, bot: commands.Bot, path: str = './cogs', lazy: bool = True, on_load: Callable[[str], None] = None) -> None:
+        """
+        :param on_load: 每個cog載入後呼叫，參數為extension名稱
+        """
+        self.bot = bot
+        self.lazy = lazy
+        self.__on_load = on_load
+        self.__pending: Dict[str, Set[str]] = { }
+        self.__eager: List[str] = []
+        for filepath in sorted(Path(path).glob('**/*.py')):
+            extension = f'cogs.{filepath.stem}'
+            command_names, needs_eager = self.__scan(filepath)
+            if lazy == False or needs_eager:
+                self.__eager.append(extension)
+            else:
+                self.__pending[extension] = command_names
+
+    def loadEager(self) -> None:
+        """載入啟動時就需要的cog"""
+        for extension in self.__eager:
+            self.__load(extension)
+        if len(self.__pending) > 0:
+            log.info(f'延遲載入的cog：{", ".join(self.__pending.keys())}')
+
+    def loadFor(self, command_name: str) -> bool:
+        """載入包含此指令的cog，有載入時回傳True"""
+        for extension, command_names in list(self.__pending.items()):
+            if command_name in command_names:
+                del self.__pending[extension]
+                self.__load(extension)
+                return True
+        return False
+
+    def loadAll(self) -> None:
+        """載入所有尚未載入的cog，例如顯示說明時需要列出全部指令"""
+        for extension in list(self.__pending.keys()):
+            del self.__pending[extension]
+            self.__load(extension)
+
+    def __load(self, extension: str) -> None:
+        start = time.perf_counter()
+        self.bot.load_extension(extension)
+        log.info(f'已載入 {extension} ({time.perf_counter() - start:.2f} 秒)')
+        if self.__on_load is not None:
+            self.__on_load(extension)
+
+    @staticmethod
+    def __scan(filepath: Path) -> Tuple[Set[str], bool]:
+        """解析cog原始碼，取得所有指令名稱與別名，以及是否有背景工作或事件監聽"""
+        tree = ast.parse(filepath.read_text(encoding='utf-8'))
+        command_names: Set[str] = set()
+        needs_eager = False
+        for node in ast.walk(tree):
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            for decorator in node.decorator_list:
+                func = decorator.func if isinstance(decorator, ast.Call) else decorator
+                attr = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+                if attr in ('loop', 'listener'):
+                    needs_eager = True
+                if attr not in ('command', 'group') or not isinstance(decorator, ast.Call):
+                    continue
+                command_names.add(node.name)
+                for keyword in decorator.keywords:
+                    if keyword.arg == 'name' and isinstance(keyword.value, ast.Constant):
+                        command_names.add(keyword.value.value)
+                    if keyword.arg == 'aliases' and isinstance(keyword.value, (ast.List, ast.Tuple)):
+                        command_names.update(e.value for e in keyword.value.elts if isinstance(e, ast.Constant))
+        # 解析不到任何指令時保守地在啟動時載入
+        return command_names, needs_eager or len(command_names) == 0
@@ -0,0 +1,219 @@
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+import genshin
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from .utils import log, isTransientError
+from .Metrics import Counter, Gauge, Histogram, observeUpstream
+import os
+
+# 請求的優先順序，數字越小越優先；runRateLimited執行的排程工作會設為BULK
+INTERACTIVE = 0
+BULK = 1
+upstream_priority: contextvars.ContextVar[int] = contextvars.ContextVar('upstream_priority', default=INTERACTIVE)
+
+UPSTREAM_THROTTLE_WAIT = Histogram('genshin_bot_upstream_throttle_wait_seconds', 'Time spent waiting for the upstream throttle', ['priority'])
+UPSTREAM_THROTTLE_REJECTED = Counter('genshin_bot_upstream_throttle_rejected_total', 'Upstream calls rejected by the throttle', ['endpoint', 'reason'])
+UPSTREAM_RATE = Gauge('genshin_bot_upstream_rate', 'Current adaptive upstream request rate (requests per second)')
+UPSTREAM_BREAKER_OPEN = Gauge('genshin_bot_upstream_breaker_open', 'Whether the circuit breaker of an endpoint is open', ['endpoint'])
+
+class UpstreamThrottled(genshin.errors.GenshinException):
+    """HoYoLAB目前過於忙碌，請求在送出前就被拒絕；繼承GenshinException，原本顯示錯誤訊息的地方不需要修改"""
+    def __init__(self, msg: str = '目前使用人數眾多，請稍後再試') -> None:
+        super().__init__({'retcode': 0, 'message': msg}, msg)
+
+class PriorityTokenBucket:
+    """依優先順序分配token的token bucket，並以AIMD調整速率
+    遇到HoYoLAB回傳請求過於頻繁時速率減半，之後每次成功慢慢加回，最低不低於min_rate
+    """
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = None) -> None:
+        """
+        :param rate: 每秒補充的token數量上限
+        :param capacity: 最多累積的token數量，預設與rate相同
+        :param min_rate: 被減速時的最低速率，預設為rate的1/16
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.__tokens = self.capacity
+        self.__updated_at = time.monotonic()
+        self.__waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.__counter = itertools.count()
+        self.__dispatcher: Optional[asyncio.Task] = None
+        self.__penalized_at = 0.0
+
+    @property
+    def pressure(self) -> float:
+        """目前速率被降低的倍數，1為沒有降速"""
+        return self.max_rate / self.rate
+
+    async def acquire(self, priority: int = INTERACTIVE, timeout: float = None) -> None:
+        """取得一個token；有人在等待時依優先順序排隊，超過timeout秒時拋出asyncio.TimeoutError"""
+        self.__refill()
+        if len(self.__waiters) == 0 and self.__tokens >= 1:
+            self.__tokens -= 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.__waiters, (priority, next(self.__counter), future))
+        if self.__dispatcher is None or self.__dispatcher.done():
+            self.__dispatcher = asyncio.ensure_future(self.__dispatch())
+        # 逾時或取消時future會被取消，分配token時略過
+        await asyncio.wait_for(future, timeout)
+
+    def penalize(self) -> None:
+        """上游回報過於頻繁，速率減半；同時送出的請求會一起失敗，每秒最多減速一次"""
+        now = time.monotonic()
+        if now - self.__penalized_at < 1.0:
+            return
+        self.__penalized_at = now
+        rate = max(self.min_rate, self.rate / 2)
+        if rate < self.rate:
+            log.warning(f'HoYoLAB請求過於頻繁，速率降為每秒 {rate:.2f} 次')
+        self.rate = rate
+
+    def reward(self) -> None:
+        """請求成功，速率慢慢恢復"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    async def __dispatch(self) -> None:
+        while len(self.__waiters) > 0:
+            self.__refill()
+            while self.__tokens >= 1 and len(self.__waiters) > 0:
+                _, _, future = heapq.heappop(self.__waiters)
+                if not future.done():
+                    future.set_result(None)
+                    self.__tokens -= 1
+            if len(self.__waiters) > 0:
+                await asyncio.sleep((1 - self.__tokens) / self.rate)
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated_at) * self.rate)
+        self.__updated_at = now
+
+class CircuitBreaker:
+    """單一endpoint的斷路器
+    連續failure_threshold次暫時性錯誤後開啟，開啟期間拒絕請求；時間到後只放行一個試探請求，
+    成功就關閉，失敗就再次開啟並加倍開啟時間(最長max_open_seconds)
+    """
+    def __init__(self, endpoint: str, failure_threshold: int = 5, open_seconds: float = 30.0, max_open_seconds: float = 300.0) -> None:
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.__open_seconds = open_seconds
+        self.__failures = 0
+        self.__open_until: Optional[float] = None
+        self.__probing = False
+        UPSTREAM_BREAKER_OPEN.setFunction(lambda: 1 if self.__open_until is not None else 0, endpoint)
+
+    def retryAfter(self) -> float:
+        """還要多久才可以送出請求(秒)，0為可以立即送出"""
+        if self.__open_until is None:
+            return 0
+        remaining = self.__open_until - time.monotonic()
+        if remaining > 0:
+            return remaining
+        # 開啟時間已過(半開)，試探請求還沒有結果時其他請求稍後再試
+        return 1.0 if self.__probing else 0
+
+    def begin(self) -> None:
+        """送出請求前呼叫，半開狀態下的第一個請求作為試探請求"""
+        if self.__open_until is not None:
+            self.__probing = True
+
+    def success(self) -> None:
+        if self.__open_until is not None:
+            log.info(f'{self.endpoint} 斷路器已關閉')
+        self.__failures = 0
+        self.__open_until = None
+        self.__probing = False
+        self.__open_seconds = self.base_open_seconds
+
+    def failure(self) -> None:
+        self.__failures += 1
+        if self.__probing:
+            self.__open_seconds = min(self.max_open_seconds, self.__open_seconds * 2)
+        elif self.__failures < self.failure_threshold or self.__open_until is not None:
+            return
+        self.__probing = False
+        self.__open_until = time.monotonic() + self.__open_seconds
+        log.warning(f'{self.endpoint} 連續發生錯誤，斷路器開啟 {self.__open_seconds:.0f} 秒')
+
+    def neutral(self) -> None:
+        """請求結束但無法判斷上游狀態(例如被取消)，讓下一個請求繼續試探"""
+        self.__probing = False
+
+class UpstreamThrottle:
+    """所有HoYoLAB請求的共用入口：全域token bucket + 每個endpoint的斷路器
+    互動指令優先取得token且最多等待interactive_max_wait秒，超過時直接回覆使用者稍後再試；
+    排程工作排在互動指令之後，遇到斷路器開啟時等待關閉而不是失敗
+    """
+    def __init__(self, rate: float, interactive_max_wait: float = 10.0) -> None:
+        self.bucket = PriorityTokenBucket(rate)
+        self.interactive_max_wait = interactive_max_wait
+        self.__breakers: Dict[str, CircuitBreaker] = { }
+        UPSTREAM_RATE.setFunction(lambda: self.bucket.rate)
+
+    @property
+    def pressure(self) -> float:
+        return self.bucket.pressure
+
+    async def call(self, endpoint: str, awaitable: Awaitable[Any]) -> Any:
+        """等待限速與斷路器後送出請求，並記錄metrics
+        :param endpoint: API名稱，例如 'notes'、'diary'
+        :param awaitable: genshin client的請求，被拒絕時會關閉而不會送出
+        """
+        priority = upstream_priority.get()
+        breaker = self.__breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.__breakers[endpoint] = CircuitBreaker(endpoint)
+        start = time.monotonic()
+        try:
+            await self.__waitBreaker(endpoint, breaker, priority)
+            remaining = self.interactive_max_wait - (time.monotonic() - start) if priority == INTERACTIVE else None
+            try:
+                await self.bucket.acquire(priority, remaining)
+            except asyncio.TimeoutError:
+                UPSTREAM_THROTTLE_REJECTED.inc(endpoint, 'queue_timeout')
+                raise UpstreamThrottled()
+            # 排隊期間其他請求可能讓斷路器開啟
+            await self.__waitBreaker(endpoint, breaker, priority)
+        except BaseException:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise
+        UPSTREAM_THROTTLE_WAIT.observe(time.monotonic() - start, 'interactive' if priority == INTERACTIVE else 'bulk')
+        breaker.begin()
+        try:
+            result = await observeUpstream(endpoint, awaitable)
+        except asyncio.CancelledError:
+            breaker.neutral()
+            raise
+        except Exception as e:
+            if isTransientError(e):
+                breaker.failure()
+                self.bucket.penalize()
+            else:
+                # 資料未公開、Cookie無效等錯誤代表上游有正常回應
+                breaker.success()
+            raise
+        breaker.success()
+        self.bucket.reward()
+        return result
+
+    async def __waitBreaker(self, endpoint: str, breaker: CircuitBreaker, priority: int) -> None:
+        while True:
+            retry_after = breaker.retryAfter()
+            if retry_after <= 0:
+                return
+            if priority == INTERACTIVE:
+                UPSTREAM_THROTTLE_REJECTED.inc(endpoint, 'circuit_open')
+                raise UpstreamThrottled()
+            await asyncio.sleep(retry_after)
+
+upstream_throttle = UpstreamThrottle(float(os.getenv('UPSTREAM_RPS', 10)), float(os.getenv('UPSTREAM_INTERACTIVE_MAX_WAIT', 10)))
@@ -0,0 +1,224 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+REGION_OS = 'os'
+REGION_CN = 'cn'
+
+# Cookie已過期，重新設定Cookie前不會再向HoYoLAB送出此角色的請求
+COOKIE_EXPIRED = 'expired'
+
+def regionOf(uid: str) -> str:
+    return REGION_CN if str(uid).startswith('1') else REGION_OS
+
+class GameAccount:
+    """使用者的其他遊戲帳號(Cookie與UID)"""
+    __slots__ = ('cookie', 'uid', 'region', 'status')
+
+    def __init__(self, cookie: str, uid: str, status: str = None) -> None:
+        self.cookie = cookie
+        self.uid = str(uid)
+        self.region = regionOf(self.uid)
+        self.status: Optional[str] = status
+
+    def toDict(self) -> dict:
+        data = {'cookie': self.cookie, 'uid': self.uid}
+        if self.status is not None:
+            data['status'] = self.status
+        return data
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'GameAccount':
+        return cls(data['cookie'], data['uid'], data.get('status'))
+
+class UserRecord:
+    """單一使用者的資料，使用__slots__節省大量使用者時每筆資料的記憶體
+    cookie與uid為主要角色(深淵、札記、兌換碼指令使用)，其他角色保存在extra_accounts；
+    即時便箋、樹脂提醒、自動簽到與自動兌換涵蓋accounts中的全部角色
+    """
+    __slots__ = ('cookie', '__uid', 'region', 'status', 'extra_accounts')
+
+    def __init__(self, cookie: str = None, uid: str = None) -> None:
+        self.cookie: Optional[str] = cookie
+        self.__uid: Optional[str] = None
+        # 'cn' 為國服，'os' 為國際服，設定UID時由UID開頭決定，之後不需要再判斷
+        self.region: Optional[str] = None
+        self.uid = uid
+        # 主要角色Cookie的狀態，None為正常
+        self.status: Optional[str] = None
+        # 大部分使用者只有一個角色，共用空的tuple不額外佔用記憶體
+        self.extra_accounts: Tuple[GameAccount, ...] = ()
+
+    @property
+    def uid(self) -> Optional[str]:
+        return self.__uid
+
+    @uid.setter
+    def uid(self, uid: Optional[str]) -> None:
+        self.__uid = str(uid) if uid is not None else None
+        self.region = regionOf(self.__uid) if self.__uid is not None else None
+
+    @property
+    def accounts(self) -> List[Union['UserRecord', GameAccount]]:
+        """全部已設定UID的角色，主要角色在最前面"""
+        primary = [self] if self.__uid is not None and self.cookie is not None else []
+        return primary + list(self.extra_accounts)
+
+    @property
+    def active_accounts(self) -> List[Union['UserRecord', GameAccount]]:
+        """Cookie沒有過期的角色"""
+        return [account for account in self.accounts if account.status != COOKIE_EXPIRED]
+
+    def getAccount(self, uid: str = None) -> Optional[Union['UserRecord', GameAccount]]:
+        """取得指定UID的角色，uid為None時取得主要角色"""
+        if uid is None or str(uid) == self.__uid:
+            return self
+        return next((account for account in self.extra_accounts if account.uid == str(uid)), None)
+
+    def addAccount(self, cookie: str, uid: str) -> None:
+        """新增角色；還沒有主要角色時設為主要角色，已存在的UID則更新Cookie並清除過期狀態"""
+        uid = str(uid)
+        if self.__uid is None or self.__uid == uid:
+            self.cookie = cookie
+            self.uid = uid
+            self.status = None
+            return
+        self.extra_accounts = tuple(a for a in self.extra_accounts if a.uid != uid) + (GameAccount(cookie, uid),)
+
+    def setPrimary(self, uid: str) -> None:
+        """將指定UID設為主要角色，UID屬於其他角色時與主要角色交換
+        還沒有設定UID的舊資料直接設定主要角色的UID；UID不屬於已保存的任何角色時拋出ValueError，避免蓋掉原本的主要角色
+        """
+        uid = str(uid)
+        if self.__uid is None:
+            self.uid = uid
+            return
+        account = self.getAccount(uid)
+        if account is None:
+            raise ValueError(f'UID {uid} is not one of the saved accounts')
+        if account is self:
+            return
+        others = [a for a in self.extra_accounts if a is not account]
+        if self.__uid is not None and self.cookie is not None:
+            others.insert(0, GameAccount(self.cookie, self.__uid, self.status))
+        self.cookie = account.cookie
+        self.uid = account.uid
+        self.status = account.status
+        self.extra_accounts = tuple(others)
+
+    def toDict(self) -> dict:
+        """轉換成儲存後端使用的格式"""
+        data = { }
+        if self.cookie is not None:
+            data['cookie'] = self.cookie
+        if self.uid is not None:
+            data['uid'] = self.uid
+        if self.status is not None:
+            data['status'] = self.status
+        if len(self.extra_accounts) > 0:
+            data['accounts'] = [account.toDict() for account in self.extra_accounts]
+        return data
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'UserRecord':
+        record = cls(data.get('cookie'), data.get('uid'))
+        record.status = data.get('status')
+        if data.get('accounts'):
+            record.extra_accounts = tuple(GameAccount.fromDict(a) for a in data['accounts'])
+        return record
+
+class UserRegistry:
+    """以整數Discord ID為key保存所有使用者資料，並維護UID到使用者的索引"""
+    def __init__(self) -> None:
+        self.__users: Dict[int, UserRecord] = { }
+        # 絕大多數UID只屬於一位使用者，使用tuple比set省下許多記憶體
+        self.__uid_index: Dict[str, Tuple[int, ...]] = { }
+
+    @classmethod
+    def fromDict(cls, data: Dict[str, dict]) -> 'UserRegistry':
+        """由儲存後端讀取的資料({Discord ID字串: 使用者資料})建立"""
+        registry = cls()
+        for user_id, user_data in data.items():
+            registry.set(user_id, UserRecord.fromDict(user_data))
+        return registry
+
+    def get(self, user_id: Union[int, str]) -> Optional[UserRecord]:
+        """取得使用者資料，ID不是數字(例如指令參數輸入錯誤)時視為找不到使用者"""
+        user_id = self.__key(user_id)
+        return self.__users.get(user_id) if user_id is not None else None
+
+    def set(self, user_id: Union[int, str], record: UserRecord) -> None:
+        """新增或取代使用者資料"""
+        user_id = int(user_id)
+        self.pop(user_id)
+        self.__users[user_id] = record
+        self.__indexRecord(user_id, record)
+
+    def pop(self, user_id: Union[int, str]) -> Optional[UserRecord]:
+        """移除使用者資料，回傳被移除的資料"""
+        user_id = self.__key(user_id)
+        if user_id is None:
+            return None
+        record = self.__users.pop(user_id, None)
+        if record is not None:
+            self.__unindexRecord(user_id, record)
+        return record
+
+    def setUID(self, user_id: Union[int, str], uid: str) -> None:
+        """將UID設為使用者的主要角色並同步索引，使用者不存在時拋出KeyError，UID不屬於使用者的角色時拋出ValueError"""
+        user_id = int(user_id)
+        record = self.__users[user_id]
+        self.__unindexRecord(user_id, record)
+        try:
+            record.setPrimary(uid)
+        finally:
+            self.__indexRecord(user_id, record)
+
+    def addAccount(self, user_id: Union[int, str], cookie: str, uid: str) -> None:
+        """為使用者新增角色並同步索引，使用者不存在時拋出KeyError"""
+        user_id = int(user_id)
+        record = self.__users[user_id]
+        self.__unindexRecord(user_id, record)
+        record.addAccount(cookie, uid)
+        self.__indexRecord(user_id, record)
+
+    def findByUID(self, uid: str) -> Set[int]:
+        """找出保存了此UID的所有使用者"""
+        return set(self.__uid_index.get(str(uid), ()))
+
+    @staticmethod
+    def __key(user_id: Union[int, str]) -> Optional[int]:
+        try:
+            return int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+    def __indexRecord(self, user_id: int, record: UserRecord) -> None:
+        self.__index(user_id, record.uid)
+        for account in record.extra_accounts:
+            self.__index(user_id, account.uid)
+
+    def __unindexRecord(self, user_id: int, record: UserRecord) -> None:
+        self.__unindex(user_id, record.uid)
+        for account in record.extra_accounts:
+            self.__unindex(user_id, account.uid)
+
+    def __index(self, user_id: int, uid: Optional[str]) -> None:
+        if uid is not None and user_id not in self.__uid_index.get(uid, ()):
+            self.__uid_index[uid] = self.__uid_index.get(uid, ()) + (user_id,)
+
+    def __unindex(self, user_id: int, uid: Optional[str]) -> None:
+        if uid is None:
+            return
+        users = tuple(u for u in self.__uid_index.get(uid, ()) if u != user_id)
+        if len(users) > 0:
+            self.__uid_index[uid] = users
+        else:
+            self.__uid_index.pop(uid, None)
+
+    def __contains__(self, user_id: Union[int, str]) -> bool:
+        return self.__key(user_id) in self.__users
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.__users)
+
+    def __len__(self) -> int:
+        return len(self.__users)
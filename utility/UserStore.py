@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from .utils import log
+from .Metrics import USER_STORE_WRITE_SECONDS
+
+class UserStore(ABC):
+    """使用者資料儲存後端的基底類別
+    所有讀寫都在單一背景執行緒中依序執行，寫入時不會阻塞event loop，同一使用者的寫入順序也不會錯亂
+    """
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+
+    def load(self) -> Dict[str, dict]:
+        """讀取全部使用者資料，只在啟動時呼叫一次"""
+        return self._executor.submit(self._load).result()
+
+    def upsert(self, user_id: str, data: dict) -> Optional[asyncio.Future]:
+        """新增或更新單一使用者的資料
+        :param user_id: 使用者Discord ID
+        :param data: 使用者資料，呼叫當下就會序列化，之後再修改不影響寫入內容
+        """
+        return self._submit(self._upsert, str(user_id), json.dumps(data))
+
+    def delete(self, user_id: str) -> Optional[asyncio.Future]:
+        """刪除單一使用者的資料
+        :param user_id: 使用者Discord ID
+        """
+        return self._submit(self._delete, str(user_id))
+
+    async def reloadIfChanged(self) -> Optional[Dict[str, dict]]:
+        """若其他process修改過資料，重新讀取全部使用者資料；沒有變動或不支援時回傳None"""
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._reloadIfChanged)
+
+    def close(self) -> None:
+        """等待所有寫入完成後關閉儲存後端"""
+        self._executor.submit(self._run, self._close)
+        self._executor.shutdown(wait=True)
+
+    def _submit(self, func, *args) -> Optional[asyncio.Future]:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._executor.submit(self._run, func, *args).result()
+            return None
+        return loop.run_in_executor(self._executor, self._run, func, *args)
+
+    def _run(self, func, *args) -> None:
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as e:
+            log.error(f'{type(self).__name__}.{func.__name__}: {e}')
+        finally:
+            USER_STORE_WRITE_SECONDS.observe(time.perf_counter() - start, type(self).__name__, func.__name__.strip('_'))
+
+    @abstractmethod
+    def _load(self) -> Dict[str, dict]:
+        pass
+
+    @abstractmethod
+    def _upsert(self, user_id: str, payload: str) -> None:
+        pass
+
+    @abstractmethod
+    def _delete(self, user_id: str) -> None:
+        pass
+
+    def _reloadIfChanged(self) -> Optional[Dict[str, dict]]:
+        return None
+
+    def _close(self) -> None:
+        pass
+
+class JsonUserStore(UserStore):
+    """將全部使用者資料存成單一JSON檔案(舊版格式)，每次寫入先寫暫存檔再取代原檔案，避免寫到一半損毀"""
+    def __init__(self, filename: str, sqlite_filename: str = None) -> None:
+        """
+        :param sqlite_filename: 從SQLite改回JSON時匯入資料的SQLite資料庫
+        """
+        super().__init__()
+        self.__filename = filename
+        self.__sqlite_filename = sqlite_filename
+        self.__data: Dict[str, dict] = { }
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.__filename, 'r', encoding='utf-8') as f:
+                self.__data = json.load(f)
+        except FileNotFoundError:
+            self.__data = self.__loadBackup()
+        return json.loads(json.dumps(self.__data))
+
+    def __loadBackup(self) -> Dict[str, dict]:
+        """從SQLite改回JSON時JSON檔案已不存在(匯入SQLite時改名為.bak)，
+        優先從SQLite資料庫讀取最新的資料並將資料庫改名為.bak，沒有資料庫時從JSON的.bak讀取，讀取後寫回JSON檔案
+        """
+        data: Optional[Dict[str, dict]] = None
+        source = self.__sqlite_filename
+        if source is not None and os.path.exists(source):
+            conn = sqlite3.connect(source)
+            try:
+                data = {user_id: json.loads(row) for user_id, row in conn.execute('SELECT user_id, data FROM users')}
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                log.error(f'讀取 {source} 失敗: {e}')
+            finally:
+                conn.close()
+        if data is None and os.path.exists(self.__filename + '.bak'):
+            source = self.__filename + '.bak'
+            with open(source, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        if data is None:
+            return { }
+        self.__data = data
+        self.__dump()
+        if source == self.__sqlite_filename:
+            # 與匯入SQLite時相同，舊的資料庫改名為.bak保留，之後再改回SQLite時會重新從JSON匯入
+            os.replace(source, source + '.bak')
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(source + suffix):
+                    os.remove(source + suffix)
+        log.warning(f'找不到 {self.__filename}，已從 {source} 匯入 {len(data)} 筆使用者資料')
+        return data
+
+    def _upsert(self, user_id: str, payload: str) -> None:
+        self.__data[user_id] = json.loads(payload)
+        self.__dump()
+
+    def _delete(self, user_id: str) -> None:
+        if self.__data.pop(user_id, None) is not None:
+            self.__dump()
+
+    def __dump(self) -> None:
+        tmp_filename = self.__filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            json.dump(self.__data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.__filename)
+
+class SQLiteUserStore(UserStore):
+    """以SQLite(WAL模式)保存使用者資料，每位使用者一列，更新時只寫入該使用者"""
+    def __init__(self, filename: str, legacy_json_filename: str = None) -> None:
+        super().__init__()
+        self.__filename = filename
+        self.__legacy_json_filename = legacy_json_filename
+        self.__conn: Optional[sqlite3.Connection] = None
+        self.__data_version: Optional[int] = None
+
+    def _load(self) -> Dict[str, dict]:
+        self.__conn = sqlite3.connect(self.__filename, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        self.__conn.execute('CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+        self.__conn.commit()
+        self.__migrateFromJson()
+        return self.__loadAll()
+
+    def _reloadIfChanged(self) -> Optional[Dict[str, dict]]:
+        # data_version只有在其他連線(其他process)寫入後才會改變
+        if self.__conn.execute('PRAGMA data_version').fetchone()[0] == self.__data_version:
+            return None
+        return self.__loadAll()
+
+    def __loadAll(self) -> Dict[str, dict]:
+        self.__data_version = self.__conn.execute('PRAGMA data_version').fetchone()[0]
+        return {user_id: json.loads(data) for user_id, data in self.__conn.execute('SELECT user_id, data FROM users')}
+
+    def _upsert(self, user_id: str, payload: str) -> None:
+        with self.__conn:
+            self.__conn.execute(
+                'INSERT INTO users (user_id, data) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET data=excluded.data',
+                (user_id, payload)
+            )
+
+    def _delete(self, user_id: str) -> None:
+        with self.__conn:
+            self.__conn.execute('DELETE FROM users WHERE user_id=?', (user_id,))
+
+    def _close(self) -> None:
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+
+    def __migrateFromJson(self) -> None:
+        """資料庫為空且存在舊版JSON檔案時，將JSON資料一次匯入，並把舊檔案改名為.bak保留"""
+        filename = self.__legacy_json_filename
+        if filename is None or os.path.exists(filename) == False:
+            return
+        if self.__conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] > 0:
+            return
+        with open(filename, 'r', encoding='utf-8') as f:
+            legacy_data: Dict[str, dict] = json.load(f)
+        with self.__conn:
+            self.__conn.executemany(
+                'INSERT INTO users (user_id, data) VALUES (?, ?)',
+                ((str(user_id), json.dumps(data)) for user_id, data in legacy_data.items())
+            )
+        os.replace(filename, filename + '.bak')
+        log.info(f'已從 {filename} 匯入 {len(legacy_data)} 筆使用者資料')
+
+def createUserStore() -> UserStore:
+    """依照環境變數USER_STORE(sqlite|json)建立使用者資料儲存後端，預設為sqlite"""
+    backend = os.getenv('USER_STORE', 'sqlite').lower()
+    if backend == 'json':
+        return JsonUserStore('data/user_data.json', sqlite_filename='data/user_data.db')
+    return SQLiteUserStore('data/user_data.db', legacy_json_filename='data/user_data.json')
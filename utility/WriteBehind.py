@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import atexit
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from .utils import log
+from .Metrics import USER_STORE_WRITE_SECONDS
+try:
+    import fcntl
+except ImportError:
+    # Windows沒有fcntl，只支援單一process寫入
+    fcntl = None
+
+class WriteBehindJsonFile:
+    """延遲寫入的JSON檔案：資料修改後只標記為dirty，在delay秒後於背景執行緒一次寫入，
+    期間的多次修改會合併成一次寫入；寫入時先寫暫存檔再取代原檔案，避免寫到一半損毀
+    """
+    def __init__(self, filename: str, data: dict, *, delay: float = 5.0, merge: Callable[[dict, str], dict] = None) -> None:
+        """
+        :param filename: 檔案路徑
+        :param data: 要保存的dict，之後直接修改這個dict再呼叫markDirty()
+        :param delay: 標記dirty後等待多少秒才寫入
+        :param merge: 寫入前在背景執行緒呼叫merge(資料, 檔案路徑)，回傳實際要寫入的資料；
+            多個process共用檔案時使用，讀取、合併到寫入完成期間持有檔案鎖，避免同時寫入時蓋掉其他process的修改
+        """
+        self.filename = filename
+        self.data = data
+        self.__delay = delay
+        self.__merge = merge
+        self.__dirty = False
+        self.__hold = 0
+        self.__timer: Optional[asyncio.TimerHandle] = None
+        self.__write_lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='WriteBehindJsonFile')
+        # 程式結束時把還沒寫入的修改寫入檔案
+        atexit.register(self.flushSync)
+
+    @property
+    def dirty(self) -> bool:
+        return self.__dirty
+
+    def markDirty(self) -> None:
+        """標記資料已修改，沒有執行中的event loop時立即寫入"""
+        self.__dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flushSync()
+            return
+        if self.__hold > 0 or self.__timer is not None:
+            return
+        self.__timer = loop.call_later(self.__delay, lambda: asyncio.ensure_future(self.flush()))
+
+    @contextmanager
+    def batch(self):
+        """區塊內的修改不會觸發寫入，離開區塊後合併成一次寫入"""
+        self.__hold += 1
+        try:
+            yield self
+        finally:
+            self.__hold -= 1
+            if self.__hold == 0 and self.__dirty:
+                self.markDirty()
+
+    async def flush(self) -> None:
+        """立即在背景執行緒寫入目前的資料"""
+        self.__cancelTimer()
+        if self.__dirty == False:
+            return
+        self.__dirty = False
+        # 在event loop上序列化，確保寫入的是這個時間點的完整內容
+        payload = json.dumps(self.data)
+        await asyncio.get_running_loop().run_in_executor(self.__executor, self.__write, payload)
+
+    def flushSync(self) -> None:
+        """在目前的執行緒寫入目前的資料，用於關閉時"""
+        self.__cancelTimer()
+        if self.__dirty == False:
+            return
+        self.__dirty = False
+        self.__write(json.dumps(self.data))
+
+    def __cancelTimer(self) -> None:
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+    @contextmanager
+    def __fileLock(self):
+        """需要合併時，以另外的.lock檔案取得跨process的獨佔鎖；檔案本身會被os.replace取代，不能直接鎖定"""
+        if self.__merge is None or fcntl is None:
+            yield
+            return
+        with open(self.filename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __write(self, payload: str) -> None:
+        start = time.perf_counter()
+        try:
+            with self.__write_lock, self.__fileLock():
+                if self.__merge is not None:
+                    payload = json.dumps(self.__merge(json.loads(payload), self.filename))
+                tmp_filename = self.filename + '.tmp'
+                with open(tmp_filename, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_filename, self.filename)
+        except Exception as e:
+            # 寫入失敗時重新標記，下次修改或關閉時再試一次
+            self.__dirty = True
+            log.error(f'WriteBehindJsonFile({self.filename}): {e}')
+        finally:
+            USER_STORE_WRITE_SECONDS.observe(time.perf_counter() - start, type(self).__name__, os.path.basename(self.filename))
@@ -1,18 +1,15 @@
 import logging
+import asyncio
+import aiohttp
 import genshin
 import re
+import atexit
 from data.character_names import character_names
+from .LogPipeline import setupLogging
 
-__file_handler = logging.FileHandler('data/error.log', encoding='utf-8')
-__file_handler.setLevel(logging.WARNING)
-__console_handler = logging.StreamHandler()
-__console_handler.setLevel(logging.INFO)
-__formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s', '%Y-%m-%d %H:%M:%S')
-__file_handler.setFormatter(__formatter)
-__console_handler.setFormatter(__formatter)
-logging.getLogger().setLevel(logging.INFO)
-logging.getLogger().addHandler(__file_handler)
-logging.getLogger().addHandler(__console_handler)
+# 所有log先放入佇列，由背景執行緒寫入data/error.log(JSON、自動輪替)與終端機，不阻塞event loop
+__log_listener = setupLogging('data/error.log')
+atexit.register(__log_listener.stop)
 log = logging
 
 def getCharacterName(character: genshin.models.BaseCharacter) -> str:
@@ -29,4 +26,10 @@ def trimCookie(cookie: str) -> str:
         ])
     except:
         new_cookie = None
-    return new_cookie
\ No newline at end of file
+    return new_cookie
+
+def isTransientError(e: Exception) -> bool:
+    """判斷錯誤是否為暫時性(請求過於頻繁、連線失敗或逾時)，可以稍後重試"""
+    if isinstance(e, (genshin.errors.VisitsTooFrequently, aiohttp.ClientError, asyncio.TimeoutError)):
+        return True
+    return isinstance(e, genshin.errors.GenshinException) and e.retcode == -1